@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+from fastapi import Body, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+import drift
+import explanations
+import feature_schema
+import model_registry
+import shadow
+import telemetry
+from batch_scoring import predict_frame
+from calibration import decide, get_calibration, summary
+from fast_scorer import get_predictor
+from microbatch import batcher_stats, get_batcher
+from prediction_cache import get_cache
+
+# Headless prediction service over the same Saved models/ artifacts as the
+# Streamlit app. Every worker process loads the models once at startup and
+# only reports ready after all of them have been loaded and used once.
+_ready = False
+
+
+# Load every model and run one prediction through it, so the first real
+# request does not pay for lazy imports or initialisation
+def warm_models():
+    global _ready
+    for name, artifact in model_registry.ARTIFACTS.items():
+        model = get_predictor(name)
+        zeros = pd.DataFrame([[0.0] * len(artifact['features'])], columns=artifact['features'])
+        predict_frame(model, zeros, artifact['features'], get_calibration(name))
+    _ready = True
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(warm_models)
+    yield
+
+
+app = FastAPI(title='Patient Sickness Prediction API', lifespan=lifespan)
+
+
+# Score a list of records, answering repeated patients from the prediction
+# cache and scoring the rest with one vectorized call. The whole list is
+# validated against the feature schema in one pass first.
+# Lists routed to a canary candidate bypass the cache, which only holds the
+# primary model's answers.
+def score_records(name, records):
+    frame = feature_schema.validate(name, records)
+    drift.observe(name, frame)
+    role = shadow.route(name)
+    cache = get_cache() if role == 'primary' else None
+    results = [cache.get(name, record) if cache else None for record in records]
+    missing = [index for index, result in enumerate(results) if result is None]
+    telemetry.increment('predictions', len(records) - len(missing), model=name, source='cache')
+    telemetry.increment('predictions', len(missing), model=name, source='model')
+    if missing:
+        predictions, probabilities = shadow.score(name, frame.iloc[missing], role)
+        for index, prediction, probability in zip(missing, predictions, probabilities):
+            results[index] = (int(prediction), float(probability))
+            if cache:
+                cache.set(name, records[index], results[index])
+    return [{'prediction': prediction, 'probability': probability} for prediction, probability in results]
+
+
+# Per-feature contributions for each validated row, added to the results
+def add_explanations(name, frame, results):
+    explanation = explanations.explain(name, frame)
+    for row, result in enumerate(results):
+        result['contributions'] = explanations.contributions_dict(explanation, row)
+    return {'method': explanation['method'], 'units': explanation['units'],
+            'base_value': explanation['base_value']}
+
+
+# Relabel predictions with the threshold of a calibrated operating point
+def apply_operating_point(name, results, operating_point):
+    predictions = decide(get_calibration(name), [result['probability'] for result in results], operating_point)
+    for result, prediction in zip(results, predictions):
+        result['prediction'] = int(prediction)
+
+
+# Accepts one patient as a {feature: value} object, or a list of them for a
+# batch. Single patients are micro-batched with other concurrent requests;
+# lists are scored in the thread pool. Either way the event loop keeps serving.
+# Probabilities are calibrated risks when the model has a calibration. With
+# ?operating_point=recall_90 (see GET /calibration/{disease}) predictions use
+# that threshold; with ?explain=true every prediction carries its feature
+# contributions.
+@app.post('/predict/{disease}')
+async def predict(disease: str,
+                  payload: Union[Dict[str, float], List[Dict[str, float]]] = Body(...),
+                  explain: bool = False, operating_point: Optional[str] = None):
+    if disease not in model_registry.ARTIFACTS:
+        raise HTTPException(status_code=404, detail=f'Unknown model: {disease}')
+    telemetry.increment('prediction_requests', model=disease)
+    try:
+        if operating_point:
+            decide(get_calibration(disease), [], operating_point)
+        if isinstance(payload, list):
+            results = await run_in_threadpool(score_records, disease, payload) if payload else []
+            if operating_point:
+                apply_operating_point(disease, results, operating_point)
+            response = {'model': disease, 'predictions': results}
+            if explain and payload:
+                frame = feature_schema.validate(disease, payload)
+                response['explanation'] = await run_in_threadpool(add_explanations, disease, frame, results)
+            return response
+        frame = feature_schema.validate(disease, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    drift.observe(disease, frame)
+
+    if shadow.route(disease) == 'candidate':
+        telemetry.increment('predictions', model=disease, source='model')
+        predictions, probabilities = await run_in_threadpool(shadow.score, disease, frame, 'candidate')
+        prediction, probability = int(predictions[0]), float(probabilities[0])
+    else:
+        payload = frame.iloc[0].to_dict()
+        cache = get_cache()
+        cached = await run_in_threadpool(cache.get, disease, payload) if cache else None
+        telemetry.increment('predictions', model=disease, source='model' if cached is None else 'cache')
+        if cached is not None:
+            prediction, probability = cached
+        else:
+            prediction, probability = await asyncio.wrap_future(get_batcher(disease).submit(payload))
+            if cache:
+                await run_in_threadpool(cache.set, disease, payload, (prediction, probability))
+
+    response = {'model': disease, 'prediction': prediction, 'probability': probability}
+    if operating_point:
+        apply_operating_point(disease, [response], operating_point)
+    if explain:
+        response['explanation'] = await run_in_threadpool(add_explanations, disease, frame, [response])
+    return response
+
+
+# One patient (or a list of them) with the union of every model's features;
+# each model with a complete feature set is scored, all models concurrently
+@app.post('/screen')
+async def screen(payload: Union[Dict[str, float], List[Dict[str, float]]] = Body(...)):
+    import screening
+
+    try:
+        if isinstance(payload, list):
+            if not payload:
+                return {'patients': []}
+            report = await run_in_threadpool(screening.screen_frame, pd.DataFrame.from_records(payload))
+            return {'patients': report.to_dict(orient='records')}
+        return await run_in_threadpool(screening.screen_patient, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.get('/health')
+async def health():
+    return {'status': 'ok', 'ready': _ready}
+
+
+@app.get('/ready')
+async def ready():
+    if not _ready:
+        return JSONResponse({'ready': False}, status_code=503)
+    return {'ready': True, 'models': sorted(model_registry.ARTIFACTS)}
+
+
+# Hit/miss counters of the prediction cache
+@app.get('/stats/cache')
+async def cache_stats():
+    cache = get_cache()
+    return cache.stats() if cache else {'backend': None}
+
+
+# Queue depth, batch sizes and latency of the micro-batching schedulers
+@app.get('/stats/batching')
+async def batching_stats():
+    return batcher_stats()
+
+
+# Per-version latency, memory, test accuracy and disagreement of the served
+# and candidate models, as seen by this worker
+@app.get('/stats/shadow')
+async def shadow_stats():
+    return await run_in_threadpool(shadow.shadow_stats)
+
+
+# Calibration method, operating points and test Brier scores of a model
+@app.get('/calibration/{disease}')
+async def calibration_summary(disease: str):
+    if disease not in model_registry.ARTIFACTS:
+        raise HTTPException(status_code=404, detail=f'Unknown model: {disease}')
+    calibration = get_calibration(disease)
+    if calibration is None:
+        raise HTTPException(status_code=404, detail=f'{disease} has no calibration for its current version')
+    return summary(calibration)
+
+
+# Input drift of every model against its training data, as seen by this
+# worker: the current window, the last periodic check and recent alerts
+@app.get('/stats/drift')
+async def drift_stats():
+    return await run_in_threadpool(drift.drift_stats)
+
+
+# Spans, counters and memory gauges in the Prometheus text format. Each
+# worker process keeps its own metrics.
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    return telemetry.prometheus_text()
+
+
+# Serve with several worker processes to use every core:
+#   python api.py --workers 4 --port 8000
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Run the prediction API.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    uvicorn.run('api:app', host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import json
+import time
+
+import pandas as pd
+
+import feature_schema
+import model_registry
+from calibration import calibrate, decide, get_calibration, label
+from fast_scorer import get_predictor
+
+DEFAULT_CHUNKSIZE = 10_000
+
+
+# Raise if the CSV does not carry every feature column the model needs.
+# Extra columns (patient ids etc.) are allowed and passed through.
+def validate_columns(name, columns):
+    features = model_registry.ARTIFACTS[name]['features']
+    missing = [feature for feature in features if feature not in columns]
+    if missing:
+        raise ValueError(f"CSV is missing {name} feature columns: {', '.join(missing)}")
+    return features
+
+
+# Columns of the scored CSV for an input with the given columns: the input
+# columns, then prediction and probability (and contributions) unless the
+# input already has them, in which case they are overwritten in place
+def output_columns(name, columns, explain=False):
+    added = ['prediction', 'probability']
+    if explain:
+        added += [f'{feature}_contribution' for feature in model_registry.ARTIFACTS[name]['features']]
+    return list(columns) + [column for column in added if column not in columns]
+
+
+# Header of a CSV path or file object; a file object is put back where it was
+def read_header(source):
+    position = source.tell() if hasattr(source, 'seek') else None
+    columns = list(pd.read_csv(source, nrows=0, encoding='utf-8-sig').columns)
+    if position is not None:
+        source.seek(position)
+    return columns
+
+
+# Predicted class and positive-class probability for every row of frame,
+# with a single vectorized predict and predict_proba call. With the model's
+# calibration (see calibration.py) the probabilities are calibrated risks and
+# the classes follow from them with one predict_proba call.
+def predict_frame(model, frame, features, calibration=None):
+    X = model_registry.model_input(model, frame[features].astype(float))
+    if calibration is None:
+        return model.predict(X), model.predict_proba(X)[:, 1]
+    probabilities = calibrate(calibration, model.predict_proba(X)[:, 1])
+    return label(calibration, probabilities, model.classes_), probabilities
+
+
+# Validate a chunk against the model's feature schema (ValueError names the
+# bad rows) and append the prediction and probability columns, and with
+# explain a '<feature>_contribution' column per feature (see explanations.py).
+# With an operating point (e.g. 'recall_90') the predictions use its
+# threshold on the calibrated probability instead of the model's own rule.
+def score_chunk(name, model, chunk, explain=False, operating_point=None):
+    features = model_registry.ARTIFACTS[name]['features']
+    frame = feature_schema.validate(name, chunk)
+    scored = chunk.copy()
+    calibration = get_calibration(name)
+    scored['prediction'], scored['probability'] = predict_frame(model, frame, features, calibration)
+    if operating_point:
+        scored['prediction'] = decide(calibration, scored['probability'], operating_point)
+    if explain:
+        import explanations
+
+        contributions = explanations.explain(name, frame)['contributions']
+        for index, feature in enumerate(features):
+            scored[f'{feature}_contribution'] = contributions[:, index]
+    return scored
+
+
+# Stream source through the model chunk by chunk, appending each scored chunk
+# to destination as soon as it is ready, so memory stays bounded by the
+# chunk size rather than the file size. source and destination may be paths
+# or file objects. The header is checked and written first, so a file
+# without rows still fails on missing columns or gets a scored header.
+def score_csv(name, source, destination, chunksize=DEFAULT_CHUNKSIZE, progress=None, explain=False,
+              operating_point=None):
+    model = get_predictor(name)
+    if operating_point:
+        # Fail before anything is read or written
+        decide(get_calibration(name), [], operating_point)
+    start = time.perf_counter()
+    rows = 0
+    columns = read_header(source)
+    validate_columns(name, columns)
+    pd.DataFrame(columns=output_columns(name, columns, explain)).to_csv(destination, index=False)
+
+    for chunk in pd.read_csv(source, chunksize=chunksize, encoding='utf-8-sig'):
+        if chunk.empty:
+            continue
+        scored = score_chunk(name, model, chunk, explain, operating_point)
+        scored.to_csv(destination, mode='a', header=False, index=False)
+        rows += len(scored)
+        if progress is not None:
+            progress(rows)
+
+    seconds = time.perf_counter() - start
+    return {
+        'model': name,
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds, 1) if seconds else 0.0,
+    }
+
+
+# Headless bulk scoring:
+#   python batch_scoring.py diabetes patients.csv scored.csv --chunksize 50000
+def main():
+    parser = argparse.ArgumentParser(description='Score a CSV of patients with a disease model.')
+    parser.add_argument('model', choices=sorted(model_registry.ARTIFACTS))
+    parser.add_argument('input', help='CSV in the same column layout as Datasets/<model>.csv')
+    parser.add_argument('output', help='CSV to write, with prediction and probability columns added')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--explain', action='store_true', help='add a <feature>_contribution column per feature')
+    parser.add_argument('--operating-point', help='predict with a calibrated threshold, e.g. recall_90 '
+                                                  '(see python calibration.py)')
+    args = parser.parse_args()
+
+    try:
+        summary = score_csv(args.model, args.input, args.output, args.chunksize, explain=args.explain,
+                            operating_point=args.operating_point)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
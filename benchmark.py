@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import dataset_cache
+import model_registry
+from batch_scoring import predict_frame
+from calibration import get_calibration
+from fast_scorer import get_predictor
+
+# Benchmarks for the paths that decide how the app and API feel: importing
+# the libraries, loading each model from Saved models/, scoring one patient
+# and scoring batches. Results are a flat {metric: value} dict so two runs
+# can be compared key by key; comparing against the stored baseline exits
+# non-zero when any metric is worse by more than its tolerance. Timings on
+# a shared host drift by tens of percent from run to run, so a metric only
+# counts as regressed if it is still worse after re-measuring (--attempts),
+# comparing the best value seen; noisy metrics have wider tolerances.
+#
+#   python benchmark.py                    run and compare with the baseline
+#   python benchmark.py --save-baseline    run --attempts times and store the medians as the baseline
+#   python benchmark.py --output run.json  also write the results to a file
+
+BASELINE_PATH = os.path.join(model_registry.base_dir, 'benchmark_baseline.json')
+BATCH_SIZES = (16, 256, 4096)
+DEFAULT_TOLERANCE = 0.5
+DEFAULT_ATTEMPTS = 3
+# Tolerances by metric suffix, overriding the default: small batches are
+# dominated by per-call overhead and jitter, and the p99 of a few hundred
+# single-row calls is one or two samples, so it is reported but not gated
+# (None)
+METRIC_TOLERANCES = {
+    '.batch_16.rows_per_second': 1.0,
+    '.single_row.p99_ms': None,
+}
+
+# Run in a fresh interpreter so imports and unpickling are really cold
+_COLD_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import numpy, pandas, sklearn.ensemble, sklearn.neighbors, sklearn.pipeline, sklearn.svm
+import dataset_cache
+import model_registry
+result = {'import': time.perf_counter() - start}
+for name in sys.argv[1:]:
+    start = time.perf_counter()
+    model_registry.load_artifact(model_registry.model_path(name))
+    result[name] = time.perf_counter() - start
+print(json.dumps(result))
+'''
+
+
+# Patients drawn column by column from the dataset's own values with a little
+# noise, so they look like real inputs without repeating dataset rows
+def synthesize_rows(name, rows, seed=0):
+    features = model_registry.ARTIFACTS[name]['features']
+    data = dataset_cache.load_columns(name)
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for feature in features:
+        values = data[feature].astype(np.float64)
+        sample = rng.choice(values, rows) + rng.normal(0, 0.01 * values.std(), rows)
+        columns[feature] = np.clip(sample, values.min(), values.max())
+    return pd.DataFrame(columns)
+
+
+def cold_start(names, repeat):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _COLD_SCRIPT, *names], check=True,
+                                capture_output=True, text=True, cwd=model_registry.base_dir)
+        runs.append(json.loads(output.stdout))
+    results = {'cold_import_seconds': float(np.median([run['import'] for run in runs]))}
+    for name in names:
+        results[f'{name}.cold_load_seconds'] = float(np.median([run[name] for run in runs]))
+    return results
+
+
+# Latency of scoring one patient at a time the way the app does it, with
+# the model's calibration applied as it is when served
+def single_row(name, model, frame, calibration=None):
+    features = model_registry.ARTIFACTS[name]['features']
+    for index in range(min(10, len(frame))):
+        predict_frame(model, frame.iloc[index:index + 1], features, calibration)
+    latencies = []
+    for index in range(len(frame)):
+        start = time.perf_counter()
+        predict_frame(model, frame.iloc[index:index + 1], features, calibration)
+        latencies.append(time.perf_counter() - start)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        f'{name}.single_row.p50_ms': float(p50),
+        f'{name}.single_row.p95_ms': float(p95),
+        f'{name}.single_row.p99_ms': float(p99),
+    }
+
+
+# Rows per second at each batch size: the median run after repeating for at
+# least min_seconds and min_runs runs
+def batch(name, model, frame, sizes, min_seconds=1.0, calibration=None, min_runs=25):
+    features = model_registry.ARTIFACTS[name]['features']
+    results = {}
+    for size in sizes:
+        rows = frame.iloc[:size]
+        predict_frame(model, rows, features, calibration)
+        timings = []
+        while len(timings) < min_runs or sum(timings) < min_seconds:
+            start = time.perf_counter()
+            predict_frame(model, rows, features, calibration)
+            timings.append(time.perf_counter() - start)
+        results[f'{name}.batch_{size}.rows_per_second'] = len(rows) / float(np.median(timings))
+    return results
+
+
+def run(names, single_rows=200, sizes=BATCH_SIZES, cold_repeat=3):
+    metrics = cold_start(names, cold_repeat)
+    predictors = {}
+    for name in names:
+        model = get_predictor(name)
+        calibration = get_calibration(name)
+        predictors[name] = type(model).__name__
+        frame = synthesize_rows(name, max(single_rows, *sizes))
+        metrics.update(single_row(name, model, frame.iloc[:single_rows], calibration))
+        metrics.update(batch(name, model, frame, sizes, calibration=calibration))
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'libraries': model_registry.library_versions(),
+            'predictors': predictors,
+        },
+        'metrics': {key: round(value, 6) for key, value in metrics.items()},
+    }
+
+
+def _higher_is_better(key):
+    return key.endswith('rows_per_second')
+
+
+def metric_tolerance(key, tolerance=DEFAULT_TOLERANCE):
+    for suffix, value in METRIC_TOLERANCES.items():
+        if key.endswith(suffix):
+            return value
+    return tolerance
+
+
+# The best value of every metric over several runs
+def best_of(*runs):
+    return {key: (max if _higher_is_better(key) else min)(run[key] for run in runs) for key in runs[0]}
+
+
+# The median of every metric over several runs, for a baseline that is not
+# set by one unusually fast or slow run
+def median_of(*runs):
+    return {key: round(float(np.median([run[key] for run in runs])), 6) for key in runs[0]}
+
+
+# Throughput metrics regress when they drop, everything else (times) when it rises
+def compare(metrics, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    for key, value in sorted(metrics.items()):
+        reference = baseline.get(key)
+        if not reference:
+            continue
+        if _higher_is_better(key):
+            change = reference / value - 1 if value else float('inf')
+        else:
+            change = value / reference - 1
+        limit = metric_tolerance(key, tolerance)
+        status = 'info' if limit is None else 'REGRESSION' if change > limit else 'ok'
+        print(f"{status:<10} {key:<45} {reference:>14.4f} -> {value:>14.4f} "
+              f"({abs(change):.1%} {'slower' if change > 0 else 'faster'})")
+        if status == 'REGRESSION':
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark model loading and inference.')
+    parser.add_argument('models', nargs='*', help='default: all models')
+    parser.add_argument('--output', help='write the results JSON to this file')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='store the median of --attempts runs as the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed relative slowdown before a metric counts as a regression')
+    parser.add_argument('--attempts', type=int, default=DEFAULT_ATTEMPTS,
+                        help='runs to compare the best value of before reporting a regression, '
+                             'and runs to take the median of with --save-baseline')
+    parser.add_argument('--rows', type=int, default=200, help='rows timed one at a time')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(BATCH_SIZES))
+    args = parser.parse_args()
+    names = args.models or sorted(model_registry.ARTIFACTS)
+    unknown = set(names) - set(model_registry.ARTIFACTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+
+    results = run(names, args.rows, args.batch_sizes)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        runs = [results['metrics']] + [run(names, args.rows, args.batch_sizes)['metrics']
+                                       for _ in range(args.attempts - 1)]
+        results['metrics'] = median_of(*runs)
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+        return
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save-baseline to create one')
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['environment'] != results['environment']:
+        print('Warning: the baseline was recorded in a different environment')
+    metrics = results['metrics']
+    regressions = compare(metrics, baseline['metrics'], args.tolerance)
+    for attempt in range(2, args.attempts + 1):
+        if not regressions:
+            break
+        print(f'{len(regressions)} metric(s) over tolerance; measuring again ({attempt}/{args.attempts})')
+        metrics = best_of(metrics, run(names, args.rows, args.batch_sizes)['metrics'])
+        regressions = compare(metrics, baseline['metrics'], args.tolerance)
+    if regressions:
+        raise SystemExit(f"{len(regressions)} metric(s) regressed by more than "
+                         f"{args.tolerance:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+import model_registry
+
+logger = logging.getLogger(__name__)
+
+# Calibrated risk for every model, fitted once per model version and stored
+# next to the model as '<model file stem>_calibration.json'. The models' own
+# probabilities (libsvm's internal Platt scaling, KNN vote shares and their
+# soft-voting average) rank patients well but are not calibrated, so:
+#   - out-of-fold probabilities are collected on the training split by
+#     refitting the model's hyperparameters on each fold; the folds are
+#     grouped on a hash of each row's features, so a repeated row never
+#     lands on both sides of a fold
+#   - an isotonic fit (with ISOTONIC_MIN_ROWS distinct rows or more) or a
+#     Platt sigmoid maps them to the observed rate of positives
+#   - the map is stored as a table over GRID evenly spaced raw
+#     probabilities, so calibrating a row is one index computation and one
+#     interpolation, with no extra estimator call
+# Served labels follow the calibrated risk: positive from THRESHOLD up, so a
+# label never contradicts the risk shown next to it. Operating thresholds
+# for the precision and recall targets are picked on the calibrated
+# out-of-fold probabilities and checked on the test split. A threshold that
+# every (or no) out-of-fold patient clears, or that lies within SATURATION
+# of 0 or 1, does not separate patients: it is kept, marked 'saturated', and
+# refused when asked for.
+GRID = 1001
+THRESHOLD = 0.5
+ISOTONIC_MIN_ROWS = 1000
+RECALL_TARGETS = (0.8, 0.9, 0.95)
+PRECISION_TARGETS = (0.8, 0.9)
+SATURATION = 0.01
+
+_calibrations = {}
+_lock = threading.Lock()
+
+
+def calibration_path(name):
+    stem = os.path.splitext(model_registry.ARTIFACTS[name]['model'])[0]
+    return os.path.join(model_registry.models_dir, f'{stem}_calibration.json')
+
+
+# Calibrated probabilities for raw positive-class probabilities; with no
+# calibration the probabilities are returned unchanged
+def calibrate(calibration, probabilities):
+    if calibration is None:
+        return probabilities
+    table = calibration['table']
+    position = np.clip(np.asarray(probabilities, dtype=float), 0.0, 1.0) * (len(table) - 1)
+    index = np.minimum(position.astype(np.intp), len(table) - 2)
+    low = table[index]
+    return low + (position - index) * (table[index + 1] - low)
+
+
+# Class labels for calibrated probabilities at the calibration's default
+# threshold
+def label(calibration, probabilities, classes):
+    return np.asarray(classes)[(np.asarray(probabilities) >= calibration['threshold']).astype(int)]
+
+
+# Names of the operating points that can be used, i.e. reachable and not
+# saturated
+def usable_points(calibration):
+    points = calibration['operating_points'] if calibration is not None else {}
+    return sorted(key for key, point in points.items() if point is not None and not point.get('saturated'))
+
+
+# Class predictions at a named operating point, e.g. 'recall_90'
+def decide(calibration, probabilities, operating_point):
+    points = calibration['operating_points'] if calibration is not None else {}
+    if operating_point not in points:
+        raise ValueError(f"Unknown operating point '{operating_point}'; "
+                         f"available: {', '.join(usable_points(calibration)) or 'none (model not calibrated)'}")
+    if points[operating_point] is None:
+        raise ValueError(f"Operating point '{operating_point}' is not reachable for this model")
+    if points[operating_point].get('saturated'):
+        raise ValueError(f"Operating point '{operating_point}' saturates at threshold "
+                         f"{points[operating_point]['threshold']:.4f} and does not separate patients")
+    return (np.asarray(probabilities) >= points[operating_point]['threshold']).astype(int)
+
+
+def _fit_table(scores, y, method):
+    grid = np.linspace(0.0, 1.0, GRID)
+    if method == 'isotonic':
+        from sklearn.isotonic import IsotonicRegression
+
+        return IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds='clip').fit(scores, y).predict(grid)
+    from sklearn.linear_model import LogisticRegression
+
+    platt = LogisticRegression(C=1e6).fit(scores.reshape(-1, 1), y)
+    return platt.predict_proba(grid.reshape(-1, 1))[:, 1]
+
+
+def _precision_recall(y, predictions):
+    positives = int(predictions.sum())
+    true_positives = int((predictions & y).sum())
+    return (true_positives / positives if positives else None,
+            true_positives / int(y.sum()) if y.sum() else None)
+
+
+# For each recall target the highest threshold that still reaches it, and
+# for each precision target the lowest one, so the other measure is as high
+# as it can be
+def _operating_points(probabilities, y):
+    from sklearn.metrics import precision_recall_curve
+
+    precision, recall, thresholds = precision_recall_curve(y, probabilities)
+    precision, recall = precision[:-1], recall[:-1]
+    points = {}
+    for measure, values, targets, pick in (('recall', recall, RECALL_TARGETS, np.max),
+                                           ('precision', precision, PRECISION_TARGETS, np.min)):
+        for target in targets:
+            reachable = np.flatnonzero(values >= target)
+            key = f'{measure}_{round(target * 100)}'
+            if not len(reachable):
+                points[key] = None
+                continue
+            index = int(pick(reachable))
+            threshold = float(thresholds[index])
+            points[key] = {'target': target, 'threshold': threshold,
+                           'cv_precision': float(precision[index]), 'cv_recall': float(recall[index]),
+                           'saturated': bool(threshold <= SATURATION or threshold >= 1 - SATURATION
+                                             or threshold <= probabilities.min()
+                                             or threshold > probabilities.max())}
+    return points
+
+
+def _brier(probabilities, y):
+    return float(np.mean((probabilities - y) ** 2))
+
+
+# Map, default threshold and operating points fitted to positive-class
+# scores of rows the model did not train on; groups are the rows' hashes
+def _from_scores(scores, y, groups, method):
+    unique_rows = int(len(np.unique(groups)))
+    if method == 'auto':
+        method = 'isotonic' if unique_rows >= ISOTONIC_MIN_ROWS else 'sigmoid'
+    calibration = {'method': method, 'rows': int(len(y)), 'unique_rows': unique_rows, 'threshold': THRESHOLD,
+                   'table': _fit_table(scores, y, method)}
+    calibration['operating_points'] = _operating_points(calibrate(calibration, scores), y)
+    return calibration
+
+
+# Record how the calibration does on test rows, given their calibrated
+# probabilities
+def _add_test_stats(calibration, model, X_test, y_test, test_calibrated):
+    test_y = (np.asarray(y_test) == model.classes_[1]).astype(int)
+    X = model_registry.model_input(model, X_test)
+    for point in calibration['operating_points'].values():
+        if point is not None:
+            point['test_precision'], point['test_recall'] = _precision_recall(
+                test_y, (test_calibrated >= point['threshold']).astype(int))
+    calibration['test'] = {
+        'rows': int(len(test_y)),
+        'accuracy_raw': float(np.mean(model.predict(X) == np.asarray(y_test))),
+        'accuracy_calibrated': float(np.mean((test_calibrated >= THRESHOLD).astype(int) == test_y)),
+        'brier_raw': _brier(model.predict_proba(X)[:, 1], test_y),
+        'brier_calibrated': _brier(test_calibrated, test_y),
+    }
+    return calibration
+
+
+# Fit the calibration of a trained model from its training and test splits
+def fit_calibration(model, X_train, y_train, X_test, y_test, folds=5, n_jobs=None, method='auto'):
+    from sklearn.base import clone
+    from sklearn.model_selection import StratifiedGroupKFold, cross_val_predict
+
+    import train
+
+    y = (np.asarray(y_train) == model.classes_[1]).astype(int)
+    groups = train.row_hashes(X_train)
+    cv = StratifiedGroupKFold(folds, shuffle=True, random_state=train.RANDOM_STATE)
+    scores = cross_val_predict(clone(model), X_train, y_train, groups=groups, cv=cv, method='predict_proba',
+                               n_jobs=n_jobs)[:, 1]
+    calibration = {'scores': 'out_of_fold', **_from_scores(scores, y, groups, method)}
+    raw = model.predict_proba(model_registry.model_input(model, X_test))[:, 1]
+    return _add_test_stats(calibration, model, X_test, y_test, calibrate(calibration, raw))
+
+
+# Fit the calibration of a model as it is, from its own scores on held-out
+# rows (the test split). Used for models that cannot be refitted fold by
+# fold, such as incrementally updated ones. The map and thresholds are
+# fitted on all the rows; the test figures are cross-fitted, each fold
+# calibrated with a map fitted on the other folds.
+def fit_heldout_calibration(model, X, y, folds=5, method='auto'):
+    from sklearn.model_selection import StratifiedGroupKFold
+
+    import train
+
+    target = (np.asarray(y) == model.classes_[1]).astype(int)
+    groups = train.row_hashes(X)
+    scores = model.predict_proba(model_registry.model_input(model, X))[:, 1]
+    calibration = {'scores': 'held_out', **_from_scores(scores, target, groups, method)}
+    crossfitted = np.empty(len(scores))
+    cv = StratifiedGroupKFold(folds, shuffle=True, random_state=train.RANDOM_STATE)
+    for fit_index, test_index in cv.split(X, target, groups):
+        table = _fit_table(scores[fit_index], target[fit_index], calibration['method'])
+        crossfitted[test_index] = calibrate({'table': table}, scores[test_index])
+    return _add_test_stats(calibration, model, X, y, crossfitted)
+
+
+# Calibration of a model with name's hyperparameters (default: the served
+# model), on the same train/test split train.py uses
+def compute_calibration(name, model=None, folds=5, method='auto'):
+    import train
+
+    model = model if model is not None else model_registry.get_model(name)
+    X_train, X_test, y_train, y_test = train.split(name)
+    return fit_calibration(model, X_train, y_train, X_test, y_test, folds, method=method)
+
+
+# Stamp a calibration with the model version it belongs to and write it
+# through a temporary file
+def write_calibration(path, calibration, version):
+    document = {**calibration, 'model_version': version,
+                'table': np.round(np.asarray(calibration['table'], dtype=float), 8).tolist()}
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(document, file)
+    os.replace(f'{path}.tmp', path)
+    return document
+
+
+# The calibration stored at path if it belongs to version, otherwise None
+# (the model is then served with its raw probabilities). Reloaded when the
+# file changes. 'version' is the hash of the file, for keying results that
+# depend on it (see prediction_cache.py).
+def load_calibration(path, version):
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    key = (mtime_ns, version)
+    cached = _calibrations.get(path)
+    if cached is None or cached[0] != key:
+        with _lock:
+            try:
+                with open(path, 'rb') as file:
+                    content = file.read()
+                calibration = json.loads(content)
+            except (OSError, ValueError):
+                calibration = None
+            if calibration is not None and calibration.get('model_version') != version:
+                logger.warning("Calibration %s is stale; serving raw probabilities", path)
+                calibration = None
+            if calibration is not None:
+                calibration['table'] = np.asarray(calibration['table'], dtype=float)
+                calibration['version'] = hashlib.sha256(content).hexdigest()[:16]
+            cached = _calibrations[path] = (key, calibration)
+    return cached[1]
+
+
+def get_calibration(name):
+    return load_calibration(calibration_path(name), model_registry.model_version(name))
+
+
+# Version of the calibration name is served with, 'raw' when there is none
+def calibration_version(name):
+    calibration = get_calibration(name)
+    return 'raw' if calibration is None else calibration['version']
+
+
+def summary(calibration):
+    return {key: value for key, value in calibration.items() if key not in ('table', 'version')}
+
+
+#   python calibration.py [models] [--method auto|sigmoid|isotonic]
+# Refit the calibration of the served models (train.py does this as part
+# of training) and print the operating points and test Brier scores.
+def main():
+    parser = argparse.ArgumentParser(description='Fit probability calibration and operating thresholds.')
+    parser.add_argument('models', nargs='*', help='default: all models')
+    parser.add_argument('--method', choices=['auto', 'sigmoid', 'isotonic'], default='auto')
+    parser.add_argument('--folds', type=int, default=5)
+    args = parser.parse_args()
+    unknown = set(args.models) - set(model_registry.ARTIFACTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+
+    for name in args.models or sorted(model_registry.ARTIFACTS):
+        calibration = compute_calibration(name, folds=args.folds, method=args.method)
+        document = write_calibration(calibration_path(name), calibration, model_registry.model_version(name))
+        print(json.dumps({'model': name, **summary(document)}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import threading
+
+import evaluation
+import model_registry
+
+# Evaluation charts as Vega-Lite specs drawn in the browser. A spec is built
+# once per model version from the stored metrics and reused for every
+# request, so the server neither renders nor holds any figures.
+_charts = {}
+_lock = threading.Lock()
+
+
+def confusion_matrix_spec(cm):
+    values = [{'actual': str(actual), 'predicted': str(predicted), 'count': count}
+              for actual, row in enumerate(cm) for predicted, count in enumerate(row)]
+    encoding = {
+        'x': {'field': 'predicted', 'type': 'ordinal', 'title': 'Predicted'},
+        'y': {'field': 'actual', 'type': 'ordinal', 'title': 'Actual'},
+    }
+    return {
+        'data': {'values': values},
+        'encoding': encoding,
+        'layer': [
+            {'mark': 'rect', 'encoding': {'color': {'field': 'count', 'type': 'quantitative',
+                                                    'scale': {'scheme': 'blues'}, 'title': 'Count'}}},
+            {'mark': {'type': 'text', 'fontSize': 16},
+             'encoding': {'text': {'field': 'count', 'type': 'quantitative'},
+                          'color': {'condition': {'test': f'datum.count > {max(map(max, cm)) / 2}',
+                                                  'value': 'white'}, 'value': 'black'}}},
+        ],
+        'height': 300,
+    }
+
+
+def pr_curve_spec(precision, recall, pr_auc):
+    return {
+        'data': {'values': [{'recall': r, 'precision': p} for p, r in zip(precision, recall)]},
+        'mark': {'type': 'line', 'color': 'green', 'interpolate': 'step-after'},
+        'encoding': {
+            'x': {'field': 'recall', 'type': 'quantitative', 'title': 'Recall', 'scale': {'domain': [0, 1]}},
+            'y': {'field': 'precision', 'type': 'quantitative', 'title': 'Precision', 'scale': {'domain': [0, 1]}},
+        },
+        'title': f'PR Curve (AUC = {pr_auc:.2f})',
+        'height': 300,
+    }
+
+
+# Horizontal bars of per-feature contributions ({feature: value}, largest
+# first), red where a feature pushes towards the positive class
+def contributions_spec(contributions, units):
+    return {
+        'data': {'values': [{'feature': feature, 'contribution': value} for feature, value in contributions.items()]},
+        'mark': 'bar',
+        'encoding': {
+            'y': {'field': 'feature', 'type': 'nominal', 'sort': None, 'title': None},
+            'x': {'field': 'contribution', 'type': 'quantitative', 'title': f'Contribution ({units})'},
+            'color': {'condition': {'test': 'datum.contribution > 0', 'value': '#d62728'}, 'value': '#1f77b4'},
+        },
+        'height': {'step': 22},
+    }
+
+
+# Both chart specs for the current version of a model
+def get_charts(name):
+    version = model_registry.model_version(name)
+    cached = _charts.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with _lock:
+        metrics = evaluation.get_metrics(name)
+        charts = {
+            'confusion_matrix': confusion_matrix_spec(metrics['confusion_matrix']),
+            'pr_curve': pr_curve_spec(metrics['pr_curve']['precision'], metrics['pr_curve']['recall'],
+                                      metrics['pr_auc']),
+        }
+        _charts[name] = (metrics['model_version'], charts)
+        return charts
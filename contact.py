@@ -1,7 +1,4 @@
 import streamlit as st
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
 def app():
     
@@ -33,40 +30,24 @@ def app():
         elif not validate_email(email):
             st.error("Please enter a valid email address.")
         else:
-            # Send email (example: replace with your email server settings)
-            send_email(name, email, message)
-            st.success("Your message has been sent successfully!")
+            # Mail server settings come from the CONTACT_* environment variables
+            if send_email(name, email, message) is not None:
+                st.success("Your message has been received and will be delivered shortly!")
 
 # Email validation function
 def validate_email(email):
     return '@' in email and '.' in email
 
-# Function to send email
+# Queue the message for the background outbox worker (see outbox.py), which
+# delivers it over a reused SMTP connection and retries on failure, so the
+# form returns without waiting on the mail server
 def send_email(name, email, message):
-    try:
-        sender_email = "your_email@example.com"  # Replace with your email
-        receiver_email = "receiver_email@example.com"  # Replace with your email address
-        password = "your_email_password"  # Replace with your email password
-
-        # Create the email content
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = receiver_email
-        msg['Subject'] = f"Contact Us Message from {name}"
-
-        body = f"Name: {name}\nEmail: {email}\nMessage: {message}"
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Establish SMTP connection and send the email
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, password)
-        text = msg.as_string()
-        server.sendmail(sender_email, receiver_email, text)
-        server.quit()
+    import outbox
 
+    try:
+        return outbox.submit(name, email, message)
     except Exception as e:
-        st.error(f"Error sending email: {e}")
+        st.error(f"Error queuing email: {e}")
         print(e)
 
 # Run the app only if the script is executed directly
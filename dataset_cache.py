@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import model_registry
+
+# Columnar cache of the training CSVs. A dataset is parsed once, in chunks so
+# memory stays bounded by the chunk size, with only the feature and target
+# columns read (identifier columns such as Parkinson's 'name' are skipped).
+# Each column is stored as its own .npy file in the smallest dtype that holds
+# every value exactly, and later loads memory-map those files instead of
+# parsing text.
+#
+# Layout: Datasets/.cache/<name>-<sha256 prefix of the CSV>/
+#   <index>.npy  - one file per column, in dataset order
+#   meta.json    - column names and dtypes, row count, source size/mtime/hash
+# An entry is built in a temporary directory of its own (.<name>-*) and
+# renamed into place complete, so a directory that is loaded from (and may be
+# memory-mapped by other processes) is never written to again. When two
+# builders race, the first rename wins and the other build is dropped.
+
+cache_dir = os.path.join(model_registry.datasets_dir, '.cache')
+DEFAULT_CHUNKSIZE = 100_000
+STALE_BUILD_SECONDS = 3600
+_INT_TYPES = (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.int64)
+
+_lock = threading.Lock()
+
+
+def columns(name):
+    artifact = model_registry.ARTIFACTS[name]
+    return artifact['features'] + [artifact['target']]
+
+
+def _entry_dir(name, sha256):
+    return os.path.join(cache_dir, f'{name}-{sha256[:16]}')
+
+
+# Smallest dtype that stores every value of a column exactly, from the
+# statistics gathered while streaming it
+def _compact_dtype(stats):
+    if stats['integral']:
+        for dtype in _INT_TYPES:
+            info = np.iinfo(dtype)
+            if info.min <= stats['min'] and stats['max'] <= info.max:
+                return np.dtype(dtype)
+    return np.dtype(np.float32 if stats['float32_exact'] else np.float64)
+
+
+# Parse the given columns of a CSV chunk by chunk into float64 scratch files
+# while tracking each column's range, integrality and float32 exactness; then
+# write each column to directory/<index>.npy in its compact dtype. Returns
+# the row count and the dtype names. Also used for screening input files.
+def write_columns(path, names, directory, chunksize=DEFAULT_CHUNKSIZE):
+    os.makedirs(directory, exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=directory)
+    try:
+        stats = [{'min': np.inf, 'max': -np.inf, 'integral': True, 'float32_exact': True} for _ in names]
+        handles = [open(os.path.join(scratch, f'{index}.f8'), 'wb') for index in range(len(names))]
+        rows = 0
+        try:
+            for chunk in pd.read_csv(path, usecols=names, chunksize=chunksize, encoding='utf-8-sig'):
+                for index, column in enumerate(names):
+                    values = chunk[column].to_numpy(dtype=np.float64)
+                    values.tofile(handles[index])
+                    if not len(values):
+                        continue
+                    column_stats = stats[index]
+                    finite = np.isfinite(values).all()
+                    column_stats['min'] = min(column_stats['min'], values.min())
+                    column_stats['max'] = max(column_stats['max'], values.max())
+                    column_stats['integral'] &= bool(finite and (values == np.round(values)).all())
+                    column_stats['float32_exact'] &= bool(np.array_equal(
+                        values.astype(np.float32).astype(np.float64), values, equal_nan=True))
+                rows += len(chunk)
+        finally:
+            for handle in handles:
+                handle.close()
+
+        dtypes = []
+        for index, column_stats in enumerate(stats):
+            dtype = _compact_dtype(column_stats) if rows else np.dtype(np.float64)
+            source = np.memmap(os.path.join(scratch, f'{index}.f8'), dtype=np.float64, mode='r', shape=(rows,))
+            target = np.lib.format.open_memmap(os.path.join(directory, f'{index}.npy'), mode='w+',
+                                               dtype=dtype, shape=(rows,))
+            for start in range(0, rows, chunksize):
+                target[start:start + chunksize] = source[start:start + chunksize]
+            target.flush()
+            del source, target
+            dtypes.append(dtype.name)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return rows, dtypes
+
+
+# Cache the feature and target columns of a dataset, keyed on the CSV hash
+def build(name, chunksize=DEFAULT_CHUNKSIZE):
+    path = model_registry.dataset_path(name)
+    names = columns(name)
+    stat = os.stat(path)
+    sha256 = model_registry.file_hash(path)
+    directory = _entry_dir(name, sha256)
+    os.makedirs(cache_dir, exist_ok=True)
+    building = tempfile.mkdtemp(prefix=f'.{name}-', dir=cache_dir)
+    try:
+        os.chmod(building, 0o755)
+        rows, dtypes = write_columns(path, names, building, chunksize)
+        meta = {
+            'dataset': name,
+            'columns': names,
+            'dtypes': dtypes,
+            'rows': rows,
+            'source': {'file': os.path.relpath(path, model_registry.base_dir), 'size': stat.st_size,
+                       'mtime_ns': stat.st_mtime_ns, 'sha256': sha256},
+        }
+        with open(os.path.join(building, 'meta.json'), 'w') as file:
+            json.dump(meta, file, indent=2)
+        _move_into_place(building, directory)
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+
+    # Entries for older versions of the CSV are no longer reachable, and
+    # builds older than STALE_BUILD_SECONDS were left by a builder that died
+    for entry in os.listdir(cache_dir):
+        entry_path = os.path.join(cache_dir, entry)
+        if entry.startswith(f'{name}-') and entry_path != directory:
+            shutil.rmtree(entry_path, ignore_errors=True)
+        elif entry.startswith(f'.{name}-') and _age(entry_path) > STALE_BUILD_SECONDS:
+            shutil.rmtree(entry_path, ignore_errors=True)
+    return _read_meta(directory)
+
+
+# Rename a finished build to its entry directory. If another builder got
+# there first, its entry is kept; a directory without meta.json (left by a
+# build that wrote in place) is replaced.
+def _move_into_place(building, directory):
+    try:
+        os.replace(building, directory)
+    except OSError:
+        if _read_meta(directory) is not None:
+            return
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(building, directory)
+
+
+def _age(path):
+    try:
+        return time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# The cache entry for the CSV as it is on disk now, or None. When size and
+# mtime match the entry the CSV is not re-hashed; otherwise it is, so a
+# touched but unchanged file still hits.
+def _current_entry(name):
+    path = model_registry.dataset_path(name)
+    stat = os.stat(path)
+    if os.path.isdir(cache_dir):
+        for entry in sorted(os.listdir(cache_dir)):
+            if not entry.startswith(f'{name}-'):
+                continue
+            meta = _read_meta(os.path.join(cache_dir, entry))
+            if meta and meta['columns'] == columns(name) and \
+                    (meta['source']['size'], meta['source']['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                return os.path.join(cache_dir, entry), meta
+    meta = _read_meta(_entry_dir(name, model_registry.content_hash(path)))
+    if meta and meta['columns'] == columns(name):
+        return _entry_dir(name, meta['source']['sha256']), meta
+    return None
+
+
+# {column: read-only memory-mapped array} for a dataset, building the cache
+# first if the CSV is new or has changed
+def load_columns(name, chunksize=DEFAULT_CHUNKSIZE):
+    entry = _current_entry(name)
+    if entry is None:
+        with _lock:
+            entry = _current_entry(name)
+            if entry is None:
+                build(name, chunksize)
+                entry = _current_entry(name)
+    directory, meta = entry
+    return {column: np.load(os.path.join(directory, f'{index}.npy'), mmap_mode='r')
+            for index, column in enumerate(meta['columns'])}
+
+
+# Features (as a DataFrame in model column order) and target of a dataset,
+# read from the columnar cache
+def load_dataset(name):
+    arrays = load_columns(name)
+    artifact = model_registry.ARTIFACTS[name]
+    X = pd.DataFrame({feature: arrays[feature] for feature in artifact['features']})
+    return X, pd.Series(arrays[artifact['target']], name=artifact['target'])
+
+
+#   python dataset_cache.py [models] [--rebuild] [--chunksize N]
+# Builds the cache where needed and compares a CSV parse with a cached load.
+def main():
+    parser = argparse.ArgumentParser(description='Build the columnar cache of the training CSVs.')
+    parser.add_argument('models', nargs='*', help='default: all models')
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+    unknown = set(args.models) - set(model_registry.ARTIFACTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+
+    for name in args.models or sorted(model_registry.ARTIFACTS):
+        if args.rebuild or _current_entry(name) is None:
+            build(name, args.chunksize)
+        directory, meta = _current_entry(name)
+
+        start = time.perf_counter()
+        pd.read_csv(model_registry.dataset_path(name), encoding='utf-8-sig')
+        parse_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        load_dataset(name)
+        load_seconds = time.perf_counter() - start
+
+        cached_bytes = sum(os.path.getsize(os.path.join(directory, f'{index}.npy'))
+                           for index in range(len(meta['columns'])))
+        print(json.dumps({
+            'dataset': name,
+            'rows': meta['rows'],
+            'csv_bytes': meta['source']['size'],
+            'cached_bytes': cached_bytes,
+            'dtypes': dict(zip(meta['columns'], meta['dtypes'])),
+            'csv_parse_ms': round(parse_seconds * 1000, 2),
+            'cached_load_ms': round(load_seconds * 1000, 2),
+        }))
+
+
+if __name__ == '__main__':
+    main()
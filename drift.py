@@ -0,0 +1,312 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import dataset_cache
+import feature_schema
+import model_registry
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Data-drift monitor for the inputs of every scored request. Each model has
+# a reference sketch built from its Datasets/ CSV and a sketch of the
+# current window of live inputs, both of constant size per feature:
+#   - counts per bin, the bins cut at the reference's deciles, from which
+#     the population stability index (PSI) and approximate quantiles follow
+#   - counts of zeros (0 often stands for "not measured", e.g. Insulin and
+#     SkinThickness in the diabetes data) and of values outside the range
+#     seen in training (feature_schema's observed_min/observed_max)
+#   - a running sum for the mean
+# The request path only queues the already validated input (put_nowait on a
+# bounded queue; inputs are dropped and counted when it is full). A
+# background thread folds them into the window and every DRIFT_INTERVAL
+# seconds compares each window with its reference, logging an alert and
+# counting 'drift_alerts' in telemetry for every feature past a limit. A
+# window is started afresh once it holds DRIFT_WINDOW_ROWS rows.
+BINS = 10
+DRIFT = os.environ.get('DRIFT', '1') == '1'
+INTERVAL = float(os.environ.get('DRIFT_INTERVAL', 60))
+MIN_ROWS = int(os.environ.get('DRIFT_MIN_ROWS', 100))
+WINDOW_ROWS = int(os.environ.get('DRIFT_WINDOW_ROWS', 10_000))
+MAX_PENDING = int(os.environ.get('DRIFT_MAX_PENDING', 10_000))
+# Alert limits: PSI, absolute change in the share of zeros, share of values
+# outside the training range
+PSI_ALERT = float(os.environ.get('DRIFT_PSI_ALERT', 0.2))
+ZERO_ALERT = float(os.environ.get('DRIFT_ZERO_ALERT', 0.1))
+OUT_OF_RANGE_ALERT = float(os.environ.get('DRIFT_OUT_OF_RANGE_ALERT', 0.01))
+# Keeps empty bins from making the PSI infinite
+_EPSILON = 1e-4
+
+
+class Sketch:
+    def __init__(self, edges, low, high):
+        self.edges = edges
+        self.low = low
+        self.high = high
+        self.rows = 0
+        self.counts = [np.zeros(len(feature_edges) + 1, dtype=np.int64) for feature_edges in edges]
+        self.zeros = np.zeros(len(edges), dtype=np.int64)
+        self.out_of_range = np.zeros(len(edges), dtype=np.int64)
+        self.sums = np.zeros(len(edges))
+
+    def empty(self):
+        return Sketch(self.edges, self.low, self.high)
+
+    # Add the rows of X, (rows, features) in model feature order
+    def update(self, X):
+        self.rows += len(X)
+        for index, feature_edges in enumerate(self.edges):
+            bins = np.searchsorted(feature_edges, X[:, index], side='right')
+            self.counts[index] += np.bincount(bins, minlength=len(feature_edges) + 1)
+        self.zeros += (X == 0).sum(axis=0)
+        self.out_of_range += ((X < self.low) | (X > self.high)).sum(axis=0)
+        self.sums += X.sum(axis=0)
+
+    # Approximate q-quantile of a feature, interpolated within its bin; the
+    # outer bins are bounded by the training range
+    def quantile(self, index, q):
+        bounds = np.concatenate([[self.low[index]], self.edges[index], [self.high[index]]])
+        cumulative = np.cumsum(self.counts[index]) / self.rows
+        k = int(np.searchsorted(cumulative, q))
+        if k >= len(cumulative):
+            return float(bounds[-1])
+        below = cumulative[k - 1] if k else 0.0
+        share = (q - below) / (cumulative[k] - below) if cumulative[k] > below else 0.0
+        return float(bounds[k] + share * (bounds[k + 1] - bounds[k]))
+
+
+def _bin_edges(values):
+    return np.unique(np.quantile(values, np.linspace(0, 1, BINS + 1)[1:-1]))
+
+
+# Reference sketch of name's training data. Rebuilt when the CSV changes.
+_references = {}
+
+
+def build_reference(name):
+    features = model_registry.ARTIFACTS[name]['features']
+    columns = dataset_cache.load_columns(name)
+    X = np.column_stack([np.asarray(columns[feature], dtype=np.float64) for feature in features])
+    fields = feature_schema.fields(name)
+    low = np.array([field['observed_min'] for field in fields], dtype=np.float64)
+    high = np.array([field['observed_max'] for field in fields], dtype=np.float64)
+    reference = Sketch([_bin_edges(X[:, index]) for index in range(len(features))], low, high)
+    reference.update(X)
+    return reference
+
+
+def get_reference(name):
+    key = os.stat(model_registry.dataset_path(name)).st_mtime_ns
+    cached = _references.get(name)
+    if cached is None or cached[0] != key:
+        cached = _references[name] = (key, build_reference(name))
+    return cached[1]
+
+
+def _psi(reference, sketch, index):
+    expected = reference.counts[index] / reference.rows + _EPSILON
+    actual = sketch.counts[index] / sketch.rows + _EPSILON
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+# Per-feature comparison of a sketch with its reference, and the alerts
+def compare(name, reference, sketch):
+    features = model_registry.ARTIFACTS[name]['features']
+    rows = []
+    alerts = []
+    for index, feature in enumerate(features):
+        stats = {
+            'feature': feature,
+            'psi': _psi(reference, sketch, index),
+            'zero_rate': sketch.zeros[index] / sketch.rows,
+            'reference_zero_rate': reference.zeros[index] / reference.rows,
+            'out_of_range_rate': sketch.out_of_range[index] / sketch.rows,
+            'mean': sketch.sums[index] / sketch.rows,
+            'reference_mean': reference.sums[index] / reference.rows,
+            'median': sketch.quantile(index, 0.5),
+            'reference_median': reference.quantile(index, 0.5),
+        }
+        rows.append({key: value if key == 'feature' else round(float(value), 4) for key, value in stats.items()})
+        for kind, value, limit in (
+                ('psi', stats['psi'], PSI_ALERT),
+                ('zero_rate', abs(stats['zero_rate'] - stats['reference_zero_rate']), ZERO_ALERT),
+                ('out_of_range', stats['out_of_range_rate'], OUT_OF_RANGE_ALERT)):
+            if value >= limit:
+                alerts.append({'model': name, 'feature': feature, 'kind': kind,
+                               'value': round(float(value), 4), 'limit': limit})
+    return {'model': name, 'rows': sketch.rows, 'features': rows, 'alerts': alerts}
+
+
+# Live monitoring state, per process
+_queue = queue.Queue(MAX_PENDING)
+_windows = {}
+_totals = {}
+_dropped = {}
+_checks = {}
+# Models with inputs since their last check
+_updated = set()
+_alerts = deque(maxlen=100)
+_lock = threading.Lock()
+_thread = None
+
+
+# Queue the input of a scored request: a validated frame, or one or more
+# {feature: value} records. Nothing is computed on the caller's thread.
+def observe(name, data):
+    if not DRIFT:
+        return
+    if _thread is None:
+        _start()
+    try:
+        _queue.put_nowait((name, data))
+    except queue.Full:
+        with _lock:
+            _dropped[name] = _dropped.get(name, 0) + 1
+
+
+def _start():
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name='drift-monitor', daemon=True)
+            _thread.start()
+
+
+def _matrix(name, data):
+    features = model_registry.ARTIFACTS[name]['features']
+    if isinstance(data, pd.DataFrame):
+        return data[features].to_numpy(dtype=np.float64)
+    records = [data] if isinstance(data, dict) else data
+    return np.array([[record[feature] for feature in features] for record in records], dtype=np.float64)
+
+
+# The current window of name, started afresh when the reference changes
+def _window(name):
+    reference = get_reference(name)
+    window = _windows.get(name)
+    if window is None or window.edges is not reference.edges:
+        window = _windows[name] = reference.empty()
+    return window
+
+
+def _update(name, X):
+    with _lock:
+        _window(name).update(X)
+        _totals[name] = _totals.get(name, 0) + len(X)
+        _updated.add(name)
+
+
+# Compare every window that has new inputs and enough rows with its
+# reference, raising alerts, and start a new window for those that are full
+def check():
+    for name in list(_windows):
+        with _lock:
+            window = _window(name)
+            if name not in _updated or window.rows < MIN_ROWS:
+                continue
+            _updated.discard(name)
+            result = compare(name, get_reference(name), window)
+            result['checked_at'] = time.time()
+            _checks[name] = result
+            _alerts.extend(result['alerts'])
+            if window.rows >= WINDOW_ROWS:
+                _windows[name] = window.empty()
+        for alert in result['alerts']:
+            logger.warning("Input drift in %s: %s %s=%s (limit %s) over %d rows", name, alert['feature'],
+                           alert['kind'], alert['value'], alert['limit'], result['rows'])
+            telemetry.increment('drift_alerts', model=name, feature=alert['feature'], kind=alert['kind'])
+
+
+def _run():
+    next_check = time.monotonic() + INTERVAL
+    while True:
+        try:
+            name, data = _queue.get(timeout=max(0.0, next_check - time.monotonic()))
+        except queue.Empty:
+            pass
+        else:
+            try:
+                _update(name, _matrix(name, data))
+            except Exception:
+                logger.exception("Drift monitor could not record an input for %s", name)
+        if time.monotonic() >= next_check:
+            try:
+                check()
+            except Exception:
+                logger.exception("Drift check failed")
+            next_check = time.monotonic() + INTERVAL
+
+
+# The current window compared with the reference (no alerts are raised),
+# the result of the last periodic check and the recent alerts
+def report(name):
+    with _lock:
+        window = _windows.get(name)
+        current = compare(name, get_reference(name), window) if window is not None and window.rows else None
+        return {
+            'model': name,
+            'observed_rows': _totals.get(name, 0),
+            'dropped_inputs': _dropped.get(name, 0),
+            'pending_inputs': _queue.qsize(),
+            'current_window': current,
+            'last_check': _checks.get(name),
+            'recent_alerts': [alert for alert in _alerts if alert['model'] == name],
+        }
+
+
+def recent_alerts():
+    with _lock:
+        return list(_alerts)
+
+
+def drift_stats():
+    return [report(name) for name in sorted(model_registry.ARTIFACTS)]
+
+
+#   python drift.py reference [models]           reference statistics per feature
+#   python drift.py check <model> patients.csv   compare a CSV with the reference
+# check exits with status 1 when any limit is exceeded.
+def main():
+    parser = argparse.ArgumentParser(description='Compare model inputs with the training data.')
+    parser.add_argument('command', choices=['reference', 'check'])
+    parser.add_argument('args', nargs='*', help='reference: models; check: model and CSV')
+    parser.add_argument('--chunksize', type=int, default=dataset_cache.DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+
+    if args.command == 'reference':
+        unknown = set(args.args) - set(model_registry.ARTIFACTS)
+        if unknown:
+            parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+        for name in args.args or sorted(model_registry.ARTIFACTS):
+            reference = get_reference(name)
+            result = compare(name, reference, reference)
+            print(json.dumps({'model': name, 'rows': reference.rows, 'features': [
+                {key: value for key, value in row.items() if key != 'psi' and not key.startswith('reference_')}
+                for row in result['features']]}))
+        return
+
+    if len(args.args) != 2 or args.args[0] not in model_registry.ARTIFACTS:
+        parser.error('check takes a model name and a CSV')
+    name, path = args.args
+    sketch = get_reference(name).empty()
+    for chunk in pd.read_csv(path, chunksize=args.chunksize, encoding='utf-8-sig'):
+        sketch.update(feature_schema.validate(name, chunk).to_numpy())
+    if not sketch.rows:
+        parser.error(f'{path} has no rows')
+    result = compare(name, get_reference(name), sketch)
+    print(json.dumps(result))
+    sys.exit(1 if result['alerts'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import threading
+
+import model_registry
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Evaluation metrics only depend on the model, not on the patient being
+# scored, so they are computed once per model version and stored next to the
+# model as '<model file stem>_metrics.json'
+_metrics = {}
+_lock = threading.Lock()
+
+
+def metrics_path(name):
+    stem = os.path.splitext(model_registry.ARTIFACTS[name]['model'])[0]
+    return os.path.join(model_registry.models_dir, f'{stem}_metrics.json')
+
+
+# Score the saved test split and collect everything the metrics view shows
+def compute_metrics(name):
+    from sklearn.metrics import accuracy_score, auc, confusion_matrix, precision_recall_curve
+
+    model = model_registry.get_model(name)
+    X_test, y_test = model_registry.get_test_data(name)
+    X_test = model_registry.model_input(model, X_test)
+    with telemetry.span('predict_proba', model=name, data='test'):
+        y_probs = model.predict_proba(X_test)[:, 1]
+    with telemetry.span('predict', model=name, data='test'):
+        y_preds = model.predict(X_test)
+    precision, recall, thresholds = precision_recall_curve(y_test, y_probs)
+
+    return {
+        'model': model_registry.ARTIFACTS[name]['model'],
+        'model_version': model_registry.model_version(name),
+        'test_rows': int(len(y_test)),
+        'accuracy': float(accuracy_score(y_test, y_preds)),
+        'confusion_matrix': confusion_matrix(y_test, y_preds).tolist(),
+        'pr_curve': {
+            'precision': precision.tolist(),
+            'recall': recall.tolist(),
+            'thresholds': thresholds.tolist(),
+        },
+        'pr_auc': float(auc(recall, precision)),
+    }
+
+
+# Write through a temporary file so readers never see a half-written artifact
+def write_metrics(name, metrics):
+    path = metrics_path(name)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(metrics, file)
+    os.replace(tmp_path, path)
+
+
+def _read_metrics(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Metrics for the current version of a model. Served from memory, then from
+# the stored artifact, and only recomputed when the model file has changed.
+def get_metrics(name):
+    version = model_registry.model_version(name)
+    cached = _metrics.get(name)
+    if cached is not None and cached['model_version'] == version:
+        return cached
+
+    with _lock:
+        metrics = _read_metrics(metrics_path(name))
+        if metrics is None or metrics.get('model_version') != version:
+            logger.info("Computing evaluation metrics for %s", name)
+            metrics = compute_metrics(name)
+            write_metrics(name, metrics)
+        _metrics[name] = metrics
+        return metrics
+
+
+# Precompute the metrics artifacts for every model:
+#   python evaluation.py
+def main():
+    for name in model_registry.ARTIFACTS:
+        metrics = compute_metrics(name)
+        write_metrics(name, metrics)
+        print(f"{name}: accuracy={metrics['accuracy']:.3f} "
+              f"pr_auc={metrics['pr_auc']:.3f} -> {metrics_path(name)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import dataset_cache
+import model_registry
+from calibration import calibrate, calibration_version, get_calibration
+from fast_scorer import get_predictor
+
+# Per-feature contributions to a prediction, cheap enough to return with
+# every single and batch prediction. What is precomputed once per model
+# and calibration version depends on the model:
+#   - linear models (LogisticRegression or linear-kernel SVC, optionally
+#     behind a StandardScaler) are explained in closed form: the coefficients
+#     are folded through the scaler into weights on the raw features, and a
+#     patient's contributions are weight * (value - dataset mean), in units
+#     of the decision function, which is not calibrated. They add up to
+#     decision(patient) - decision(mean patient).
+#   - any other model (the KNN/SVC hybrids, RBF SVC) gets sampled Shapley
+#     values: a fixed set of feature orderings, each paired with a
+#     background patient from the dataset, along which the patient's values
+#     are switched in one feature at a time. What is explained is the risk
+#     the model is served with, i.e. the probability passed through the
+#     model's calibration (calibration.py) when it has one, so the
+#     contributions add up to the displayed risk(patient) - base_value.
+# Orderings and background rows are drawn with a fixed seed, so a patient
+# always gets the same explanation from the same model and calibration.
+SAMPLES = 32
+SEED = 2
+# Upper bound on the synthetic rows scored at once by the sampled path
+_BLOCK_ROWS = 200_000
+
+_explainers = {}
+_lock = threading.Lock()
+
+
+# (weights on the raw features, intercept) of a linear binary model, or
+# None if the model is not linear
+def _linear_weights(model):
+    steps = [step for _, step in model.steps] if type(model).__name__ == 'Pipeline' else [model]
+    *transforms, final = steps
+    if any(type(step).__name__ != 'StandardScaler' for step in transforms):
+        return None
+    if type(final).__name__ == 'SVC' and final.kernel != 'linear':
+        return None
+    coef = getattr(final, 'coef_', None)
+    if coef is None or len(final.classes_) != 2:
+        return None
+    weights = np.asarray(coef, dtype=float)[0]
+    intercept = float(np.ravel(final.intercept_)[0])
+    # Fold each scaler, x -> (x - mean) / scale, into the weights
+    for scaler in reversed(transforms):
+        mean = scaler.mean_ if scaler.with_mean else 0.0
+        scale = scaler.scale_ if scaler.with_std else 1.0
+        weights = weights / scale
+        intercept -= float(np.dot(weights, np.broadcast_to(mean, weights.shape)))
+    return weights, intercept
+
+
+def _positive_proba(predictor, X, features, calibration):
+    frame = pd.DataFrame(X, columns=features)
+    return calibrate(calibration, predictor.predict_proba(model_registry.model_input(predictor, frame))[:, 1])
+
+
+# Everything needed to explain predictions of model, precomputed from the
+# model and its dataset
+def build_explainer(name, model, samples=SAMPLES, seed=SEED):
+    features = model_registry.ARTIFACTS[name]['features']
+    columns = dataset_cache.load_columns(name)
+    data = np.column_stack([np.asarray(columns[feature], dtype=np.float64) for feature in features])
+    baseline = data.mean(axis=0)
+
+    linear = _linear_weights(model)
+    if linear is not None:
+        weights, intercept = linear
+        return {
+            'method': 'linear',
+            'units': 'decision function (uncalibrated)',
+            'features': features,
+            'weights': weights,
+            'baseline': baseline,
+            'base_value': float(weights @ baseline + intercept),
+        }
+
+    rng = np.random.default_rng(seed)
+    d = len(features)
+    orders = np.array([rng.permutation(d) for _ in range(samples)])
+    ranks = np.argsort(orders, axis=1)
+    # masks[m, k, j]: feature j already switched to the patient's value at
+    # step k of ordering m (step 0 is the background row, step d the patient)
+    masks = ranks[:, None, :] < np.arange(d + 1)[None, :, None]
+    background = data[rng.choice(len(data), samples)]
+    calibration = get_calibration(name)
+    background_proba = _positive_proba(model, background, features, calibration)
+    return {
+        'method': 'sampled',
+        'units': 'probability' if calibration is None else 'calibrated risk',
+        'features': features,
+        'calibration': calibration,
+        'samples': samples,
+        'ranks': ranks,
+        'masks': masks,
+        'background': background,
+        'background_proba': background_proba,
+        'base_value': float(background_proba.mean()),
+    }
+
+
+def get_explainer(name):
+    version = (model_registry.model_version(name), calibration_version(name))
+    cached = _explainers.get(name)
+    if cached is None or cached[0] != version:
+        with _lock:
+            cached = _explainers.get(name)
+            if cached is None or cached[0] != version:
+                cached = _explainers[name] = (version, build_explainer(name, model_registry.get_model(name)))
+    return cached[1]
+
+
+# The first step of every ordering is its background row and the last is
+# the patient, so only the steps in between are scored per ordering
+def _sampled(explainer, predictor, X):
+    masks, background = explainer['masks'][:, 1:-1], explainer['background']
+    samples, steps, d = masks.shape
+    contributions = np.empty_like(X)
+    block = max(1, _BLOCK_ROWS // (samples * (steps + 1)))
+    for start in range(0, len(X), block):
+        rows = X[start:start + block]
+        # (rows, samples, steps, d): every patient along every ordering
+        chains = np.where(masks[None], rows[:, None, None, :], background[None, :, None, :])
+        scored = _positive_proba(predictor, np.concatenate([chains.reshape(-1, d), rows]), explainer['features'],
+                                 explainer['calibration'])
+        inner, patient = scored[:-len(rows)].reshape(len(rows), samples, steps), scored[-len(rows):]
+        probabilities = np.concatenate([
+            np.broadcast_to(explainer['background_proba'][None, :, None], (len(rows), samples, 1)),
+            inner,
+            np.broadcast_to(patient[:, None, None], (len(rows), samples, 1)),
+        ], axis=2)
+        deltas = np.diff(probabilities, axis=2)
+        # Step k of ordering m switched feature orders[m, k]; gather by rank
+        by_feature = np.take_along_axis(deltas, np.broadcast_to(explainer['ranks'][None], deltas.shape), axis=2)
+        contributions[start:start + block] = by_feature.mean(axis=1)
+    return contributions
+
+
+# Contributions for a validated frame (feature_schema.validate output) as
+# {'method', 'units', 'base_value', 'features', 'contributions': (rows, d)}
+def explain(name, frame):
+    explainer = get_explainer(name)
+    X = frame[explainer['features']].to_numpy(dtype=np.float64)
+    if explainer['method'] == 'linear':
+        contributions = (X - explainer['baseline']) * explainer['weights']
+    else:
+        contributions = _sampled(explainer, get_predictor(name), X)
+    return {
+        'method': explainer['method'],
+        'units': explainer['units'],
+        'base_value': explainer['base_value'],
+        'features': explainer['features'],
+        'contributions': contributions,
+    }
+
+
+# One row of an explanation as {feature: contribution}, largest effect first
+def contributions_dict(explanation, row=0, top=None):
+    values = explanation['contributions'][row]
+    order = np.argsort(-np.abs(values), kind='stable')[:top]
+    return {explanation['features'][index]: float(values[index]) for index in order}
+
+
+# Time both paths on rows synthesized from the dataset:
+#   python explanations.py [models] [--rows 1000]
+def main():
+    parser = argparse.ArgumentParser(description='Time per-prediction explanations.')
+    parser.add_argument('models', nargs='*', help='default: all models')
+    parser.add_argument('--rows', type=int, default=1000)
+    args = parser.parse_args()
+    unknown = set(args.models) - set(model_registry.ARTIFACTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+
+    for name in args.models or sorted(model_registry.ARTIFACTS):
+        X, _ = dataset_cache.load_dataset(name)
+        frame = X.sample(args.rows, replace=True, random_state=SEED).astype(float)
+        start = time.perf_counter()
+        get_explainer(name)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        explain(name, frame.iloc[:1])
+        single_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        explanation = explain(name, frame)
+        batch_seconds = time.perf_counter() - start
+        print(json.dumps({
+            'model': name,
+            'method': explanation['method'],
+            'build_ms': round(build_seconds * 1000, 2),
+            'single_row_ms': round(single_seconds * 1000, 3),
+            'batch_rows': args.rows,
+            'batch_us_per_row': round(batch_seconds / args.rows * 1e6, 2),
+            'top_features_row_0': contributions_dict(explanation, top=3),
+        }))
+
+
+if __name__ == '__main__':
+    main()
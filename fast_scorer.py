@@ -0,0 +1,457 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import model_registry
+
+logger = logging.getLogger(__name__)
+
+# Compiled-down scorers for the saved models. The fitted parameters of each
+# supported estimator are pulled out into plain NumPy arrays and scored with
+# vectorized NumPy only, skipping sklearn's estimator machinery and input
+# validation. Compiled scorers live next to the versioned artifact in
+# Saved models/artifacts/<name>/fast/ as scorer.json (structure) plus one
+# .npy file per array, loaded memory-mapped without importing sklearn. The
+# arrays of each compiled version get their own arrays-<hash>/ directory,
+# so a recompile never rewrites files a running worker has mapped.
+#
+# Supported: StandardScaler pipelines, SVC (linear and rbf kernels, with
+# Platt-scaled probabilities), LogisticRegression, uniform-weight euclidean
+# KNeighborsClassifier and soft VotingClassifier, for binary targets.
+
+# libsvm clips pairwise probabilities to [min_prob, 1 - min_prob], then
+# couples them with an iterative solver (max 100 iterations, eps 0.005 / k)
+_LIBSVM_MIN_PROB = 1e-7
+_LIBSVM_MAX_ITER = 100
+_LIBSVM_EPS = 0.005 / 2
+
+# Upper bound on the temporary distance array used by KNN, in elements, and
+# the number of extra candidates re-ranked exactly
+_KNN_BLOCK = 4_000_000
+_KNN_SLACK = 8
+
+
+def _binary_classes(model):
+    classes = np.asarray(model.classes_)
+    if len(classes) != 2:
+        raise TypeError(f'{type(model).__name__} has {len(classes)} classes; only binary models compile')
+    return classes
+
+
+# Turn a fitted estimator into a nested dict of parameters
+def compile_model(model):
+    kind = type(model).__name__
+    if kind == 'Pipeline':
+        steps = [compile_model(step) for _, step in model.steps]
+        return {'kind': 'pipeline', 'steps': steps, 'classes': steps[-1]['classes']}
+    if kind == 'StandardScaler':
+        n = model.n_features_in_
+        return {
+            'kind': 'scaler',
+            'mean': np.asarray(model.mean_ if model.with_mean else np.zeros(n), dtype=float),
+            'scale': np.asarray(model.scale_ if model.with_std else np.ones(n), dtype=float),
+        }
+    if kind == 'SVC':
+        classes = _binary_classes(model)
+        spec = {'kind': 'svc', 'classes': classes, 'intercept': float(model.intercept_[0])}
+        if model.kernel == 'linear':
+            spec['coef'] = np.asarray(model.coef_[0], dtype=float)
+        elif model.kernel == 'rbf':
+            spec['gamma'] = float(model._gamma)
+            spec['support_vectors'] = np.asarray(model.support_vectors_, dtype=float)
+            spec['dual_coef'] = np.asarray(model.dual_coef_[0], dtype=float)
+        else:
+            raise TypeError(f"SVC kernel '{model.kernel}' is not supported")
+        if model.probability:
+            spec['prob_a'] = float(model.probA_[0])
+            spec['prob_b'] = float(model.probB_[0])
+        return spec
+    if kind == 'LogisticRegression':
+        return {
+            'kind': 'logistic',
+            'classes': _binary_classes(model),
+            'coef': np.asarray(model.coef_[0], dtype=float),
+            'intercept': float(model.intercept_[0]),
+        }
+    if kind == 'KNeighborsClassifier':
+        if model.weights != 'uniform' or model.effective_metric_ != 'euclidean':
+            raise TypeError('Only uniform-weight euclidean KNeighborsClassifier is supported')
+        fit_X = np.asarray(model._fit_X, dtype=float)
+        return {
+            'kind': 'knn',
+            'classes': _binary_classes(model),
+            'k': int(model.n_neighbors),
+            'fit_X': fit_X,
+            'fit_y': np.asarray(model._y, dtype=np.int64),
+            'fit_sq_norms': (fit_X * fit_X).sum(axis=1),
+        }
+    if kind == 'VotingClassifier':
+        if model.voting != 'soft':
+            raise TypeError('Only soft VotingClassifier is supported')
+        estimators = [compile_model(estimator) for estimator in model.estimators_]
+        weights = model._weights_not_none
+        return {
+            'kind': 'voting',
+            'classes': _binary_classes(model),
+            'estimators': estimators,
+            'weights': np.ones(len(estimators)) if weights is None else np.asarray(weights, dtype=float),
+        }
+    raise TypeError(f'{kind} is not supported by the fast scorer')
+
+
+def _transform(spec, X):
+    if spec['kind'] == 'scaler':
+        return (X - spec['mean']) / spec['scale']
+    raise TypeError(f"{spec['kind']} is not a transform")
+
+
+def _svc_decision(spec, X):
+    if 'coef' in spec:
+        return X @ spec['coef'] + spec['intercept']
+    sv = spec['support_vectors']
+    sq_dist = (X * X).sum(axis=1)[:, None] - 2 * X @ sv.T + (sv * sv).sum(axis=1)[None, :]
+    return np.exp(-spec['gamma'] * np.maximum(sq_dist, 0)) @ spec['dual_coef'] + spec['intercept']
+
+
+# libsvm's overflow-safe sigmoid_predict, applied to sklearn's (sign-flipped)
+# binary decision function: the probability of classes[0]
+def _platt(decision, a, b):
+    f = -decision * a + b
+    e = np.exp(-np.abs(f))
+    p = np.where(f >= 0, e / (1 + e), 1 / (1 + e))
+    return np.clip(p, _LIBSVM_MIN_PROB, 1 - _LIBSVM_MIN_PROB)
+
+
+# Port of libsvm's multiclass_probability for k = 2. The copy of libsvm
+# bundled with sklearn runs it even for binary problems, so its output is
+# close to, but not exactly, the clipped Platt probability r01.
+def _libsvm_coupling_row(r01):
+    r10 = 1 - r01
+    q00, q11, q01 = r10 * r10, r01 * r01, -r10 * r01
+    p0 = p1 = 0.5
+    for _ in range(_LIBSVM_MAX_ITER):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        if max(abs(qp0 - pqp), abs(qp1 - pqp)) < _LIBSVM_EPS:
+            break
+        diff = (pqp - qp0) / q00
+        p0 += diff
+        pqp = (pqp + diff * (diff * q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+        qp1 = (qp1 + diff * q01) / (1 + diff)
+        p0 /= 1 + diff
+        p1 /= 1 + diff
+        diff = (pqp - qp1) / q11
+        p1 += diff
+        p0 /= 1 + diff
+        p1 /= 1 + diff
+    return p1
+
+
+# Vectorized form of the same iteration for batches. Rows that have
+# converged get a zero step, which leaves them unchanged.
+def _libsvm_coupling(r01):
+    if len(r01) <= 8:
+        return np.array([_libsvm_coupling_row(float(r)) for r in r01])
+    r10 = 1 - r01
+    q00, q11, q01 = r10 * r10, r01 * r01, -r10 * r01
+    p0 = np.full(len(r01), 0.5)
+    p1 = np.full(len(r01), 0.5)
+    for _ in range(_LIBSVM_MAX_ITER):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        active = np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp)) >= _LIBSVM_EPS
+        if not active.any():
+            break
+
+        diff = np.where(active, (pqp - qp0) / q00, 0.0)
+        p0 += diff
+        pqp = (pqp + diff * (diff * q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+        qp1 = (qp1 + diff * q01) / (1 + diff)
+        p0 /= 1 + diff
+        p1 /= 1 + diff
+
+        diff = np.where(active, (pqp - qp1) / q11, 0.0)
+        p1 += diff
+        p0 /= 1 + diff
+        p1 /= 1 + diff
+    return p1
+
+
+# Neighbours are ranked with the fast dot-product form of the squared
+# distance, then the best k + _KNN_SLACK candidates are re-ranked with exact
+# differences so rounding in the fast form cannot change which k are chosen
+def _knn_votes(spec, X):
+    fit_X, fit_y, fit_sq, k = spec['fit_X'], spec['fit_y'], spec['fit_sq_norms'], spec['k']
+    candidates = min(k + _KNN_SLACK, len(fit_X))
+    rows = max(1, _KNN_BLOCK // len(fit_X))
+    positive = np.empty(len(X))
+    for start in range(0, len(X), rows):
+        block = X[start:start + rows]
+        approx = (block * block).sum(axis=1)[:, None] - 2 * block @ fit_X.T + fit_sq
+        nearest = np.argpartition(approx, candidates - 1, axis=1)[:, :candidates]
+        delta = block[:, None, :] - fit_X[nearest]
+        exact = np.einsum('nij,nij->ni', delta, delta)
+        best = np.take_along_axis(nearest, np.argpartition(exact, k - 1, axis=1)[:, :k], axis=1)
+        positive[start:start + rows] = fit_y[best].sum(axis=1)
+    return positive / k
+
+
+# Probability of classes[1] for every row of X
+def _positive_proba(spec, X):
+    kind = spec['kind']
+    if kind == 'pipeline':
+        for step in spec['steps'][:-1]:
+            X = _transform(step, X)
+        return _positive_proba(spec['steps'][-1], X)
+    if kind == 'svc':
+        if 'prob_a' not in spec:
+            raise TypeError('SVC was fitted without probability=True')
+        return _libsvm_coupling(_platt(_svc_decision(spec, X), spec['prob_a'], spec['prob_b']))
+    if kind == 'logistic':
+        return 1 / (1 + np.exp(-(X @ spec['coef'] + spec['intercept'])))
+    if kind == 'knn':
+        return _knn_votes(spec, X)
+    if kind == 'voting':
+        probas = [_positive_proba(estimator, X) for estimator in spec['estimators']]
+        return np.average(probas, axis=0, weights=spec['weights'])
+    raise TypeError(f'{kind} cannot produce probabilities')
+
+
+# Predicted class index, following each estimator's own decision rule
+def _predict_index(spec, X):
+    kind = spec['kind']
+    if kind == 'pipeline':
+        for step in spec['steps'][:-1]:
+            X = _transform(step, X)
+        return _predict_index(spec['steps'][-1], X)
+    if kind == 'svc':
+        return (_svc_decision(spec, X) >= 0).astype(int)
+    if kind == 'logistic':
+        return (X @ spec['coef'] + spec['intercept'] > 0).astype(int)
+    return (_positive_proba(spec, X) > 0.5).astype(int)
+
+
+# Drop-in replacement for the sklearn model in predict_frame and friends
+class FastScorer:
+    def __init__(self, spec, source=None):
+        self.spec = spec
+        self.classes_ = np.asarray(spec['classes'])
+        self.source = source
+
+    def _array(self, X):
+        X = np.asarray(X, dtype=float)
+        return X.reshape(1, -1) if X.ndim == 1 else X
+
+    def predict_proba(self, X):
+        positive = _positive_proba(self.spec, self._array(X))
+        return np.column_stack([1 - positive, positive])
+
+    def predict(self, X):
+        return self.classes_[_predict_index(self.spec, self._array(X))]
+
+
+def scorer_dir(name):
+    return os.path.join(model_registry.artifacts_dir, name, 'fast')
+
+
+# Split a spec into a JSON-able structure and a dict of named arrays
+def _flatten(spec, arrays, prefix):
+    if isinstance(spec, dict):
+        return {key: _flatten(value, arrays, f'{prefix}{key}.') for key, value in spec.items()}
+    if isinstance(spec, list):
+        return [_flatten(value, arrays, f'{prefix}{index}.') for index, value in enumerate(spec)]
+    if isinstance(spec, np.ndarray):
+        key = prefix.rstrip('.')
+        arrays[key] = spec
+        return {'$array': f'{key}.npy'}
+    return spec
+
+
+def _unflatten(spec, directory):
+    if isinstance(spec, dict):
+        if '$array' in spec:
+            # A plain ndarray view of the map avoids np.memmap's per-operation overhead
+            return np.asarray(np.load(os.path.join(directory, spec['$array']), mmap_mode='r'))
+        return {key: _unflatten(value, directory) for key, value in spec.items()}
+    if isinstance(spec, list):
+        return [_unflatten(value, directory) for value in spec]
+    return spec
+
+
+def _arrays_hash(arrays):
+    digest = hashlib.sha256()
+    for key in sorted(arrays):
+        array = np.ascontiguousarray(arrays[key])
+        digest.update(f'{key}:{array.dtype.str}:{array.shape}'.encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _read_document(directory):
+    try:
+        with open(os.path.join(directory, 'scorer.json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# The arrays are written to a new directory named after their content, which
+# is renamed into place complete; scorer.json is swapped in last, so readers
+# only ever see a spec together with the arrays it was saved with
+def save_scorer(name, spec, source):
+    directory = scorer_dir(name)
+    os.makedirs(directory, exist_ok=True)
+    arrays = {}
+    structure = _flatten(spec, arrays, '')
+    arrays_dir = f'arrays-{_arrays_hash(arrays)}'
+    target = os.path.join(directory, arrays_dir)
+    if not os.path.isdir(target):
+        shutil.rmtree(f'{target}.tmp', ignore_errors=True)
+        os.makedirs(f'{target}.tmp')
+        for key, array in arrays.items():
+            np.save(os.path.join(f'{target}.tmp', f'{key}.npy'), array)
+        os.replace(f'{target}.tmp', target)
+    previous = _read_document(directory)
+    document = {
+        'spec': structure,
+        'arrays': arrays_dir,
+        'source': {
+            'file': os.path.relpath(source, model_registry.models_dir),
+            'sha256': model_registry.file_hash(source),
+        },
+    }
+    tmp_path = os.path.join(directory, 'scorer.json.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(document, file)
+    os.replace(tmp_path, os.path.join(directory, 'scorer.json'))
+    # Drop older array sets. The previous one is kept for readers that have
+    # read the old scorer.json but not opened its arrays yet; mapped files
+    # stay readable after they are unlinked.
+    keep = {arrays_dir, previous.get('arrays', '') if previous else None}
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if entry.startswith('arrays-') and entry not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+        elif entry.endswith('.npy') and '' not in keep:
+            # Arrays of the layout without arrays-<hash>/ directories
+            os.remove(path)
+
+
+def load_scorer(name):
+    directory = scorer_dir(name)
+    with open(os.path.join(directory, 'scorer.json')) as file:
+        document = json.load(file)
+    spec = _unflatten(document['spec'], os.path.join(directory, document.get('arrays', '')))
+    return FastScorer(spec, document['source'])
+
+
+# Compare the scorer with the sklearn model on the saved test split. Class
+# predictions must match exactly and probabilities to floating point noise.
+def verify(name, scorer, model, atol=1e-8):
+    X_test, _ = model_registry.get_test_data(name)
+    X = X_test.to_numpy(dtype=float)
+    sk_input = model_registry.model_input(model, X_test.astype(float))
+    mismatches = int((scorer.predict(X) != model.predict(sk_input)).sum())
+    max_error = float(np.abs(scorer.predict_proba(X) - model.predict_proba(sk_input)).max())
+    return {
+        'rows': len(X),
+        'prediction_mismatches': mismatches,
+        'max_probability_error': max_error,
+        'ok': mismatches == 0 and max_error <= atol,
+    }
+
+
+def compile_and_save(name):
+    model = model_registry.get_model(name)
+    scorer = FastScorer(compile_model(model))
+    report = verify(name, scorer, model)
+    if not report['ok']:
+        raise ValueError(f'Fast scorer for {name} does not match sklearn: {report}')
+    save_scorer(name, scorer.spec, model_registry.model_path(name))
+    return report
+
+
+# The compiled scorer is opt-in (FAST_SCORER=1). It is only used while the
+# model file it was compiled from is unchanged; otherwise the sklearn model
+# is served until the scorer is recompiled.
+_scorers = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return os.environ.get('FAST_SCORER', '0') == '1'
+
+
+def _compiled_scorer(name):
+    try:
+        stat = os.stat(os.path.join(scorer_dir(name), 'scorer.json'))
+    except FileNotFoundError:
+        return None
+    cached = _scorers.get(name)
+    if cached is None or cached[0] != stat.st_mtime_ns:
+        with _lock:
+            cached = _scorers[name] = (stat.st_mtime_ns, load_scorer(name))
+    scorer = cached[1]
+    path = model_registry.model_path(name)
+    if (os.path.relpath(path, model_registry.models_dir) != scorer.source['file']
+            or model_registry.content_hash(path) != scorer.source['sha256']):
+        logger.warning("Fast scorer for %s is stale; serving the sklearn model", name)
+        return None
+    return scorer
+
+
+# The object to score name with: the compiled scorer when enabled and
+# current, otherwise the sklearn model from the registry
+def get_predictor(name):
+    if enabled():
+        scorer = _compiled_scorer(name)
+        if scorer is not None:
+            return scorer
+    return model_registry.get_model(name)
+
+
+def _latency(predictor, X, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        predictor.predict_proba(X)
+    return (time.perf_counter() - start) / repeat
+
+
+# Compile, verify against sklearn and save every model:
+#   python fast_scorer.py
+def main():
+    parser = argparse.ArgumentParser(description='Compile the models into NumPy-only scorers.')
+    parser.add_argument('models', nargs='*', help='default: all models')
+    parser.add_argument('--repeat', type=int, default=200, help='iterations for the latency comparison')
+    args = parser.parse_args()
+    unknown = set(args.models) - set(model_registry.ARTIFACTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+
+    for name in args.models or sorted(model_registry.ARTIFACTS):
+        report = compile_and_save(name)
+        model = model_registry.get_model(name)
+        scorer = load_scorer(name)
+        X_test, _ = model_registry.get_test_data(name)
+        row = X_test.iloc[:1].astype(float)
+        sklearn_seconds = _latency(model, model_registry.model_input(model, row), args.repeat)
+        fast_seconds = _latency(scorer, row.to_numpy(), args.repeat)
+        report['single_row_us'] = {
+            'sklearn': round(sklearn_seconds * 1e6, 1),
+            'fast': round(fast_seconds * 1e6, 1),
+            'speedup': round(sklearn_seconds / fast_seconds, 1),
+        }
+        print(name, json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
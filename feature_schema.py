@@ -0,0 +1,159 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import model_registry
+
+# Declarative description of every model's input: names and order come from
+# the Datasets/ CSV header, dtype and observed range from its values, and
+# labels, units and allowed ranges from FIELDS below. The schema is written
+# into each artifact's manifest.json by model_artifacts.py and read back from
+# there, so forms, the API and batch scoring all validate against the same
+# definition as the model was exported with.
+#
+# Bounds are physical limits, not the training range: a value outside
+# [min, max] is rejected, while observed_min/observed_max only record what
+# the model was trained on.
+FIELDS = {
+    'diabetes': {
+        'Pregnancies': {'min': 0, 'max': 30},
+        'Glucose': {'unit': 'mg/dL', 'min': 0},
+        'BloodPressure': {'unit': 'mm Hg', 'min': 0},
+        'SkinThickness': {'unit': 'mm', 'min': 0},
+        'Insulin': {'unit': 'μU/mL', 'min': 0},
+        'BMI': {'unit': 'kg/m²', 'min': 0},
+        'DiabetesPedigreeFunction': {'min': 0},
+        'Age': {'unit': 'years', 'min': 0, 'max': 120},
+    },
+    'heart': {
+        'age': {'label': 'Age', 'unit': 'years', 'min': 0, 'max': 120},
+        'sex': {'label': 'Sex (1 = Male, 0 = Female)', 'min': 0, 'max': 1},
+        'cp': {'label': 'Chest Pain Type (0-3)', 'min': 0, 'max': 3},
+        'trestbps': {'label': 'Resting Blood Pressure', 'unit': 'mm Hg', 'min': 0},
+        'chol': {'label': 'Serum Cholesterol', 'unit': 'mg/dL', 'min': 0},
+        'fbs': {'label': 'Fasting Blood Sugar > 120 mg/dl (1 = True, 0 = False)', 'min': 0, 'max': 1},
+        'restecg': {'label': 'Resting ECG Results (0-2)', 'min': 0, 'max': 2},
+        'thalach': {'label': 'Maximum Heart Rate', 'unit': 'bpm', 'min': 0},
+        'exang': {'label': 'Exercise Induced Angina (1 = Yes, 0 = No)', 'min': 0, 'max': 1},
+        'oldpeak': {'label': 'ST Depression', 'min': 0},
+        'slope': {'label': 'Slope of Peak Exercise ST (0-2)', 'min': 0, 'max': 2},
+        'ca': {'label': 'Number of Major Vessels (0-4)', 'min': 0, 'max': 4},
+        'thal': {'label': 'Thal (0-3)', 'min': 0, 'max': 3},
+    },
+    'parkinsons': {
+        'MDVP:Fo(Hz)': {'unit': 'Hz', 'min': 0},
+        'MDVP:Fhi(Hz)': {'unit': 'Hz', 'min': 0},
+        'MDVP:Flo(Hz)': {'unit': 'Hz', 'min': 0},
+        'MDVP:Jitter(%)': {'unit': '%', 'min': 0},
+        'MDVP:Jitter(Abs)': {'unit': 's', 'min': 0},
+        'MDVP:RAP': {'min': 0},
+        'MDVP:PPQ': {'min': 0},
+        'Jitter:DDP': {'min': 0},
+        'MDVP:Shimmer': {'min': 0},
+        'MDVP:Shimmer(dB)': {'unit': 'dB', 'min': 0},
+        'Shimmer:APQ3': {'min': 0},
+        'Shimmer:APQ5': {'min': 0},
+        'MDVP:APQ': {'min': 0},
+        'Shimmer:DDA': {'min': 0},
+        'NHR': {'min': 0},
+        'HNR': {'unit': 'dB'},
+        'RPDE': {'min': 0, 'max': 1},
+        'DFA': {'min': 0, 'max': 1},
+        # Log-scale measure; every recording in the dataset is negative
+        'spread1': {},
+        'spread2': {'min': 0},
+        'D2': {'min': 0},
+        'PPE': {'min': 0},
+    },
+}
+
+_schemas = {}
+_lock = threading.Lock()
+
+
+# Schema derived from the training CSV and FIELDS; used when exporting
+def build_schema(name):
+    artifact = model_registry.ARTIFACTS[name]
+    data = pd.read_csv(model_registry.dataset_path(name), encoding='utf-8-sig')
+    schema = []
+    for feature in artifact['features']:
+        column = data[feature]
+        field = FIELDS[name].get(feature, {})
+        schema.append({
+            'name': feature,
+            'dtype': str(column.dtype),
+            'label': field.get('label', feature),
+            'unit': field.get('unit'),
+            'min': field.get('min'),
+            'max': field.get('max'),
+            'observed_min': column.min().item(),
+            'observed_max': column.max().item(),
+        })
+    return schema
+
+
+# The schema stored with the exported artifact, or one built from the
+# dataset when the model has not been exported (or predates schemas)
+def get_schema(name):
+    schema = _schemas.get(name)
+    if schema is None:
+        with _lock:
+            manifest = model_registry.read_manifest(name)
+            schema = manifest['features'] if manifest else None
+            if not schema or 'label' not in schema[0]:
+                schema = build_schema(name)
+            bounds = np.array([[np.nan if field[key] is None else field[key] for key in ('min', 'max')]
+                               for field in schema], dtype=np.float64)
+            _schemas[name] = schema = {
+                'fields': schema,
+                'names': [field['name'] for field in schema],
+                'low': np.where(np.isnan(bounds[:, 0]), -np.inf, bounds[:, 0]),
+                'high': np.where(np.isnan(bounds[:, 1]), np.inf, bounds[:, 1]),
+            }
+    return schema
+
+
+def fields(name):
+    return get_schema(name)['fields']
+
+
+def _describe(field):
+    low = '-inf' if field['min'] is None else field['min']
+    high = 'inf' if field['max'] is None else field['max']
+    return f"[{low}, {high}]"
+
+
+# Validate and coerce a batch of records for a model in one pass. data may be
+# a DataFrame, a list of {feature: value} records or a single record; extra
+# columns are ignored. Returns a float64 DataFrame with exactly the model's
+# columns in the model's order, or raises ValueError naming the offending
+# rows and columns.
+def validate(name, data, max_errors=5):
+    schema = get_schema(name)
+    names = schema['names']
+    if isinstance(data, dict):
+        data = [data]
+    frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame.from_records(data)
+
+    missing = [feature for feature in names if feature not in frame.columns]
+    if missing:
+        raise ValueError(f"Input is missing {name} features: {', '.join(missing)}")
+    try:
+        X = frame[names].to_numpy(dtype=np.float64)
+    except (TypeError, ValueError):
+        numeric = frame[names].apply(pd.to_numeric, errors='coerce')
+        bad = [feature for feature in names if (numeric[feature].isna() & frame[feature].notna()).any()]
+        raise ValueError(f"Non-numeric values in {name} features: {', '.join(bad)}") from None
+
+    invalid = ~np.isfinite(X) | (X < schema['low']) | (X > schema['high'])
+    if invalid.any():
+        rows, columns = np.nonzero(invalid)
+        problems = [f"row {frame.index[row]}: {names[column]}={float(X[row, column])!r} "
+                    f"(allowed {_describe(schema['fields'][column])})"
+                    for row, column in zip(rows[:max_errors], columns[:max_errors])]
+        if len(rows) > max_errors:
+            problems.append(f"and {len(rows) - max_errors} more")
+        raise ValueError(f"Invalid {name} input: {'; '.join(problems)}")
+    return pd.DataFrame(X, columns=names, index=frame.index)
+
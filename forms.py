@@ -0,0 +1,32 @@
+import streamlit as st
+
+import feature_schema
+
+
+def _label(field):
+    return f"{field['label']} ({field['unit']})" if field['unit'] else field['label']
+
+
+# One number input per feature of the model, laid out over columns in schema
+# order, with bounds and integer steps taken from the schema. Returns the
+# entered {feature: value} record. Features in skip are left out; key_prefix
+# keeps widget keys unique when several forms share a page.
+def patient_form(name, columns=3, skip=(), key_prefix=''):
+    fields = [field for field in feature_schema.fields(name) if field['name'] not in skip]
+    layout = st.columns(columns)
+    per_column = -(-len(fields) // columns)
+    record = {}
+    for index, field in enumerate(fields):
+        low, high = field['min'], field['max']
+        with layout[index // per_column]:
+            if field['dtype'].startswith('int'):
+                record[field['name']] = st.number_input(
+                    _label(field), min_value=low, max_value=high, value=max(low or 0, 0), step=1,
+                    key=f"{key_prefix}{field['name']}")
+            else:
+                small = 0 < abs(field['observed_min']) < 0.01
+                record[field['name']] = st.number_input(
+                    _label(field), min_value=None if low is None else float(low),
+                    max_value=None if high is None else float(high), value=max(float(low or 0), 0.0),
+                    format="%.6f" if small else "%.4f", key=f"{key_prefix}{field['name']}")
+    return record
@@ -0,0 +1,220 @@
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import pickle
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import VotingClassifier
+from sklearn.metrics import accuracy_score
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+from sklearn.utils import Bunch
+
+import calibration
+import evaluation
+import feature_schema
+import model_artifacts
+import model_registry
+import train
+
+logger = logging.getLogger(__name__)
+
+# Incremental model updates from newly labelled patient records. Only the new
+# rows are used; the served model is updated component by component:
+#   - fitted preprocessing (the scaler) is kept, so every component keeps
+#     seeing the feature space it was trained in
+#   - estimators with partial_fit are updated with it
+#   - KNN is refitted on its stored training rows plus the new ones, which
+#     is exactly what a full refit on the union would give
+#   - SVC is retrained on its support vectors plus the new rows (the usual
+#     support-vector incremental SVM); rows outside the margin would not
+#     have become support vectors, so little is lost
+# The candidate is scored on the held-out *_test_data.pkl split and only
+# promoted when its accuracy does not drop by more than max_drop. Incoming
+# rows whose features match a test-split row are dropped first, so the gate
+# never scores the candidate on rows it was trained on. Promotion
+# swaps the files in Saved models/ with os.replace; running apps and the API
+# reload on the next request because the registry watches the model hash.
+DEFAULT_MAX_DROP = 0.0
+
+
+def update_estimator(estimator, X, y):
+    if isinstance(estimator, Pipeline):
+        Xt = X
+        for _, step in estimator.steps[:-1]:
+            Xt = step.transform(Xt)
+        step_name, final = estimator.steps[-1]
+        updated = copy.copy(estimator)
+        updated.steps = estimator.steps[:-1] + [(step_name, update_estimator(final, Xt, y))]
+        return updated
+
+    if isinstance(estimator, VotingClassifier):
+        encoded = estimator.le_.transform(y)
+        updated = copy.copy(estimator)
+        updated.estimators_ = [update_estimator(member, X, encoded) for member in estimator.estimators_]
+        members = iter(updated.estimators_)
+        updated.named_estimators_ = Bunch(**{name: member if member == 'drop' else next(members)
+                                             for name, member in estimator.estimators})
+        return updated
+
+    if hasattr(estimator, 'partial_fit'):
+        updated = copy.deepcopy(estimator)
+        updated.partial_fit(X, y)
+        return updated
+
+    if isinstance(estimator, KNeighborsClassifier):
+        updated = clone(estimator)
+        updated.fit(np.vstack([estimator._fit_X, X]),
+                    np.concatenate([estimator.classes_[estimator._y], y]))
+        return updated
+
+    if isinstance(estimator, SVC) and estimator.kernel != 'precomputed':
+        # 'scale'/'auto' would be recomputed from the much smaller training
+        # set; keep the kernel width the model was tuned with
+        updated = clone(estimator)
+        if isinstance(estimator.gamma, str):
+            updated.set_params(gamma=estimator._gamma)
+        updated.fit(np.vstack([estimator.support_vectors_, X]),
+                    np.concatenate([np.repeat(estimator.classes_, estimator.n_support_), y]))
+        return updated
+
+    raise TypeError(f'{type(estimator).__name__} cannot be updated incrementally')
+
+
+# The model updated with the new rows, as a new object; model itself (shared
+# with every session through the registry) is left untouched
+def update_model(model, X, y):
+    unknown = set(np.unique(y)) - set(model.classes_)
+    if unknown:
+        raise ValueError(f'Labels {sorted(unknown)} are not classes of the model {list(model.classes_)}')
+    return update_estimator(model, model_registry.model_input(model, X), y)
+
+
+# Validated features and labels of a CSV or DataFrame of labelled records
+def read_labelled(name, source):
+    frame = source if isinstance(source, pd.DataFrame) else pd.read_csv(source, encoding='utf-8-sig')
+    target = model_registry.ARTIFACTS[name]['target']
+    if target not in frame.columns:
+        raise ValueError(f"Labelled {name} records need a '{target}' column")
+    if frame.empty:
+        raise ValueError(f'No labelled {name} records')
+    labels = pd.to_numeric(frame[target], errors='coerce')
+    if labels.isna().any():
+        rows = list(frame.index[labels.isna()][:5])
+        raise ValueError(f"Missing or non-numeric '{target}' in rows {rows}")
+    return feature_schema.validate(name, frame), labels.to_numpy()
+
+
+# Rows of X, y whose features are not in name's test split, and how many
+# were dropped
+def drop_test_rows(name, X, y):
+    X_test, _ = model_registry.get_test_data(name)
+    held_out = np.isin(train.row_hashes(X), train.row_hashes(X_test))
+    if held_out.all():
+        raise ValueError(f'Every labelled {name} record is in the test split')
+    keep = ~held_out
+    return X[keep].reset_index(drop=True), y[keep], int(held_out.sum())
+
+
+def test_accuracy(name, model):
+    X_test, y_test = model_registry.get_test_data(name)
+    return float(accuracy_score(y_test, model.predict(model_registry.model_input(model, X_test))))
+
+
+# Write the updated model the same way train.py does, recording its parent.
+# The calibration is fitted first, on the updated model's own scores for
+# the test split, and written just before the model is swapped in, so the
+# new version is never served without it.
+def promote(name, model, update):
+    import fast_scorer
+
+    fitted = calibration.fit_heldout_calibration(model, *model_registry.get_test_data(name))
+    source = model_registry.artifact_path(name, 'model')
+    train._dump(model, source, pickle.dump)
+    manifest = model_artifacts.export_artifact(
+        name, model, source, update=update,
+        before_swap=lambda manifest: calibration.write_calibration(
+            calibration.calibration_path(name), fitted, manifest['model_version']))
+    try:
+        fast_scorer.compile_and_save(name)
+    except (TypeError, ValueError) as e:
+        logger.warning("Fast scorer for %s not compiled: %s", name, e)
+    evaluation.write_metrics(name, evaluation.compute_metrics(name))
+    return manifest
+
+
+# Update name with labelled records and promote the result if it holds up on
+# the test split, or with stage, make it the shadow candidate (see shadow.py)
+# instead of replacing the served model. Returns a report of what was done.
+def update(name, source, max_drop=DEFAULT_MAX_DROP, dry_run=False, stage=False):
+    X, y = read_labelled(name, source)
+    X, y, dropped = drop_test_rows(name, X, y)
+    parent = model_registry.model_version(name)
+    model = model_registry.get_model(name)
+    candidate = update_model(model, X, y)
+
+    baseline_accuracy = test_accuracy(name, model)
+    candidate_accuracy = test_accuracy(name, candidate)
+    report = {
+        'model': name,
+        'rows': int(len(y)),
+        'dropped_test_rows': dropped,
+        'parent_version': parent,
+        'baseline_accuracy': baseline_accuracy,
+        'candidate_accuracy': candidate_accuracy,
+        'promoted': False,
+    }
+    if candidate_accuracy < baseline_accuracy - max_drop:
+        report['reason'] = f'test accuracy dropped by more than {max_drop}'
+        return report
+    if dry_run:
+        report['reason'] = 'dry run'
+        return report
+    # Another update (or a retrain) got there first; this one was built on
+    # a model that is no longer served
+    if model_registry.model_version(name) != parent:
+        report['reason'] = 'model changed during the update'
+        return report
+
+    rows_hash = hashlib.sha256(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes()
+                               + np.ascontiguousarray(y).tobytes()).hexdigest()
+    lineage = {
+        'parent_version': parent,
+        'rows': int(len(y)),
+        'rows_sha256': rows_hash,
+        'baseline_accuracy': baseline_accuracy,
+        'test_accuracy': candidate_accuracy,
+    }
+    if stage:
+        import shadow
+
+        manifest = shadow.stage(name, candidate, update=lineage)
+        report['staged'] = True
+    else:
+        manifest = promote(name, candidate, lineage)
+        report['promoted'] = True
+    report['model_version'] = manifest['model_version']
+    return report
+
+
+#   python incremental.py <model> new_rows.csv [--max-drop 0.01] [--dry-run] [--stage]
+# new_rows.csv has the model's feature columns and its target column.
+def main():
+    parser = argparse.ArgumentParser(description='Update a model with newly labelled records.')
+    parser.add_argument('model', choices=sorted(model_registry.ARTIFACTS))
+    parser.add_argument('source', help='CSV of labelled records')
+    parser.add_argument('--max-drop', type=float, default=DEFAULT_MAX_DROP,
+                        help='largest allowed drop in test accuracy (default: %(default)s)')
+    parser.add_argument('--dry-run', action='store_true', help='validate without promoting')
+    parser.add_argument('--stage', action='store_true', help='stage as a shadow candidate instead of promoting')
+    args = parser.parse_args()
+    print(json.dumps(update(args.model, args.source, args.max_drop, args.dry_run, args.stage)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,131 +1,339 @@
-import pickle
+import io
 import os
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import confusion_matrix, precision_recall_curve, auc
+import time
+_script_start = time.perf_counter()
+
 import streamlit as st
 from streamlit_option_menu import option_menu
 
+import model_registry
+import prediction_cache
+import telemetry
+import theme
+
+from calibration import get_calibration, usable_points
+from forms import patient_form
 from home import app as show_home_page
 from about import app as show_about_page
 from contact import app as show_contact_page
 
+telemetry.record_phase('import', time.perf_counter() - _script_start)
+telemetry.record_span('script_import', time.perf_counter() - _script_start)
+_render_start = time.perf_counter()
+
 st.set_page_config(
     page_title="Patient Sickness Prediction App",
     page_icon="🏥",
     layout="wide"
 )
-page_bg_img = f"""
-<style>
-[data-testid="stAppViewContainer"]{{
-background-image: url("https://images.unsplash.com/photo-1478760329108-5c3ed9d495a0?w=500&auto=format&fit=crop&q=60&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxzZWFyY2h8MTl8fGRhcmt8ZW58MHx8MHx8fDA%3D");
-background-size: 180%;
-background-position: top left;
-background-repeat: no-repeat;
-background-attachment: local;
-background-size: cover;
-}}
-
-[data-testid="stSidebar"] > div:first-child {{
-background-image: url("https://images.unsplash.com/photo-1637775297458-7443ffd545b2?w=500&auto=format&fit=crop&q=60&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxzZWFyY2h8NHx8YmxhY2t8ZW58MHx8MHx8fDA%3D");
-background-position: center; 
-background-repeat: no-repeat;
-background-attachment: fixed;
-background-size: cover;
-}}
-
-[data-testid="stHeader"] {{
-background: rgba(0,0,0,0);
-}}
-
-[data-testid="stToolbar"] {{
-right: 2rem;
-}}
-</style>
-"""
-
-st.markdown(page_bg_img, unsafe_allow_html=True)
-models_dir = os.path.join(os.path.dirname(__file__), 'Saved models')
-
-def load_model(model_path):
-    if not os.path.exists(model_path):
-        st.error(f"Model file missing: {model_path}")
-        st.stop()
-    with open(model_path, 'rb') as file:
-        return pickle.load(file)
+# The background CSS is built once per process (see theme.py); each rerun
+# only sends the same string again
+st.markdown(theme.PAGE_BG_CSS, unsafe_allow_html=True)
+
+# The debug panel is opened with ?debug=1 in the URL, or for every session
+# with TELEMETRY_DEBUG_PANEL=1. Profiling is switched on per session from the
+# panel and samples each rerun until switched off.
+debug_panel = st.query_params.get('debug') == '1' or os.environ.get('TELEMETRY_DEBUG_PANEL') == '1'
+if st.session_state.get('profiler') is not None:
+    st.session_state.profiler.stop()
+    st.session_state.profiler = None
+if debug_panel and st.session_state.get('profile_session'):
+    st.session_state.profiler = telemetry.SamplingProfiler().start()
 
-def load_test_data(file_name):
-    file_path = os.path.join(models_dir, file_name)
-    if not os.path.exists(file_path):
-        st.error(f"❌ Missing test data file: {file_name}")
+# Models and test data are cached process-wide by the registry, so reruns and
+# other sessions reuse the same objects until the file on disk changes.
+# Each prediction page loads only its own model, on first use.
+def load_model(name):
+    try:
+        with telemetry.phase('load'), telemetry.span('load_model', model=name):
+            return model_registry.get_model(name)
+    except FileNotFoundError:
+        st.error(f"Model file missing: {model_registry.model_path(name)}")
         st.stop()
-    with open(file_path, 'rb') as file:
-        return pickle.load(file)
 
-# Load models + test data
-diabetes_model = load_model(os.path.join(models_dir, 'diabetes_model.sav'))
-diabetes_X_test, diabetes_y_test = load_test_data('diabetes_test_data.pkl')
+# Score one patient's {feature: value} record, validated against the model's
+# feature schema. Identical inputs (reruns, repeated clicks) are answered from
+# the prediction cache.
+def predict_patient(name, model, record):
+    import drift
+    import feature_schema
+    import shadow
 
-heart_model = load_model(os.path.join(models_dir, 'hybrid_heart_disease_model.sav'))
-heart_X_test, heart_y_test = load_test_data('heart_test_data.pkl')
+    drift.observe(name, record)
+    role = shadow.route(name)
 
-parkinsons_model = load_model(os.path.join(models_dir, 'hybrid_parkinsons_model.sav'))
-parkinsons_X_test, parkinsons_y_test = load_test_data('parkinsons_test_data.pkl')
+    def compute():
+        telemetry.increment('predictions', model=name, source='model')
+        with telemetry.span('predict', model=name):
+            predictions, probabilities = shadow.score(name, feature_schema.validate(name, record), role, model)
+        return int(predictions[0]), float(probabilities[0])
+
+    telemetry.increment('prediction_requests', model=name)
+    # The cache only holds the primary model's answers
+    cache = prediction_cache.get_cache() if role == 'primary' else None
+    return cache.get_or_compute(name, record, compute) if cache else compute()
 
 # Sidebar
 with st.sidebar:
     selected = option_menu('Patient Sickness Prediction App',
-                           ['Home', 'Diabetes Prediction', 'Heart Disease Prediction', 'Parkinsons Prediction', 'About', 'Contact'],
-                           icons=['house', 'activity', 'heart', 'person', 'info-circle', 'envelope'],
+                           ['Home', 'Diabetes Prediction', 'Heart Disease Prediction', 'Parkinsons Prediction',
+                            'Screening', 'Batch Scoring', 'About', 'Contact'],
+                           icons=['house', 'activity', 'heart', 'person', 'clipboard2-pulse',
+                                  'file-earmark-spreadsheet', 'info-circle', 'envelope'],
                            default_index=0)
 
+    with st.expander('Performance'):
+        if not telemetry.in_cold_start():
+            st.caption(f"Cold start: {telemetry.startup_report()}")
+        for stat in model_registry.registry_stats():
+            st.caption(f"{stat['artifact']}: loaded in {stat['load_seconds']}s, "
+                       f"{stat['memory_mib']} MiB, {stat['hits']} cache hits")
+        cache = prediction_cache.get_cache()
+        if cache:
+            st.caption(f"Prediction cache: {cache.stats()}")
+        import shadow
+        for name in model_registry.ARTIFACTS:
+            if shadow.candidate_version(name):
+                st.caption(f"Candidate {name}: {shadow.report(name)}")
+        import drift
+        for alert in drift.recent_alerts()[-5:]:
+            st.caption(f"Input drift in {alert['model']}: {alert['feature']} {alert['kind']}="
+                       f"{alert['value']} (limit {alert['limit']})")
+
+    if debug_panel:
+        with st.expander('Debug', expanded=True):
+            st.caption('Timing spans')
+            st.dataframe(telemetry.span_stats(), hide_index=True)
+            st.caption('Counters')
+            st.dataframe(telemetry.counter_stats(), hide_index=True)
+            st.caption('Memory')
+            st.dataframe([{'gauge': name, **labels, 'value': value}
+                          for name, labels, value in telemetry.memory_gauges()], hide_index=True)
+            st.toggle('Profile this session', key='profile_session')
+            if st.session_state.get('last_profile'):
+                st.caption('Sampled profile of the previous rerun')
+                st.dataframe(st.session_state.last_profile, hide_index=True)
+            with st.popover('Prometheus metrics'):
+                st.code(telemetry.prometheus_text(), language='text')
+
 # Confusion Matrix & PR Curve
-def plot_confusion_matrix(y_test, y_pred):
-    cm = confusion_matrix(y_test, y_pred)
-    fig, ax = plt.subplots()
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues')
-    st.pyplot(fig)
-
-def plot_pr_curve(y_test, y_probs):
-    precision, recall, _ = precision_recall_curve(y_test, y_probs)
-    pr_auc = auc(recall, precision)
-    fig, ax = plt.subplots()
-    ax.plot(recall, precision, label=f'PR Curve (AUC = {pr_auc:.2f})', color='green')
-    ax.legend()
-    st.pyplot(fig)
-
-if selected == 'Home':
-    show_home_page()
+# The charts are Vega-Lite specs built once per model version (see charts.py)
+# and drawn by the browser, so no figures are rendered or kept on the server.
+# The rendered elements are cached per model version too, so later reruns
+# replay them instead of serializing the specs again. Telemetry stays out of
+# the cached function, which only runs on a cache miss: the specs are loaded
+# (a dictionary hit after the first time) and the charts rendered or
+# replayed under spans on every run.
+def show_metrics(name):
+    import charts
+
+    with telemetry.phase('load'):
+        specs = charts.get_charts(name)
+    with telemetry.span('render', chart='metrics', model=name):
+        render_metrics(name, model_registry.model_version(name), specs)
+
+# _specs is left out of the cache key; the model version stands for it
+@st.cache_data(show_spinner=False)
+def render_metrics(name, version, _specs):
+    st.subheader("Confusion Matrix")
+    st.vega_lite_chart(spec=_specs['confusion_matrix'], use_container_width=True)
+    st.subheader("Precision-Recall Curve")
+    st.vega_lite_chart(spec=_specs['pr_curve'], use_container_width=True)
+
+# Why the model decided as it did: the features that moved this patient's
+# prediction most, relative to an average patient (see explanations.py).
+# Computed once per prediction and kept with it in session state.
+def show_explanation(name, prediction, top=8):
+    import charts
+
+    if 'explanation' not in prediction:
+        import explanations
+        import feature_schema
+
+        with telemetry.span('explain', model=name):
+            explanation = explanations.explain(name, feature_schema.validate(name, prediction['record']))
+        prediction['explanation'] = {
+            'caption': f"Largest feature contributions ({explanation['method']}, {explanation['units']}); "
+                       f"the average patient scores {explanation['base_value']:.3f}",
+            'spec': charts.contributions_spec(explanations.contributions_dict(explanation, top=top),
+                                              explanation['units']),
+        }
+    st.subheader('Why')
+    st.caption(prediction['explanation']['caption'])
+    st.vega_lite_chart(spec=prediction['explanation']['spec'], use_container_width=True)
+
+# Home and About are static: their elements are recorded on the first run in
+# the process and replayed from Streamlit's cache afterwards
+@st.cache_data(show_spinner=False)
+def show_static_page(page):
+    {'Home': show_home_page, 'About': show_about_page}[page]()
+
+# Each interactive panel is a fragment: interacting with it reruns only that
+# panel, not the page config, CSS, sidebar and menu above it. Results are
+# kept in session state, so they survive reruns and are shown again without
+# recomputing while the inputs still match.
+# The patient forms are st.forms, so editing a value causes no rerun at all;
+# the panel reruns once, when the button is pressed.
+@st.fragment
+def prediction_panel(name, button, outcomes):
+    with telemetry.span('fragment', panel=name):
+        model = load_model(name)
+        with st.form(f'{name}_form', border=False):
+            record = patient_form(name, key_prefix=f'{name}_')
+            submitted = st.form_submit_button(button)
+        if submitted:
+            result, probability = predict_patient(name, model, record)
+            st.session_state[f'{name}_prediction'] = {'record': record, 'result': result,
+                                                      'probability': probability}
+
+        prediction = st.session_state.get(f'{name}_prediction')
+        if prediction is not None and prediction['record'] == record:
+            st.success(outcomes[prediction['result']])
+            st.caption(f"Risk: {prediction['probability']:.1%}")
+            show_explanation(name, prediction)
+
+            # Show Metrics
+            show_metrics(name)
+
+SCREENING_LABELS = {'diabetes': 'Diabetes', 'heart': 'Heart Disease', 'parkinsons': "Parkinson's"}
+
+@st.fragment
+def screening_panel():
+    import screening
+
+    with telemetry.span('fragment', panel='screening'):
+        record = patient_form('heart', columns=1,
+                              skip=set(model_registry.ARTIFACTS['heart']['features']) - {'age'},
+                              key_prefix='screen_')
+        for name, tab in zip(SCREENING_LABELS, st.tabs(list(SCREENING_LABELS.values()))):
+            with tab:
+                if st.checkbox(f'Screen for {SCREENING_LABELS[name]}', True, key=f'screen_include_{name}'):
+                    record.update(patient_form(name, skip=screening.ALIASES, key_prefix='screen_'))
+
+        if st.button('Screen Patient'):
+            try:
+                st.session_state.screening_report = {'record': record, 'report': screening.screen_patient(record)}
+            except ValueError as e:
+                st.session_state.screening_report = None
+                st.error(str(e))
+
+        last = st.session_state.get('screening_report')
+        if last is not None and last['record'] == record:
+            report = last['report']
+            for name in report['flagged']:
+                st.warning(f"{SCREENING_LABELS[name]}: positive ({report['models'][name]['probability']:.0%})")
+            if not report['flagged']:
+                st.success('No disease predicted')
+            st.dataframe([{'disease': SCREENING_LABELS[name], 'prediction': result['prediction'],
+                           'probability': round(result['probability'], 4)}
+                          for name, result in report['models'].items()], hide_index=True)
+
+# A finished file job is kept in session state (under key) so its download
+# button survives the panel's reruns
+def show_file_result(key, label, file_name):
+    result = st.session_state.get(key)
+    if result is not None:
+        st.success(result['message'])
+        st.download_button(label, result['output'], file_name=file_name, mime='text/csv')
+
+@st.fragment
+def bulk_screening_panel():
+    import screening
+
+    with telemetry.span('fragment', panel='bulk_screening'):
+        uploaded = st.file_uploader('Patients (CSV with the columns of any of the Datasets/ files)', type='csv')
+        if uploaded is not None and st.button('Screen File'):
+            progress = st.empty()
+            output = io.StringIO()
+            try:
+                summary = screening.screen_csv(uploaded, output,
+                                               progress=lambda rows: progress.caption(f'{rows} patients screened'))
+            except ValueError as e:
+                st.session_state.bulk_screening = None
+                st.error(str(e))
+            else:
+                st.session_state.bulk_screening = {
+                    'message': f"Screened {summary['rows']} patients in {summary['seconds']}s",
+                    'output': output.getvalue(),
+                }
+        show_file_result('bulk_screening', 'Download Report', 'screening_report.csv')
+
+@st.fragment
+def batch_scoring_panel():
+    with telemetry.span('fragment', panel='batch_scoring'):
+        disease = st.selectbox('Model', list(model_registry.ARTIFACTS))
+        uploaded = st.file_uploader('Patient records (CSV)', type='csv')
+        explain = st.checkbox('Add per-feature contribution columns (slower)')
+        calibration = get_calibration(disease)
+        points = usable_points(calibration)
+        operating_point = st.selectbox('Decision threshold', ['Model default'] + points,
+                                       help='Calibrated thresholds that reach a recall or precision target')
+
+        if uploaded is not None and st.button('Score File'):
+            import batch_scoring
+
+            load_model(disease)
+            progress = st.empty()
+            output = io.StringIO()
+            try:
+                summary = batch_scoring.score_csv(disease, uploaded, output,
+                                                  progress=lambda rows: progress.caption(f'{rows} rows scored'),
+                                                  explain=explain,
+                                                  operating_point=None if operating_point == 'Model default'
+                                                  else operating_point)
+            except ValueError as e:
+                st.session_state.batch_scoring = None
+                st.error(str(e))
+            else:
+                st.session_state.batch_scoring = {
+                    'disease': disease,
+                    'message': f"Scored {summary['rows']} rows in {summary['seconds']}s "
+                               f"({summary['rows_per_second']} rows/s)",
+                    'output': output.getvalue(),
+                }
+        last = st.session_state.get('batch_scoring')
+        if last is not None:
+            show_file_result('batch_scoring', 'Download Results', f"{last['disease']}_predictions.csv")
+
+if selected in ('Home', 'About'):
+    show_static_page(selected)
 
 elif selected == 'Diabetes Prediction':
     st.title('Diabetes Prediction')
-    Pregnancies = st.number_input('Pregnancies', 0)
-    Glucose = st.number_input('Glucose', 0)
-    BloodPressure = st.number_input('BloodPressure', 0)
-    SkinThickness = st.number_input('SkinThickness', 0)
-    Insulin = st.number_input('Insulin', 0)
-    BMI = st.number_input('BMI', 0.0)
-    DPF = st.number_input('DiabetesPedigreeFunction', 0.0)
-    Age = st.number_input('Age', 0)
-
-    if st.button('Predict Diabetes'):
-        X_input = [[Pregnancies, Glucose, BloodPressure, SkinThickness, Insulin, BMI, DPF, Age]]
-        result = diabetes_model.predict(X_input)[0]
-        st.success('Diabetic' if result else 'Not Diabetic')
-
-        # Show Metrics
-        y_probs = diabetes_model.predict_proba(diabetes_X_test)[:, 1]
-        y_preds = diabetes_model.predict(diabetes_X_test)
-        st.subheader("Confusion Matrix")
-        plot_confusion_matrix(diabetes_y_test, y_preds)
-        st.subheader("Precision-Recall Curve")
-        plot_pr_curve(diabetes_y_test, y_probs)
-
-# (Repeat similarly for Heart & Parkinson's Prediction)
-
-elif selected == 'About':
-    show_about_page()
+    prediction_panel('diabetes', 'Predict Diabetes', ('Not Diabetic', 'Diabetic'))
+
+elif selected == 'Heart Disease Prediction':
+    st.title('Heart Disease Prediction')
+    prediction_panel('heart', 'Predict Heart Disease', ('No Heart Disease', 'Heart Disease'))
+
+elif selected == 'Parkinsons Prediction':
+    st.title("Parkinson's Prediction")
+    prediction_panel('parkinsons', "Predict Parkinson's", ("No Parkinson's Disease", "Parkinson's Disease"))
+
+elif selected == 'Screening':
+    st.title('Combined Screening')
+    st.markdown('Enter one patient and screen them for every selected disease at once; '
+                'the models run in parallel.')
+    screening_panel()
+
+    st.subheader('Bulk Intake')
+    bulk_screening_panel()
+
+elif selected == 'Batch Scoring':
+    st.title('Batch Scoring')
+    st.markdown('Upload a CSV in the same column layout as the matching file in `Datasets/`. '
+                'Rows are scored in chunks and returned with `prediction` and `probability` columns.')
+    batch_scoring_panel()
 
 elif selected == 'Contact':
     show_contact_page()
+
+if st.session_state.get('profiler') is not None:
+    st.session_state.last_profile = st.session_state.profiler.stop().top_functions()
+    st.session_state.profiler = None
+telemetry.record_span('rerun', time.perf_counter() - _script_start, page=selected)
+
+if telemetry.in_cold_start():
+    telemetry.record_phase('first_render', time.perf_counter() - _render_start
+                           - telemetry.phase_seconds('load'))
+    telemetry.finish_cold_start()
@@ -0,0 +1,122 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+import model_registry
+import shadow
+import telemetry
+
+# Defaults can be tuned per deployment without code changes
+MAX_BATCH_SIZE = int(os.environ.get('MICROBATCH_MAX_SIZE', 64))
+MAX_WAIT_MS = float(os.environ.get('MICROBATCH_WAIT_MS', 5))
+
+
+# Collects concurrent single-patient requests for one model and scores them
+# together. A batch is closed when it reaches max_batch_size or when the
+# oldest request in it has waited max_wait_ms, whichever comes first.
+class MicroBatcher:
+    def __init__(self, name, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.name = name
+        self.features = model_registry.ARTIFACTS[name]['features']
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._batch_sizes = Counter()
+        self._latencies = deque(maxlen=10_000)
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f'microbatch-{name}', daemon=True)
+        self._thread.start()
+
+    # Queue one {feature: value} record; the future resolves to
+    # (prediction, probability)
+    def submit(self, record):
+        missing = [feature for feature in self.features if feature not in record]
+        if missing:
+            raise ValueError(f"Record is missing {self.name} features: {', '.join(missing)}")
+        future = Future()
+        self._queue.put((record, future, time.perf_counter()))
+        return future
+
+    def predict(self, record, timeout=None):
+        return self.submit(record).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            records = [record for record, _, _ in batch]
+            try:
+                frame = pd.DataFrame.from_records(records, columns=self.features)
+                with telemetry.span('predict_batch', model=self.name):
+                    predictions, probabilities = shadow.score(self.name, frame)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for (_, future, queued), prediction, probability in zip(batch, predictions, probabilities):
+                future.set_result((int(prediction), float(probability)))
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._latencies.extend(done - queued for _, _, queued in batch)
+
+    # Queue depth, batch size histogram (power-of-two buckets) and request
+    # latency percentiles over the most recent requests
+    def stats(self):
+        with self._stats_lock:
+            sizes = dict(self._batch_sizes)
+            latencies = np.array(self._latencies)
+        histogram = Counter()
+        for size, count in sizes.items():
+            histogram[f'<={1 << (size - 1).bit_length()}'] += count
+        stats = {
+            'model': self.name,
+            'queue_depth': self._queue.qsize(),
+            'batches': sum(sizes.values()),
+            'requests': sum(size * count for size, count in sizes.items()),
+            'batch_size_histogram': dict(sorted(histogram.items(), key=lambda item: int(item[0][2:]))),
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+        if len(latencies):
+            stats['latency_p50_ms'] = round(float(np.percentile(latencies, 50)) * 1000, 3)
+            stats['latency_p99_ms'] = round(float(np.percentile(latencies, 99)) * 1000, 3)
+        return stats
+
+
+_batchers = {}
+_lock = threading.Lock()
+
+
+# One scheduler per disease model, shared by the whole process
+def get_batcher(name):
+    batcher = _batchers.get(name)
+    if batcher is None:
+        with _lock:
+            batcher = _batchers.get(name)
+            if batcher is None:
+                batcher = _batchers[name] = MicroBatcher(name)
+    return batcher
+
+
+def batcher_stats():
+    return [batcher.stats() for _, batcher in sorted(_batchers.items())]
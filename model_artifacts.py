@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+
+import joblib
+
+import feature_schema
+import model_registry
+
+# Versioned model artifacts. Each model gets a directory under
+# Saved models/artifacts/<name>/ holding:
+#   model.joblib   - uncompressed joblib dump; its numpy arrays (support
+#                    vectors, coefficients, KNN training rows, scaler
+#                    statistics) are stored raw so they can be memory-mapped
+#   manifest.json  - the feature schema (names, order, dtype, label, unit,
+#                    allowed and observed ranges; see feature_schema.py),
+#                    content hashes of the model and its training data, and
+#                    library versions
+
+
+def build_manifest(name, model, model_file):
+    artifact = model_registry.ARTIFACTS[name]
+    dataset = model_registry.dataset_path(name)
+    return {
+        'format_version': model_registry.ARTIFACT_FORMAT_VERSION,
+        'name': name,
+        'model_class': f'{type(model).__module__}.{type(model).__name__}',
+        'model_version': model_registry.file_hash(model_file),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'features': feature_schema.build_schema(name),
+        'target': artifact['target'],
+        'training_data': {
+            'file': os.path.relpath(dataset, model_registry.base_dir),
+            'sha256': model_registry.file_hash(dataset),
+        },
+        'libraries': model_registry.library_versions(),
+    }
+
+
+# Write model and manifest for name. Both files are written to temporary
+# names first and swapped in with os.replace, model before manifest. update
+# records where an incrementally updated model came from (see incremental.py).
+# directory defaults to the served artifact; shadow.py stages candidates
+# elsewhere. before_swap(manifest) runs once the new model version is known
+# but before it is served, to write files that belong to it (the calibration).
+def export_artifact(name, model=None, source=None, update=None, directory=None, before_swap=None):
+    if model is None:
+        source = source or model_registry.artifact_path(name, 'model')
+        model = model_registry.load_artifact(source)
+    if not hasattr(model, 'predict'):
+        raise TypeError(f'Cannot export {name}: {type(model).__name__} is not a fitted model')
+
+    directory = directory or os.path.join(model_registry.artifacts_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    model_file = os.path.join(directory, 'model.joblib')
+    manifest_file = os.path.join(directory, 'manifest.json')
+
+    joblib.dump(model, f'{model_file}.tmp')
+    manifest = build_manifest(name, model, f'{model_file}.tmp')
+    if source is not None:
+        manifest['source'] = {
+            'file': os.path.basename(source),
+            'sha256': model_registry.file_hash(source),
+        }
+    if update is not None:
+        manifest['update'] = update
+    with open(f'{manifest_file}.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    if before_swap is not None:
+        before_swap(manifest)
+    os.replace(f'{model_file}.tmp', model_file)
+    os.replace(f'{manifest_file}.tmp', manifest_file)
+    return manifest
+
+
+# Convert the pickled .sav models, or show what is currently exported:
+#   python model_artifacts.py export [diabetes heart parkinsons]
+#   python model_artifacts.py show
+def main():
+    parser = argparse.ArgumentParser(description='Manage versioned model artifacts.')
+    parser.add_argument('command', choices=['export', 'show'])
+    parser.add_argument('models', nargs='*', help='default: all models')
+    args = parser.parse_args()
+    unknown = set(args.models) - set(model_registry.ARTIFACTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+
+    for name in args.models or sorted(model_registry.ARTIFACTS):
+        if args.command == 'export':
+            manifest = export_artifact(name)
+        else:
+            manifest = model_registry.read_manifest(name)
+            if manifest is None:
+                print(f'{name}: no versioned artifact')
+                continue
+        print(f"{name}: {manifest['model_class']} version {manifest['model_version'][:12]} "
+              f"(sklearn {manifest['libraries']['scikit-learn']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+from importlib import metadata
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+models_dir = os.path.join(base_dir, 'Saved models')
+datasets_dir = os.path.join(base_dir, 'Datasets')
+
+# Versioned artifacts written by model_artifacts.py. When present they take
+# precedence over the pickled .sav files.
+artifacts_dir = os.path.join(models_dir, 'artifacts')
+ARTIFACT_FORMAT_VERSION = 1
+
+# Saved artifacts for each disease model and its training CSV in Datasets/
+# with the label column (and identifier columns that are not features). The
+# feature columns, in the order the model expects, are read from the CSV
+# header below; feature_schema.py describes them in full.
+ARTIFACTS = {
+    'diabetes': {
+        'model': 'diabetes_model.sav',
+        'test_data': 'diabetes_test_data.pkl',
+        'dataset': 'diabetes.csv',
+        'target': 'Outcome',
+        'id_columns': [],
+    },
+    'heart': {
+        'model': 'hybrid_heart_disease_model.sav',
+        'test_data': 'heart_test_data.pkl',
+        'dataset': 'heart.csv',
+        'target': 'target',
+        'id_columns': [],
+    },
+    'parkinsons': {
+        'model': 'hybrid_parkinsons_model.sav',
+        'test_data': 'parkinsons_data.pkl',
+        'dataset': 'parkinsons.csv',
+        'target': 'status',
+        'id_columns': ['name'],
+    },
+}
+
+
+def dataset_features(name):
+    artifact = ARTIFACTS[name]
+    with open(os.path.join(datasets_dir, artifact['dataset']), newline='', encoding='utf-8-sig') as file:
+        header = next(csv.reader(file))
+    return [column for column in header if column != artifact['target'] and column not in artifact['id_columns']]
+
+
+for _name, _artifact in ARTIFACTS.items():
+    _artifact['features'] = dataset_features(_name)
+
+# Process-wide cache shared by every Streamlit session (this module is only
+# imported once per process, while main.py is re-executed on every rerun)
+_entries = {}
+_hashes = {}
+_lock = threading.Lock()
+
+
+def artifact_path(name, kind='model'):
+    return os.path.join(models_dir, ARTIFACTS[name][kind])
+
+
+def dataset_path(name):
+    return os.path.join(datasets_dir, ARTIFACTS[name]['dataset'])
+
+
+def manifest_path(name):
+    return os.path.join(artifacts_dir, name, 'manifest.json')
+
+
+# The model file to serve: the versioned artifact if one has been exported,
+# otherwise the original pickle
+def model_path(name):
+    path = os.path.join(artifacts_dir, name, 'model.joblib')
+    if os.path.exists(path):
+        return path
+    return artifact_path(name, 'model')
+
+
+# Versions of the libraries an artifact depends on, read from package
+# metadata so that nothing heavy gets imported
+def library_versions():
+    versions = {'python': platform.python_version()}
+    for package in ('numpy', 'scikit-learn', 'joblib', 'pandas'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def read_manifest(name):
+    try:
+        with open(manifest_path(name)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+# Hash a file in chunks so large artifacts are never read into memory at once
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Approximate in-memory footprint of a loaded artifact. Array buffers are
+# counted by nbytes; everything else by sys.getsizeof.
+def object_bytes(obj, _seen=None):
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if hasattr(obj, 'memory_usage') and hasattr(obj, 'dtypes'):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if hasattr(obj, 'nbytes') and hasattr(obj, 'dtype'):
+        return int(obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(object_bytes(k, seen) + object_bytes(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(object_bytes(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += object_bytes(vars(obj), seen)
+    return size
+
+
+# Unpickle an artifact, measuring wall time and the memory it occupies.
+# joblib.load reads both plain pickle files and joblib dumps. Arrays in
+# versioned artifacts are memory-mapped copy-on-write: processes on the same
+# host share the page cache, and libsvm still gets the writable buffers it
+# insists on.
+def _timed_load(path):
+    start = time.perf_counter()
+    obj = joblib.load(path, mmap_mode='c' if path.endswith('.joblib') else None)
+    seconds = time.perf_counter() - start
+    return obj, seconds, object_bytes(obj)
+
+
+# Warn when a versioned artifact was written by different library versions
+# than the ones installed, since unpickled estimators may then misbehave
+def _check_manifest(path):
+    with open(os.path.join(os.path.dirname(path), 'manifest.json')) as file:
+        manifest = json.load(file)
+    features = [feature['name'] for feature in manifest['features']]
+    if features != ARTIFACTS[manifest['name']]['features']:
+        raise ValueError(f"{path} expects features {features}, but "
+                         f"{ARTIFACTS[manifest['name']]['dataset']} has {ARTIFACTS[manifest['name']]['features']}")
+    installed = library_versions()
+    for package, version in manifest['libraries'].items():
+        if package != 'python' and installed.get(package) != version:
+            logger.warning("%s was written with %s %s but %s is installed",
+                           path, package, version, installed.get(package))
+
+
+# Content hash of path, recomputed only when its mtime or size changes
+def content_hash(path):
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _hashes.get(path)
+    if cached is None or cached[0] != key:
+        cached = _hashes[path] = (key, file_hash(path))
+    return cached[1]
+
+
+def _is_current(entry, stat):
+    return (entry is not None
+            and entry['mtime_ns'] == stat.st_mtime_ns
+            and entry['size'] == stat.st_size)
+
+
+# Return the unpickled object for path, loading it at most once per version.
+# A changed mtime/size triggers a hash check, and the file is only reloaded
+# when its content hash actually differs.
+def load_artifact(path):
+    stat = os.stat(path)
+    entry = _entries.get(path)
+    if _is_current(entry, stat):
+        entry['hits'] += 1
+        return entry['obj']
+
+    with _lock:
+        entry = _entries.get(path)
+        if _is_current(entry, stat):
+            entry['hits'] += 1
+            return entry['obj']
+
+        digest = content_hash(path)
+        if entry is not None and entry['sha256'] == digest:
+            entry['mtime_ns'] = stat.st_mtime_ns
+            entry['size'] = stat.st_size
+            entry['hits'] += 1
+            return entry['obj']
+
+        obj, seconds, memory = _timed_load(path)
+        if path.endswith('.joblib'):
+            _check_manifest(path)
+        _entries[path] = {
+            'obj': obj,
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': digest,
+            'load_seconds': seconds,
+            'memory_bytes': memory,
+            'loads': (entry['loads'] + 1) if entry else 1,
+            'hits': 0,
+        }
+        logger.info("Loaded %s in %.3fs (%.1f MiB)",
+                    os.path.basename(path), seconds, memory / 2**20)
+        return obj
+
+
+# Models fitted on a DataFrame expect one back (with the same column names);
+# the others are given a plain float array
+def model_input(model, frame):
+    if hasattr(model, 'feature_names_in_'):
+        return frame
+    return frame.to_numpy(dtype=float)
+
+
+def get_model(name):
+    path = model_path(name)
+    model = load_artifact(path)
+    if not hasattr(model, 'predict'):
+        raise TypeError(f"{os.path.basename(path)} does not contain a fitted model "
+                        f"(got {type(model).__name__})")
+    # Models fitted on DataFrames know their column order; never serve one
+    # that disagrees with the feature list used to build its input
+    expected = getattr(model, 'feature_names_in_', None)
+    if expected is not None and list(expected) != ARTIFACTS[name]['features']:
+        raise ValueError(f"{os.path.basename(path)} was fitted on columns {list(expected)}, "
+                         f"expected {ARTIFACTS[name]['features']}")
+    return model
+
+
+def get_test_data(name):
+    return load_artifact(artifact_path(name, 'test_data'))
+
+
+# Version identifier of the model currently on disk (its content hash). This
+# does not load the model.
+def model_version(name):
+    return content_hash(model_path(name))
+
+
+# Load time, memory and cache statistics for every artifact loaded so far
+def registry_stats():
+    stats = []
+    for path, entry in sorted(_entries.items()):
+        stats.append({
+            'artifact': os.path.relpath(path, models_dir),
+            'sha256': entry['sha256'][:12],
+            'load_seconds': round(entry['load_seconds'], 4),
+            'memory_mib': round(entry['memory_bytes'] / 2**20, 2),
+            'file_mib': round(entry['size'] / 2**20, 2),
+            'loads': entry['loads'],
+            'hits': entry['hits'],
+        })
+    return stats
+
+
+# Memory held by a loaded artifact, or None if it has not been loaded
+def loaded_memory(path):
+    entry = _entries.get(path)
+    return entry['memory_bytes'] if entry else None
+
+
+def clear():
+    with _lock:
+        _entries.clear()
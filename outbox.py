@@ -0,0 +1,351 @@
+import argparse
+import json
+import logging
+import os
+import random
+import smtplib
+import socketserver
+import sqlite3
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import model_registry
+
+logger = logging.getLogger(__name__)
+
+# Contact form messages are written to a local SQLite outbox and delivered by
+# a background worker, so submitting the form never waits on the mail server.
+# The worker keeps one SMTP connection open across messages, sends whatever is
+# due in batches and retries failures with exponential backoff; messages
+# survive restarts because they only leave the outbox once delivered.
+# Several workers may share one outbox (app and API processes, or
+# `python outbox.py drain` next to a running app): a worker claims the
+# messages it is about to send in one write transaction, which marks them
+# 'sending' with a lease, so no other worker picks them up. A claim whose
+# worker died is released when its lease expires.
+#
+# Configuration (environment):
+#   CONTACT_SMTP_HOST, CONTACT_SMTP_PORT   mail server (smtp.gmail.com:587)
+#   CONTACT_SMTP_USER, CONTACT_SMTP_PASSWORD   login, skipped when unset
+#   CONTACT_SMTP_STARTTLS                  1 (default) or 0 for a plain local server
+#   CONTACT_SENDER, CONTACT_RECIPIENT      envelope addresses
+#   CONTACT_OUTBOX_PATH                    SQLite file (contact_outbox.sqlite)
+#   CONTACT_MAX_ATTEMPTS                   give up after this many failures (8)
+#   CONTACT_RETRY_SECONDS                  first retry delay, doubled each time (5)
+#   CONTACT_LEASE_SECONDS                  how long a claim is held before another
+#                                          worker may take the message over (900)
+#
+# To try delivery locally, run the stand-in server and point the app at it:
+#   python outbox.py serve --port 1025
+#   CONTACT_SMTP_HOST=localhost CONTACT_SMTP_PORT=1025 CONTACT_SMTP_STARTTLS=0 streamlit run main.py
+
+PENDING, SENDING, SENT, FAILED = 'pending', 'sending', 'sent', 'failed'
+MAX_RETRY_SECONDS = 3600
+BATCH_SIZE = 20
+
+
+def smtp_settings():
+    return {
+        'host': os.environ.get('CONTACT_SMTP_HOST', 'smtp.gmail.com'),
+        'port': int(os.environ.get('CONTACT_SMTP_PORT', 587)),
+        'user': os.environ.get('CONTACT_SMTP_USER'),
+        'password': os.environ.get('CONTACT_SMTP_PASSWORD'),
+        'starttls': os.environ.get('CONTACT_SMTP_STARTTLS', '1') == '1',
+        'sender': os.environ.get('CONTACT_SENDER', 'your_email@example.com'),
+        'recipient': os.environ.get('CONTACT_RECIPIENT', 'receiver_email@example.com'),
+    }
+
+
+def build_message(sender, recipient, name, email, message):
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg['Reply-To'] = email
+    msg['Subject'] = f"Contact Us Message from {name}"
+    msg.attach(MIMEText(f"Name: {name}\nEmail: {email}\nMessage: {message}", 'plain'))
+    return msg.as_string()
+
+
+class Outbox:
+    def __init__(self, path, max_attempts=8, retry_seconds=5.0, lease_seconds=900.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, created REAL, '
+                       'name TEXT, email TEXT, body TEXT, status TEXT, attempts INTEGER, '
+                       'next_attempt REAL, last_error TEXT, lease_until REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS messages_due ON messages (status, next_attempt)')
+            # Outboxes written before leases were added
+            if 'lease_until' not in {row[1] for row in db.execute('PRAGMA table_info(messages)')}:
+                db.execute('ALTER TABLE messages ADD COLUMN lease_until REAL')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def enqueue(self, name, email, message):
+        now = time.time()
+        with self._connection() as db:
+            return db.execute('INSERT INTO messages (created, name, email, body, status, attempts, next_attempt) '
+                              'VALUES (?, ?, ?, ?, ?, 0, ?)', (now, name, email, message, PENDING, now)).lastrowid
+
+    # Claim up to limit pending messages whose next attempt is due, oldest
+    # first, and return them. Expired claims are released first. BEGIN
+    # IMMEDIATE takes the write lock before reading, so two workers never
+    # claim the same message.
+    def claim(self, limit=BATCH_SIZE):
+        now = time.time()
+        with self._connection() as db:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('UPDATE messages SET status = ?, lease_until = NULL WHERE status = ? AND lease_until <= ?',
+                       (PENDING, SENDING, now))
+            rows = db.execute('SELECT id, name, email, body, attempts FROM messages '
+                              'WHERE status = ? AND next_attempt <= ? ORDER BY next_attempt LIMIT ?',
+                              (PENDING, now, limit)).fetchall()
+            if rows:
+                db.execute(f"UPDATE messages SET status = ?, lease_until = ? "
+                           f"WHERE id IN ({', '.join('?' * len(rows))}) AND status = ?",
+                           (SENDING, now + self.lease_seconds, *(row[0] for row in rows), PENDING))
+        return rows
+
+    # Seconds until the next pending message is due or the next claim
+    # expires, or None if there is neither
+    def next_due(self):
+        row = self._connection().execute(
+            'SELECT MIN(CASE status WHEN ? THEN next_attempt ELSE lease_until END) FROM messages '
+            'WHERE status IN (?, ?)', (PENDING, PENDING, SENDING)).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def mark_sent(self, message_id):
+        with self._connection() as db:
+            db.execute('UPDATE messages SET status = ?, attempts = attempts + 1, last_error = NULL, '
+                       'lease_until = NULL WHERE id = ?', (SENT, message_id))
+
+    # Back off exponentially with jitter; give up after max_attempts
+    def mark_failed(self, message_id, attempts, error):
+        attempts += 1
+        delay = min(MAX_RETRY_SECONDS, self.retry_seconds * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        status = FAILED if attempts >= self.max_attempts else PENDING
+        with self._connection() as db:
+            db.execute('UPDATE messages SET status = ?, attempts = ?, next_attempt = ?, last_error = ?, '
+                       'lease_until = NULL WHERE id = ?',
+                       (status, attempts, time.time() + delay, str(error), message_id))
+
+    def stats(self):
+        counts = dict(self._connection().execute('SELECT status, COUNT(*) FROM messages GROUP BY status'))
+        return {status: counts.get(status, 0) for status in (PENDING, SENDING, SENT, FAILED)}
+
+
+# One SMTP connection kept open between sends and reopened when the server
+# has dropped it or it has been idle longer than max_idle seconds
+class SmtpConnection:
+    def __init__(self, settings, timeout=30, max_idle=60):
+        self.settings = settings
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._server = None
+        self._last_used = 0.0
+
+    def _open(self):
+        server = smtplib.SMTP(self.settings['host'], self.settings['port'], timeout=self.timeout)
+        if self.settings['starttls']:
+            server.starttls()
+        if self.settings['user']:
+            server.login(self.settings['user'], self.settings['password'])
+        return server
+
+    def send(self, recipient, text):
+        if self._server is not None and time.monotonic() - self._last_used > self.max_idle:
+            self.close()
+        if self._server is None:
+            self._server = self._open()
+        self._server.sendmail(self.settings['sender'], recipient, text)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+# Drains the outbox in the background. enqueue() wakes it up at once; retries
+# are picked up when their backoff has passed.
+class OutboxWorker:
+    def __init__(self, outbox, settings, poll_seconds=30):
+        self.outbox = outbox
+        self.settings = settings
+        self.poll_seconds = poll_seconds
+        self.connection = SmtpConnection(settings)
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='contact-outbox', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    # Claim and send every message that is due; returns how many were
+    # delivered
+    def drain(self):
+        delivered = 0
+        while True:
+            batch = self.outbox.claim()
+            if not batch:
+                break
+            for message_id, name, email, body, attempts in batch:
+                text = build_message(self.settings['sender'], self.settings['recipient'], name, email, body)
+                try:
+                    self.connection.send(self.settings['recipient'], text)
+                except (smtplib.SMTPException, OSError) as e:
+                    self.connection.close()
+                    self.outbox.mark_failed(message_id, attempts, e)
+                else:
+                    self.outbox.mark_sent(message_id)
+                    delivered += 1
+        return delivered
+
+    def _run(self):
+        while True:
+            try:
+                self.drain()
+                wait = self.outbox.next_due()
+            except Exception:
+                # Keep the worker alive; whatever went wrong is retried on
+                # the next wake-up or poll
+                logger.exception('Could not drain the contact outbox')
+                wait = None
+            if self._wake.wait(self.poll_seconds if wait is None else min(wait, self.poll_seconds)):
+                self._wake.clear()
+            elif wait is None:
+                self.connection.close()
+
+
+def outbox_path():
+    return os.environ.get('CONTACT_OUTBOX_PATH', os.path.join(model_registry.base_dir, 'contact_outbox.sqlite'))
+
+
+def outbox_from_env():
+    return Outbox(outbox_path(),
+                  max_attempts=int(os.environ.get('CONTACT_MAX_ATTEMPTS', 8)),
+                  retry_seconds=float(os.environ.get('CONTACT_RETRY_SECONDS', 5)),
+                  lease_seconds=float(os.environ.get('CONTACT_LEASE_SECONDS', 900)))
+
+
+_worker = None
+_lock = threading.Lock()
+
+
+# Process-wide outbox worker, started on first use
+def get_worker():
+    global _worker
+    if _worker is None:
+        with _lock:
+            if _worker is None:
+                _worker = OutboxWorker(outbox_from_env(), smtp_settings()).start()
+    return _worker
+
+
+# Queue a contact form message and return its outbox id without waiting for
+# delivery
+def submit(name, email, message):
+    worker = get_worker()
+    message_id = worker.outbox.enqueue(name, email, message)
+    worker.notify()
+    return message_id
+
+
+# Minimal SMTP stand-in for local testing: accepts every message, without
+# TLS or authentication, and prints it or appends it to a file
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 localhost stand-in SMTP ready')
+        sender, recipients = None, []
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data in self.rfile:
+                    if data in (b'.\r\n', b'.\n'):
+                        break
+                    line = data.decode(errors='replace').rstrip('\r\n')
+                    lines.append(line[1:] if line.startswith('..') else line)
+                self.server.deliver({'from': sender, 'to': recipients, 'data': '\n'.join(lines)})
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class DebugSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, output=None):
+        super().__init__(address, _SmtpHandler)
+        self.output = output
+        self.messages = []
+
+    def deliver(self, envelope):
+        self.messages.append(envelope)
+        if self.output:
+            with open(self.output, 'a') as file:
+                file.write(json.dumps(envelope) + '\n')
+        else:
+            print(json.dumps(envelope, indent=2), flush=True)
+
+
+#   python outbox.py stats               count pending, sending, sent and failed messages
+#   python outbox.py drain               deliver everything that is due now
+#   python outbox.py serve --port 1025   run the stand-in SMTP server
+def main():
+    parser = argparse.ArgumentParser(description='Contact form outbox.')
+    parser.add_argument('command', choices=['stats', 'drain', 'serve'])
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--output', help='serve: append received messages to this file as JSON lines')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        with DebugSmtpServer(('localhost', args.port), args.output) as server:
+            print(f'Stand-in SMTP server on localhost:{args.port}', flush=True)
+            server.serve_forever()
+    elif args.command == 'drain':
+        worker = OutboxWorker(outbox_from_env(), smtp_settings())
+        print(f'Delivered {worker.drain()} messages')
+        worker.connection.close()
+        print(json.dumps(worker.outbox.stats()))
+    else:
+        print(json.dumps(outbox_from_env().stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+import argparse
+import heapq
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import dataset_cache
+import feature_schema
+import model_registry
+from calibration import calibrate, calibration_version, get_calibration
+from fast_scorer import get_predictor
+from screening import ALIASES, routable_models
+
+# Population-scale screening for nightly runs over millions of patients.
+#   1. ingest: each input CSV is parsed once, in chunks, into one
+#      memory-mapped .npy column per model feature (dataset_cache's format)
+#   2. score: the rows are cut into shards that a process pool scores with
+#      vectorized predict_proba straight off the memory maps; each shard
+#      returns only its counts and its top-K patients per disease
+#   3. merge: the parent keeps a bounded heap of the K riskiest patients
+#      per disease, so no full score column is ever held or written
+# Patients are ranked on the model's own predict_proba score, which keeps its
+# full resolution; the calibrated risk (a table lookup that maps many scores
+# to the same value, see calibration.py) is reported next to it and is what
+# --threshold is compared with.
+# Everything lives in a work directory. Every finished shard is
+# checkpointed there as a small JSON file, so an interrupted run started
+# again with the same inputs and models resumes with the shards still to
+# do. Rows with missing or out-of-range values (see feature_schema) are
+# counted and skipped rather than failing the night.
+DEFAULT_SHARD_ROWS = 250_000
+DEFAULT_TOP = 100
+DEFAULT_THRESHOLD = 0.5
+# Bumped when the shard checkpoint format changes, so old checkpoints are
+# not merged into a new run
+CHECKPOINT_FORMAT = 2
+# Rows per predict_proba call inside a shard
+SCORE_CHUNK = 50_000
+
+
+def _source_info(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# Feature columns of the input: every model's features found in the header,
+# with 'Age'/'age' standing in for each other
+def _input_columns(path):
+    header = list(pd.read_csv(path, nrows=0, encoding='utf-8-sig').columns)
+    columns = {}
+    for artifact in model_registry.ARTIFACTS.values():
+        for feature in artifact['features']:
+            if feature in header:
+                columns[feature] = feature
+            elif ALIASES.get(feature) in header:
+                columns[feature] = ALIASES[feature]
+    return columns
+
+
+def _read_json(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def _ingest(index, path, directory, chunksize):
+    columns = _input_columns(path)
+    names = sorted(set(columns.values()))
+    rows, dtypes = dataset_cache.write_columns(path, names, directory, chunksize)
+    meta = {'columns': names, 'dtypes': dtypes, 'rows': rows, 'features': columns,
+            'models': routable_models(columns)}
+    _write_json(os.path.join(directory, 'meta.json'), meta)
+    return index, meta
+
+
+def _positive_proba(predictor, features, X):
+    frame = pd.DataFrame(X, columns=features)
+    return predictor.predict_proba(model_registry.model_input(predictor, frame))[:, 1]
+
+
+# Score rows [start, end) of one ingested file with every model it has the
+# features for. Runs in a worker process.
+def score_shard(directory, start, end, top, threshold):
+    began = time.perf_counter()
+    meta = _read_json(os.path.join(directory, 'meta.json'))
+    arrays = {column: np.load(os.path.join(directory, f'{index}.npy'), mmap_mode='r')
+              for index, column in enumerate(meta['columns'])}
+    result = {'rows': end - start, 'models': {}}
+    for name in meta['models']:
+        model_start = time.perf_counter()
+        schema = feature_schema.get_schema(name)
+        features = schema['names']
+        X = np.column_stack([arrays[meta['features'][feature]][start:end] for feature in features]).astype(np.float64)
+        valid = (np.isfinite(X) & (X >= schema['low']) & (X <= schema['high'])).all(axis=1)
+        rows = np.flatnonzero(valid)
+
+        predictor = get_predictor(name)
+        calibration = get_calibration(name)
+        scores = np.empty(len(rows))
+        for offset in range(0, len(rows), SCORE_CHUNK):
+            batch = rows[offset:offset + SCORE_CHUNK]
+            scores[offset:offset + len(batch)] = _positive_proba(predictor, features, X[batch])
+        risks = calibrate(calibration, scores)
+
+        keep = min(top, len(rows))
+        best = np.argpartition(-scores, keep - 1)[:keep] if keep else np.array([], dtype=int)
+        result['models'][name] = {
+            'scored': int(len(rows)),
+            'invalid': int(len(X) - len(rows)),
+            'high_risk': int((risks >= threshold).sum()),
+            'top': [[float(scores[i]), float(risks[i]), int(start + rows[i])] for i in best],
+            'seconds': time.perf_counter() - model_start,
+        }
+    result['seconds'] = time.perf_counter() - began
+    return result
+
+
+# Bounded min-heaps of (score, file index, row, risk): the heap root is the
+# least risky patient kept, replaced whenever a riskier one arrives
+class TopK:
+    def __init__(self, size):
+        self.size = size
+        self.heaps = {}
+
+    def push(self, name, file_index, entries):
+        heap = self.heaps.setdefault(name, [])
+        for score, risk, row in entries:
+            item = (score, -file_index, -row, risk)
+            if len(heap) < self.size:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    def ranked(self, name):
+        return [(score, risk, -file_index, -row)
+                for score, file_index, row, risk in sorted(self.heaps.get(name, []), reverse=True)]
+
+
+# Look up the id column of the selected rows of a CSV in one streaming pass
+# that parses only that column
+def _lookup_ids(path, id_column, rows, chunksize):
+    wanted = set(rows)
+    ids = {}
+    offset = 0
+    for chunk in pd.read_csv(path, usecols=[id_column], chunksize=chunksize, encoding='utf-8-sig'):
+        for row in wanted.intersection(range(offset, offset + len(chunk))):
+            ids[row] = chunk[id_column].iloc[row - offset]
+        offset += len(chunk)
+    return ids
+
+
+def _prepare(work_dir, sources, settings):
+    run = {'sources': [_source_info(path) for path in sources], **settings, 'checkpoint_format': CHECKPOINT_FORMAT,
+           'model_versions': {name: model_registry.model_version(name) for name in model_registry.ARTIFACTS},
+           'calibration_versions': {name: calibration_version(name) for name in model_registry.ARTIFACTS}}
+    previous = _read_json(os.path.join(work_dir, 'run.json'))
+    if previous is None or previous['sources'] != run['sources']:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    elif previous != run:
+        # Same inputs but different models, calibrations or settings: keep
+        # the ingested columns, drop the shard results
+        shutil.rmtree(os.path.join(work_dir, 'shards'), ignore_errors=True)
+    os.makedirs(os.path.join(work_dir, 'shards'), exist_ok=True)
+    _write_json(os.path.join(work_dir, 'run.json'), run)
+
+
+# Screen every source file and write the top patients per disease to
+# destination (disease, rank, file, row, [id], score, probability), where
+# score is the model's own score the ranking uses and probability the
+# calibrated risk. Returns a
+# summary with rows/second overall and per worker process.
+def screen_population(sources, destination, work_dir, workers=None, shard_rows=DEFAULT_SHARD_ROWS,
+                      top=DEFAULT_TOP, threshold=DEFAULT_THRESHOLD, id_column=None,
+                      chunksize=dataset_cache.DEFAULT_CHUNKSIZE, progress=None):
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    _prepare(work_dir, sources, {'shard_rows': shard_rows, 'top': top, 'threshold': threshold})
+
+    with ProcessPoolExecutor(workers) as pool:
+        metas = {}
+        pending = []
+        for index, path in enumerate(sources):
+            directory = os.path.join(work_dir, 'inputs', str(index))
+            meta = _read_json(os.path.join(directory, 'meta.json'))
+            if meta is None:
+                shutil.rmtree(directory, ignore_errors=True)
+                pending.append(pool.submit(_ingest, index, path, directory, chunksize))
+            else:
+                metas[index] = meta
+        for future in as_completed(pending):
+            index, meta = future.result()
+            metas[index] = meta
+        ingest_seconds = time.perf_counter() - start
+
+        topk = TopK(top)
+        totals = {}
+        busy_seconds = 0.0
+        busy_rows = 0
+        done = 0
+        futures = {}
+
+        def merge(index, result):
+            for name, counts in result['models'].items():
+                topk.push(name, index, counts['top'])
+                model_totals = totals.setdefault(name, {'scored': 0, 'invalid': 0, 'high_risk': 0, 'seconds': 0.0})
+                for key in model_totals:
+                    model_totals[key] += counts[key]
+
+        for index in sorted(metas):
+            directory = os.path.join(work_dir, 'inputs', str(index))
+            for shard_start in range(0, metas[index]['rows'], shard_rows):
+                shard_end = min(shard_start + shard_rows, metas[index]['rows'])
+                checkpoint = os.path.join(work_dir, 'shards', f'{index}-{shard_start}.json')
+                result = _read_json(checkpoint)
+                if result is None:
+                    future = pool.submit(score_shard, directory, shard_start, shard_end, top, threshold)
+                    futures[future] = (index, checkpoint)
+                    continue
+                done += 1
+                merge(index, result)
+        resumed = done
+
+        for future in as_completed(futures):
+            index, checkpoint = futures[future]
+            result = future.result()
+            _write_json(checkpoint, result)
+            busy_seconds += result['seconds']
+            busy_rows += result['rows']
+            done += 1
+            merge(index, result)
+            if progress is not None:
+                progress(f'shard {done}/{resumed + len(futures)} done')
+
+    records = []
+    for name in sorted(topk.heaps):
+        for rank, (score, probability, index, row) in enumerate(topk.ranked(name), 1):
+            records.append({'disease': name, 'rank': rank, 'file': sources[index], 'row': row,
+                            'score': score, 'probability': probability})
+    if id_column:
+        for index, path in enumerate(sources):
+            rows = [record['row'] for record in records if record['file'] == path]
+            ids = _lookup_ids(path, id_column, rows, chunksize) if rows else {}
+            for record in records:
+                if record['file'] == path:
+                    record[id_column] = ids.get(record['row'])
+    columns = ['disease', 'rank', 'file', 'row'] + ([id_column] if id_column else []) + ['score', 'probability']
+    pd.DataFrame(records, columns=columns).to_csv(destination, index=False)
+
+    seconds = time.perf_counter() - start
+    rows = sum(meta['rows'] for meta in metas.values())
+    return {
+        'rows': rows,
+        'shards': done,
+        'resumed_shards': resumed,
+        'workers': workers,
+        'seconds': round(seconds, 3),
+        'ingest_seconds': round(ingest_seconds, 3),
+        # Only shards scored in this run count towards the throughputs; the
+        # per-core figure is one worker process's rate while it was scoring
+        'rows_per_second': round(busy_rows / seconds, 1) if seconds else None,
+        'rows_per_second_per_core': round(busy_rows / busy_seconds, 1) if busy_seconds else None,
+        'models': {name: {**counts, 'seconds': round(counts['seconds'], 3),
+                          'rows_per_second_per_core': round(counts['scored'] / counts['seconds'], 1)
+                          if counts['seconds'] else None}
+                   for name, counts in totals.items()},
+    }
+
+
+#   python population.py patients.csv [more.csv ...] top_risk.csv [--work-dir DIR]
+#       [--workers N] [--shard-rows 250000] [--top 100] [--threshold 0.5] [--id-column ID]
+# Run it again with the same arguments to resume an interrupted run;
+# --restart discards the work directory first.
+def main():
+    parser = argparse.ArgumentParser(description='Screen a patient population with every disease model.')
+    parser.add_argument('sources', nargs='+', help='input CSVs, then the CSV to write the top patients to')
+    parser.add_argument('--work-dir', help='default: <output>.work')
+    parser.add_argument('--workers', type=int, default=None, help='default: one per CPU')
+    parser.add_argument('--shard-rows', type=int, default=DEFAULT_SHARD_ROWS)
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='patients kept per disease')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='calibrated risk counted as high risk')
+    parser.add_argument('--id-column', help='input column identifying patients, copied to the output')
+    parser.add_argument('--chunksize', type=int, default=dataset_cache.DEFAULT_CHUNKSIZE)
+    parser.add_argument('--restart', action='store_true')
+    args = parser.parse_args()
+    if len(args.sources) < 2:
+        parser.error('give at least one input CSV and the output CSV')
+    *sources, destination = args.sources
+    work_dir = args.work_dir or f'{destination}.work'
+    if args.restart:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = screen_population(sources, destination, work_dir, args.workers, args.shard_rows, args.top,
+                                args.threshold, args.id_column, args.chunksize,
+                                progress=lambda message: print(message, file=sys.stderr))
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import model_registry
+from calibration import calibration_version
+
+# Cache of prediction results keyed on model version plus the canonicalized
+# feature values, so Streamlit reruns and client retries for the same patient
+# are not scored again. The version is the model file's content hash plus
+# the hash of its calibration file: when either changes, the old entries can
+# no longer be hit and are purged.
+#
+# Backends (PREDICTION_CACHE):
+#   memory - in-process LRU (default)
+#   sqlite - file at PREDICTION_CACHE_PATH, shared by every process on the host
+#   redis  - server at PREDICTION_CACHE_URL, shared across hosts (needs redis)
+#   off    - no caching
+# PREDICTION_CACHE_SIZE bounds the number of entries and PREDICTION_CACHE_TTL
+# their age in seconds.
+
+DEFAULT_SIZE = 10_000
+DEFAULT_TTL = 3600
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Drop entries whose key starts with prefix, except those of keep_prefix
+    def purge(self, prefix, keep_prefix):
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key.startswith(prefix) and not key.startswith(keep_prefix)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Local stand-in for a shared cache server: one SQLite file that every app
+# process on the host reads and writes. Recency is tracked per entry and the
+# least recently used entries are evicted once the table is over its size.
+class SqliteBackend:
+    def __init__(self, path, max_entries=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                       '(key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as db:
+            row = db.execute('SELECT value FROM predictions WHERE key = ? AND expires >= ?',
+                             (key, now)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE predictions SET used = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connection() as db:
+            db.execute('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)',
+                       (key, json.dumps(value), now + self.ttl, now))
+            db.execute('DELETE FROM predictions WHERE expires < ?', (now,))
+            db.execute('DELETE FROM predictions WHERE key IN (SELECT key FROM predictions '
+                       'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def purge(self, prefix, keep_prefix):
+        with self._connection() as db:
+            db.execute('DELETE FROM predictions WHERE substr(key, 1, ?) = ? AND substr(key, 1, ?) != ?',
+                       (len(prefix), prefix, len(keep_prefix), keep_prefix))
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+
+# Shared across hosts. Size is bounded by the server's maxmemory policy
+# (configure allkeys-lru); entries expire after ttl.
+class RedisBackend:
+    def __init__(self, url, ttl=DEFAULT_TTL, namespace='prediction:'):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("PREDICTION_CACHE=redis needs the 'redis' package") from None
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.namespace = namespace
+
+    def get(self, key):
+        value = self.client.get(self.namespace + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.namespace + key, json.dumps(value), ex=self.ttl)
+
+    def purge(self, prefix, keep_prefix):
+        keep = self.namespace + keep_prefix
+        for key in self.client.scan_iter(match=f'{self.namespace}{prefix}*'):
+            if not key.decode().startswith(keep):
+                self.client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=f'{self.namespace}*'))
+
+
+class PredictionCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    # Features are put in the model's column order and converted to floats,
+    # so 1, 1.0 and '1' map to the same entry (and -0.0 to 0.0)
+    @staticmethod
+    def key(name, version, record):
+        features = model_registry.ARTIFACTS[name]['features']
+        values = record if not isinstance(record, dict) else [record[feature] for feature in features]
+        return f"{name}:{version}:{','.join(repr(float(value) + 0.0) for value in values)}"
+
+    # The cached probabilities are calibrated, so entries belong to a model
+    # version and the calibration it is served with. Purge the entries of
+    # the previous pair the first time a new one is seen.
+    def _version(self, name):
+        version = f'{model_registry.model_version(name)[:16]}.{calibration_version(name)}'
+        if self._versions.get(name) != version:
+            with self._lock:
+                if self._versions.get(name) not in (None, version):
+                    self.backend.purge(f'{name}:', f'{name}:{version}:')
+                self._versions[name] = version
+        return version
+
+    def get(self, name, record):
+        value = self.backend.get(self.key(name, self._version(name), record))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if value is None else tuple(value)
+
+    def set(self, name, record, value):
+        self.backend.set(self.key(name, self._version(name), record), list(value))
+
+    # Return the cached (prediction, probability) for record, or compute,
+    # store and return it
+    def get_or_compute(self, name, record, compute):
+        value = self.get(name, record)
+        if value is None:
+            value = compute()
+            self.set(name, record, value)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def backend_from_env():
+    kind = os.environ.get('PREDICTION_CACHE', 'memory')
+    size = int(os.environ.get('PREDICTION_CACHE_SIZE', DEFAULT_SIZE))
+    ttl = float(os.environ.get('PREDICTION_CACHE_TTL', DEFAULT_TTL))
+    if kind == 'off':
+        return None
+    if kind == 'memory':
+        return MemoryBackend(size, ttl)
+    if kind == 'sqlite':
+        path = os.environ.get('PREDICTION_CACHE_PATH',
+                              os.path.join(model_registry.models_dir, 'prediction_cache.sqlite'))
+        return SqliteBackend(path, size, ttl)
+    if kind == 'redis':
+        return RedisBackend(os.environ.get('PREDICTION_CACHE_URL', 'redis://localhost:6379/0'), ttl)
+    raise ValueError(f'Unknown PREDICTION_CACHE backend: {kind}')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Process-wide cache, or None when caching is switched off
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                backend = backend_from_env()
+                _cache = False if backend is None else PredictionCache(backend)
+    return _cache or None
@@ -0,0 +1,158 @@
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import drift
+import feature_schema
+import model_registry
+import prediction_cache
+import telemetry
+from batch_scoring import predict_frame
+from calibration import get_calibration
+from fast_scorer import get_predictor
+
+# Combined screening: one patient record carrying the union of every model's
+# features is split into each model's columns and the models are scored
+# concurrently on a shared thread pool (NumPy and libsvm release the GIL
+# while they compute). Diabetes 'Age' and heart 'age' are the same value, so
+# either spelling fills both.
+ALIASES = {'Age': 'age', 'age': 'Age'}
+DEFAULT_CHUNKSIZE = 10_000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(len(model_registry.ARTIFACTS), thread_name_prefix='screening')
+    return _pool
+
+
+def _with_aliases(frame):
+    for name, alias in ALIASES.items():
+        if name not in frame.columns and alias in frame.columns:
+            frame = frame.assign(**{name: frame[alias]})
+    return frame
+
+
+# Models whose features are all present. A model with only some of its own
+# (not shared) features raises, since scoring partial input is meaningless.
+def routable_models(columns):
+    models = []
+    for name, artifact in model_registry.ARTIFACTS.items():
+        if all(feature in columns for feature in artifact['features']):
+            models.append(name)
+        elif any(feature in columns for feature in artifact['features'] if feature not in ALIASES):
+            missing = [feature for feature in artifact['features'] if feature not in columns]
+            raise ValueError(f"Record is missing {name} features: {', '.join(missing)}")
+    if not models:
+        raise ValueError('Record has no complete feature set for any model')
+    return models
+
+
+# Validate a model's input and queue it for the drift monitor, which sees
+# every screened patient whether or not the answer comes from the cache
+def _validate(name, frame):
+    frame = feature_schema.validate(name, frame)
+    drift.observe(name, frame)
+    return frame
+
+
+def _score(name, frame):
+    with telemetry.span('predict', model=name, source='screening'):
+        return predict_frame(get_predictor(name), frame, model_registry.ARTIFACTS[name]['features'],
+                             get_calibration(name))
+
+
+def _validate_and_score(name, frame):
+    return _score(name, _validate(name, frame))
+
+
+# Score a frame of patients with every model it has features for, all models
+# at once. Returns one row per patient with '<model>_prediction' and
+# '<model>_probability' columns and 'flagged', the models that predicted 1.
+def screen_frame(frame):
+    frame = _with_aliases(frame)
+    models = routable_models(frame.columns)
+    futures = {name: _executor().submit(_validate_and_score, name, frame) for name in models}
+    report = pd.DataFrame(index=frame.index)
+    for name, future in futures.items():
+        report[f'{name}_prediction'], report[f'{name}_probability'] = future.result()
+    predictions = report[[f'{name}_prediction' for name in models]].to_numpy()
+    report['flagged'] = [','.join(name for name, positive in zip(models, row) if positive) for row in predictions]
+    telemetry.increment('screenings', len(frame))
+    return report
+
+
+# Unified risk report for one {feature: value} record. Each model's result
+# goes through the prediction cache like a single-model request.
+def screen_patient(record):
+    record = dict(record)
+    for name, alias in ALIASES.items():
+        if name not in record and alias in record:
+            record[name] = record[alias]
+    models = routable_models(record)
+    cache = prediction_cache.get_cache()
+
+    def score(name):
+        features = model_registry.ARTIFACTS[name]['features']
+        values = {feature: record[feature] for feature in features}
+        frame = _validate(name, pd.DataFrame([values], columns=features))
+
+        def compute():
+            predictions, probabilities = _score(name, frame)
+            return int(predictions[0]), float(probabilities[0])
+
+        return cache.get_or_compute(name, values, compute) if cache else compute()
+
+    futures = {name: _executor().submit(score, name) for name in models}
+    results = {name: {'prediction': future.result()[0], 'probability': future.result()[1]}
+               for name, future in futures.items()}
+    telemetry.increment('screenings')
+    return {
+        'models': results,
+        'flagged': [name for name, result in results.items() if result['prediction'] == 1],
+        'highest_risk': max(results, key=lambda name: results[name]['probability']),
+    }
+
+
+# Screen a CSV of patients chunk by chunk, like batch_scoring.score_csv
+def screen_csv(source, destination, chunksize=DEFAULT_CHUNKSIZE, progress=None):
+    start = time.perf_counter()
+    rows = 0
+    for chunk in pd.read_csv(source, chunksize=chunksize, encoding='utf-8-sig'):
+        if chunk.empty:
+            continue
+        scored = pd.concat([chunk, screen_frame(chunk)], axis=1)
+        scored.to_csv(destination, mode='a' if rows else 'w', header=not rows, index=False)
+        rows += len(scored)
+        if progress is not None:
+            progress(rows)
+    seconds = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+    }
+
+
+#   python screening.py patients.csv screened.csv [--chunksize 10000]
+def main():
+    parser = argparse.ArgumentParser(description='Screen patients with every disease model.')
+    parser.add_argument('source')
+    parser.add_argument('destination')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+    print(json.dumps(screen_csv(args.source, args.destination, args.chunksize)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+
+import calibration
+import model_registry
+import telemetry
+from batch_scoring import predict_frame
+from fast_scorer import get_predictor
+
+logger = logging.getLogger(__name__)
+
+# Shadow and canary serving. A candidate model can be staged next to the
+# served (primary) one under Saved models/artifacts/<model>/candidate/.
+# While one is staged, every batch the app or the API scores with one
+# version is scored again with the other on a background thread, off the
+# request path, and per-version latency, memory and the rate at which the
+# two disagree are recorded. CANARY_FRACTION of requests is answered by the
+# candidate instead of the primary. Staging, promoting and discarding take
+# effect in running processes on their next request.
+CANARY_FRACTION = float(os.environ.get('CANARY_FRACTION', 0))
+SHADOW = os.environ.get('SHADOW', '1') == '1'
+SHADOW_MAX_PENDING = int(os.environ.get('SHADOW_MAX_PENDING', 100))
+
+_stats = {}
+_comparisons = {}
+_accuracy = {}
+_pending = 0
+_dropped = {}
+_lock = threading.Lock()
+_pool = ThreadPoolExecutor(1, thread_name_prefix='shadow')
+
+
+def candidate_dir(name):
+    return os.path.join(model_registry.artifacts_dir, name, 'candidate')
+
+
+def candidate_path(name):
+    return os.path.join(candidate_dir(name), 'model.joblib')
+
+
+def get_candidate(name):
+    path = candidate_path(name)
+    return model_registry.load_artifact(path) if os.path.exists(path) else None
+
+
+def candidate_version(name):
+    path = candidate_path(name)
+    return model_registry.content_hash(path) if os.path.exists(path) else None
+
+
+def candidate_calibration_path(name):
+    return os.path.join(candidate_dir(name), 'calibration.json')
+
+
+# The calibration each version is served with
+def _calibration(name, role):
+    if role == 'candidate':
+        return calibration.load_calibration(candidate_calibration_path(name), candidate_version(name))
+    return calibration.get_calibration(name)
+
+
+# Which version answers the next request: 'candidate' for CANARY_FRACTION
+# of requests while a candidate is staged, otherwise 'primary'
+def route(name):
+    if CANARY_FRACTION > 0 and os.path.exists(candidate_path(name)) and random.random() < CANARY_FRACTION:
+        return 'candidate'
+    return 'primary'
+
+
+def _version_stats(name, version):
+    key = (name, version)
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = {'served_requests': 0, 'served_rows': 0, 'shadow_rows': 0,
+                               'seconds': 0.0, 'latencies': deque(maxlen=10_000)}
+    return stats
+
+
+def _record(name, version, rows, seconds, served):
+    with _lock:
+        stats = _version_stats(name, version)
+        if served:
+            stats['served_requests'] += 1
+            stats['served_rows'] += rows
+        else:
+            stats['shadow_rows'] += rows
+        stats['seconds'] += seconds
+        stats['latencies'].append(seconds)
+
+
+def _timed(name, predictor, frame, role):
+    start = time.perf_counter()
+    predictions, probabilities = predict_frame(predictor, frame, model_registry.ARTIFACTS[name]['features'],
+                                               _calibration(name, role))
+    return predictions, probabilities, time.perf_counter() - start
+
+
+def _shadow(name, frame, served_role, predictions, probabilities, versions):
+    global _pending
+    try:
+        other = get_predictor(name) if served_role == 'candidate' else get_candidate(name)
+        if other is None:
+            return
+        other_role = 'primary' if served_role == 'candidate' else 'candidate'
+        with telemetry.span('predict', model=name, source='shadow'):
+            other_predictions, other_probabilities, seconds = _timed(name, other, frame, other_role)
+        _record(name, versions[other_role], len(frame), seconds, served=False)
+        with _lock:
+            comparison = _comparisons.setdefault((name, versions['primary'], versions['candidate']),
+                                                 {'rows': 0, 'disagreements': 0, 'abs_probability_diff': 0.0})
+            comparison['rows'] += len(frame)
+            comparison['disagreements'] += int((np.asarray(predictions) != np.asarray(other_predictions)).sum())
+            comparison['abs_probability_diff'] += float(np.abs(np.asarray(probabilities) -
+                                                               np.asarray(other_probabilities)).sum())
+    except Exception:
+        logger.exception("Shadow scoring failed for %s", name)
+        telemetry.increment('shadow_errors', model=name)
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+# Score a validated frame with the given version, and, while a candidate is
+# staged, queue the same frame for the other version in the background.
+# predictor overrides the primary model (e.g. one the caller already holds).
+# Returns (predictions, probabilities) like predict_frame.
+def score(name, frame, role='primary', predictor=None):
+    global _pending
+    candidate_ver = candidate_version(name)
+    if candidate_ver is None:
+        role = 'primary'
+    if role == 'candidate':
+        predictor = get_candidate(name)
+    elif predictor is None:
+        predictor = get_predictor(name)
+    versions = {'primary': model_registry.model_version(name), 'candidate': candidate_ver}
+
+    predictions, probabilities, seconds = _timed(name, predictor, frame, role)
+    _record(name, versions[role], len(frame), seconds, served=True)
+    telemetry.increment('predictions_by_version', len(frame), model=name, version=role)
+
+    if SHADOW and candidate_ver is not None:
+        with _lock:
+            full = _pending >= SHADOW_MAX_PENDING
+            if full:
+                _dropped[name] = _dropped.get(name, 0) + 1
+            else:
+                _pending += 1
+        if not full:
+            _pool.submit(_shadow, name, frame, role, predictions, probabilities, versions)
+    return predictions, probabilities
+
+
+# Accuracy of a model version on the held-out test split, computed once
+def test_accuracy(name, version, model):
+    key = (name, version)
+    if key not in _accuracy:
+        X_test, y_test = model_registry.get_test_data(name)
+        predictions = model.predict(model_registry.model_input(model, X_test))
+        _accuracy[key] = float(np.mean(predictions == np.asarray(y_test)))
+    return _accuracy[key]
+
+
+def _describe(name, version, path, model):
+    with _lock:
+        stats = dict(_version_stats(name, version))
+        latencies = np.array(stats.pop('latencies'))
+    seconds = stats.pop('seconds')
+    rows = stats['served_rows'] + stats['shadow_rows']
+    memory = model_registry.loaded_memory(path)
+    stats.update({
+        'version': version[:12],
+        'test_accuracy': round(test_accuracy(name, version, model), 4),
+        'memory_mib': None if memory is None else round(memory / 2**20, 2),
+        'us_per_row': round(seconds / rows * 1e6, 2) if rows else None,
+    })
+    if len(latencies):
+        stats['latency_p50_ms'] = round(float(np.percentile(latencies, 50)) * 1000, 3)
+        stats['latency_p99_ms'] = round(float(np.percentile(latencies, 99)) * 1000, 3)
+    return stats
+
+
+# Primary and candidate statistics and their disagreement, for the versions
+# currently on disk
+def report(name):
+    primary = model_registry.model_version(name)
+    candidate = candidate_version(name)
+    result = {
+        'model': name,
+        'canary_fraction': CANARY_FRACTION if candidate else 0.0,
+        'primary': _describe(name, primary, model_registry.model_path(name), model_registry.get_model(name)),
+        'candidate': None,
+    }
+    if candidate is None:
+        return result
+    result['candidate'] = _describe(name, candidate, candidate_path(name), get_candidate(name))
+    with _lock:
+        comparison = dict(_comparisons.get((name, primary, candidate),
+                                           {'rows': 0, 'disagreements': 0, 'abs_probability_diff': 0.0}))
+        result['shadow_dropped'] = _dropped.get(name, 0)
+    rows = comparison['rows']
+    result['comparison'] = {
+        'rows': rows,
+        'disagreements': comparison['disagreements'],
+        'disagreement_rate': round(comparison['disagreements'] / rows, 4) if rows else None,
+        'mean_abs_probability_diff': round(comparison['abs_probability_diff'] / rows, 6) if rows else None,
+    }
+    return result
+
+
+def shadow_stats():
+    return [report(name) for name in sorted(model_registry.ARTIFACTS)]
+
+
+# Stage model as the candidate for name, replacing any previous candidate,
+# together with its own calibration, fitted on its scores for the test split
+def stage(name, model, source=None, update=None):
+    import model_artifacts
+
+    fitted = calibration.fit_heldout_calibration(model, *model_registry.get_test_data(name))
+    return model_artifacts.export_artifact(
+        name, model, source, update=update, directory=candidate_dir(name),
+        before_swap=lambda manifest: calibration.write_calibration(
+            candidate_calibration_path(name), fitted, manifest['model_version']))
+
+
+def discard(name):
+    shutil.rmtree(candidate_dir(name), ignore_errors=True)
+
+
+# Make the candidate the served model (written like a trained model, with
+# fast scorer and metrics) and remove it from the candidate slot
+def promote(name):
+    import incremental
+
+    model = get_candidate(name)
+    if model is None:
+        raise ValueError(f'No candidate staged for {name}')
+    with open(os.path.join(candidate_dir(name), 'manifest.json')) as file:
+        update = json.load(file).get('update') or {}
+    update = {**update, 'parent_version': model_registry.model_version(name),
+              'candidate_version': candidate_version(name)}
+    manifest = incremental.promote(name, model, update)
+    discard(name)
+    return manifest
+
+
+#   python shadow.py stage <model> <model file>
+#   python shadow.py promote|discard <model>
+#   python shadow.py status [models]
+def main():
+    parser = argparse.ArgumentParser(description='Stage, compare and promote candidate models.')
+    parser.add_argument('command', choices=['stage', 'promote', 'discard', 'status'])
+    parser.add_argument('models', nargs='*', help='model name (stage: model name and model file)')
+    args = parser.parse_args()
+
+    if args.command == 'stage':
+        if len(args.models) != 2 or args.models[0] not in model_registry.ARTIFACTS:
+            parser.error('stage takes a model name and a .sav or .joblib model file')
+        name, path = args.models
+        manifest = stage(name, joblib.load(path), os.path.abspath(path))
+        print(f"{name}: staged candidate {manifest['model_version'][:12]}")
+        return
+
+    unknown = set(args.models) - set(model_registry.ARTIFACTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+    for name in args.models or sorted(model_registry.ARTIFACTS):
+        if args.command == 'promote':
+            print(f"{name}: promoted {promote(name)['model_version'][:12]}")
+        elif args.command == 'discard':
+            discard(name)
+            print(f'{name}: candidate discarded')
+        else:
+            print(json.dumps(report(name)))
+
+
+if __name__ == '__main__':
+    main()
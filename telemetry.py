@@ -0,0 +1,279 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Cold start phases (import, load, first_render) in seconds. Only the first
+# script run of the process is recorded; later reruns are warm.
+_phases = {}
+_cold_start = True
+
+
+def record_phase(name, seconds):
+    if _cold_start:
+        _phases[name] = _phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+def phase_seconds(name):
+    return _phases.get(name, 0.0)
+
+
+def in_cold_start():
+    return _cold_start
+
+
+# Called at the end of the first script run; later phases are not recorded
+def finish_cold_start():
+    global _cold_start
+    if _cold_start:
+        _cold_start = False
+        logger.info("Cold start: %s", json.dumps(startup_report()))
+
+
+def startup_report():
+    report = {name: round(seconds, 4) for name, seconds in _phases.items()}
+    report['total'] = round(sum(_phases.values()), 4)
+    return report
+
+
+# Hot path metrics, kept for the life of the process: duration histograms for
+# timed spans (rerun, load_model, predict, predict_proba, render) and event
+# counters, both keyed by name plus labels such as the model. Recording costs
+# a lock and a few additions, so spans can stay on in production.
+SPAN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_spans = {}
+_counters = {}
+_metrics_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def record_span(name, seconds, **labels):
+    with _metrics_lock:
+        span = _spans.get(_key(name, labels))
+        if span is None:
+            span = _spans[_key(name, labels)] = {
+                'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(SPAN_BUCKETS)}
+        span['count'] += 1
+        span['sum'] += seconds
+        span['max'] = max(span['max'], seconds)
+        for index, bound in enumerate(SPAN_BUCKETS):
+            if seconds <= bound:
+                span['buckets'][index] += 1
+                break
+
+
+@contextmanager
+def span(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start, **labels)
+
+
+def increment(name, amount=1, **labels):
+    with _metrics_lock:
+        _counters[_key(name, labels)] = _counters.get(_key(name, labels), 0) + amount
+
+
+def span_stats():
+    with _metrics_lock:
+        spans = [(key, dict(span)) for key, span in sorted(_spans.items())]
+    return [{
+        'span': name,
+        **dict(labels),
+        'count': span['count'],
+        'mean_ms': round(span['sum'] / span['count'] * 1000, 3),
+        'max_ms': round(span['max'] * 1000, 3),
+        'total_s': round(span['sum'], 4),
+    } for (name, labels), span in spans]
+
+
+def counter_stats():
+    with _metrics_lock:
+        return [{'counter': name, **dict(labels), 'value': value}
+                for (name, labels), value in sorted(_counters.items())]
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Memory gauges, read when exported: process RSS, estimated size of every
+# loaded model artifact and the number of cached predictions
+def memory_gauges():
+    import model_registry
+    import prediction_cache
+
+    gauges = [('process_resident_memory_bytes', {}, _rss_bytes())]
+    for stat in model_registry.registry_stats():
+        gauges.append(('model_memory_bytes', {'artifact': stat['artifact']},
+                       int(stat['memory_mib'] * 2**20)))
+    cache = prediction_cache._cache
+    if cache:
+        gauges.append(('prediction_cache_entries', {}, len(cache.backend)))
+    return gauges
+
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    values = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                      for key, value in labels.items())
+    return '{' + values + '}'
+
+
+# Everything above in the Prometheus text exposition format
+def prometheus_text(prefix='patient_app'):
+    with _metrics_lock:
+        spans = [(key, dict(span, buckets=list(span['buckets']))) for key, span in sorted(_spans.items())]
+        counters = sorted(_counters.items())
+    lines = [f'# TYPE {prefix}_span_seconds histogram']
+    for (name, labels), span in spans:
+        labels = dict(labels, span=name)
+        cumulative = 0
+        for bound, count in zip(SPAN_BUCKETS, span['buckets']):
+            cumulative += count
+            lines.append(f'{prefix}_span_seconds_bucket{_labels(labels, le=bound)} {cumulative}')
+        lines.append(f"{prefix}_span_seconds_bucket{_labels(labels, le='+Inf')} {span['count']}")
+        lines.append(f"{prefix}_span_seconds_sum{_labels(labels)} {span['sum']:.6f}")
+        lines.append(f"{prefix}_span_seconds_count{_labels(labels)} {span['count']}")
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f'# TYPE {prefix}_{name}_total counter')
+        lines.extend(f'{prefix}_{name}_total{_labels(dict(labels))} {value}'
+                     for (counter, labels), value in counters if counter == name)
+    gauges = memory_gauges()
+    for name in dict.fromkeys(name for name, _, _ in gauges):
+        lines.append(f'# TYPE {prefix}_{name} gauge')
+        lines.extend(f'{prefix}_{name}{_labels(labels)} {value}'
+                     for gauge, labels, value in gauges if gauge == name)
+    if _phases:
+        lines.append(f'# TYPE {prefix}_cold_start_seconds gauge')
+    for name, seconds in _phases.items():
+        lines.append(f'{prefix}_cold_start_seconds{_labels({"phase": name})} {seconds:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+# Sampling profiler for one thread (a Streamlit session's script run): a
+# daemon thread looks at the target's current stack every interval seconds
+# and counts each distinct stack, innermost frame last. Sampling costs the
+# profiled thread nothing between samples, unlike cProfile's per-call hooks.
+class SamplingProfiler:
+    def __init__(self, interval=0.005, thread_id=None, max_depth=40):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.samples[self._stack(frame)] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Most frequent stacks in the folded format flame graph tools read
+    def folded(self, limit=None):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common(limit))
+
+    # Functions by the share of samples spent in their own code (self) and
+    # with them anywhere on the stack (inclusive)
+    def top_functions(self, limit=15):
+        total = sum(self.samples.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.samples.items():
+            functions = [frame.rsplit(':', 1)[0] for frame in stack.split(';')]
+            own[functions[-1]] += count
+            for function in set(functions):
+                inclusive[function] += count
+        return [{'function': function, 'self': round(count / total, 3),
+                 'inclusive': round(inclusive[function] / total, 3)}
+                for function, count in own.most_common(limit)]
+
+
+# Headless cold start measurement for tracking regressions:
+#   python telemetry.py > startup.json
+# Renders main.py once in this fresh interpreter, then loads every model so
+# the per-model load cost is reported even though the Home page loads none.
+# The telemetry module is imported by name because main.py records into it,
+# not into this __main__ copy.
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    from streamlit.testing.v1 import AppTest
+
+    import model_registry
+    import telemetry
+
+    app = AppTest.from_file(os.path.join(here, 'main.py'), default_timeout=120)
+    app.run()
+    if app.exception:
+        raise SystemExit(app.exception[0].value)
+
+    models = {}
+    for name in model_registry.ARTIFACTS:
+        start = time.perf_counter()
+        model_registry.get_model(name)
+        model_registry.get_test_data(name)
+        models[name] = round(time.perf_counter() - start, 4)
+
+    print(json.dumps({'cold_start': telemetry.startup_report(), 'model_load': models}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import io
+
+import pandas as pd
+import pytest
+
+import model_registry
+from batch_scoring import score_csv
+
+FEATURES = model_registry.ARTIFACTS['heart']['features']
+
+
+def test_header_only_csv_gets_a_scored_header(tmp_path):
+    source = tmp_path / 'patients.csv'
+    source.write_text('patient_id,' + ','.join(FEATURES) + '\n')
+    destination = tmp_path / 'scored.csv'
+    summary = score_csv('heart', str(source), str(destination))
+    assert summary['rows'] == 0
+    assert list(pd.read_csv(destination).columns) == ['patient_id'] + FEATURES + ['prediction', 'probability']
+
+
+def test_header_only_csv_is_validated(tmp_path):
+    source = tmp_path / 'patients.csv'
+    source.write_text(','.join(FEATURES[:-1]) + '\n')
+    destination = tmp_path / 'scored.csv'
+    with pytest.raises(ValueError, match=FEATURES[-1]):
+        score_csv('heart', str(source), str(destination))
+    assert not destination.exists()
+
+
+def test_file_objects_are_scored_in_chunks():
+    X_test, _ = model_registry.get_test_data('heart')
+    source = io.BytesIO(X_test.iloc[:25].to_csv(index=False).encode('utf-8-sig'))
+    destination = io.StringIO()
+    summary = score_csv('heart', source, destination, chunksize=10, explain=True)
+    scored = pd.read_csv(io.StringIO(destination.getvalue()))
+    assert summary['rows'] == len(scored) == 25
+    assert list(scored.columns[-len(FEATURES):]) == [f'{feature}_contribution' for feature in FEATURES]
+    assert scored['probability'].between(0, 1).all()
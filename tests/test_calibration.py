@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import model_registry
+from batch_scoring import predict_frame
+from calibration import calibrate, get_calibration
+from fast_scorer import get_predictor
+
+
+@pytest.mark.parametrize('name', sorted(model_registry.ARTIFACTS))
+def test_labels_follow_calibrated_risk_on_test_split(name):
+    calibration = get_calibration(name)
+    assert calibration is not None, f'{name} has no calibration for its current version'
+    model = get_predictor(name)
+    features = model_registry.ARTIFACTS[name]['features']
+    X_test, _ = model_registry.get_test_data(name)
+    predictions, probabilities = predict_frame(model, X_test, features, calibration)
+    positive = np.asarray(predictions) == model.classes_[1]
+    assert np.array_equal(positive, np.asarray(probabilities) >= calibration['threshold'])
+
+
+@pytest.mark.parametrize('name', sorted(model_registry.ARTIFACTS))
+def test_all_zero_form_label_matches_risk(name):
+    calibration = get_calibration(name)
+    model = get_predictor(name)
+    features = model_registry.ARTIFACTS[name]['features']
+    zeros = pd.DataFrame([[0.0] * len(features)], columns=features)
+    predictions, probabilities = predict_frame(model, zeros, features, calibration)
+    assert (predictions[0] == model.classes_[1]) == (probabilities[0] >= calibration['threshold'])
+
+
+def test_duplicated_rows_count_once_and_stay_in_one_fold():
+    import train
+    from calibration import fit_calibration
+
+    X_train, X_test, y_train, y_test = train.split('diabetes')
+    X = pd.concat([X_train, X_train], ignore_index=True)
+    y = pd.concat([y_train, y_train], ignore_index=True)
+    calibration = fit_calibration(model_registry.get_model('diabetes'), X, y, X_test, y_test, n_jobs=1)
+    assert calibration['rows'] == 2 * len(X_train)
+    assert calibration['unique_rows'] == len(X_train)
+    assert calibration['method'] == 'sigmoid'
+    # Memorized duplicates would push the out-of-fold scores to 0 and 1
+    assert len(np.unique(np.round(calibrate(calibration, np.linspace(0, 1, 101)), 4))) > 50
+
+
+def test_saturated_operating_points_are_refused():
+    from calibration import _operating_points, decide, usable_points
+
+    y = np.array([0] * 10 + [1] * 30)
+    probabilities = np.where(y == 1, 1.0, 0.0)
+    points = _operating_points(probabilities, y)
+    assert points['recall_90']['saturated']
+    calibration = {'operating_points': points}
+    assert 'recall_90' not in usable_points(calibration)
+    with pytest.raises(ValueError, match='saturates'):
+        decide(calibration, probabilities, 'recall_90')
@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+import dataset_cache
+
+
+def _build(name):
+    return dataset_cache.build(name)['rows']
+
+
+def test_concurrent_builds_leave_one_complete_entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_cache, 'cache_dir', str(tmp_path))
+    with multiprocessing.get_context('fork').Pool(4) as pool:
+        rows = pool.map(_build, ['heart'] * 8)
+    assert len(set(rows)) == 1
+    assert os.listdir(tmp_path) == [os.path.basename(dataset_cache._current_entry('heart')[0])]
+    X, y = dataset_cache.load_dataset('heart')
+    assert len(X) == len(y) == rows[0]
+
+
+def test_rebuild_never_rewrites_a_mapped_entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_cache, 'cache_dir', str(tmp_path))
+    mapped = dataset_cache.load_columns('diabetes')['Glucose']
+    values = np.array(mapped)
+    directory = dataset_cache._current_entry('diabetes')[0]
+    inode = os.stat(os.path.join(directory, '1.npy')).st_ino
+    dataset_cache.build('diabetes')
+    assert os.stat(os.path.join(directory, '1.npy')).st_ino == inode
+    assert np.array_equal(mapped, values)
@@ -0,0 +1,13 @@
+import pytest
+
+import model_registry
+from fast_scorer import FastScorer, compile_model, verify
+
+
+@pytest.mark.parametrize('name', sorted(model_registry.ARTIFACTS))
+def test_compiled_scorer_matches_the_model(name):
+    model = model_registry.get_model(name)
+    report = verify(name, FastScorer(compile_model(model)), model)
+    assert report['rows'] > 0
+    assert report['prediction_mismatches'] == 0
+    assert report['ok'], report
@@ -0,0 +1,51 @@
+import pytest
+
+import feature_schema
+import model_registry
+
+FEATURES = model_registry.ARTIFACTS['heart']['features']
+
+
+def _records():
+    X_test, _ = model_registry.get_test_data('heart')
+    return X_test.iloc[:3].to_dict('records')
+
+
+def test_valid_records_are_returned_in_model_order():
+    records = [dict(reversed(record.items())) | {'patient_id': 7} for record in _records()]
+    X = feature_schema.validate('heart', records)
+    assert list(X.columns) == FEATURES
+    assert (X.dtypes == 'float64').all()
+
+
+def test_missing_features_are_named():
+    record = _records()[0]
+    del record['chol'], record['thal']
+    with pytest.raises(ValueError, match='missing heart features: chol, thal'):
+        feature_schema.validate('heart', record)
+
+
+def test_non_numeric_features_are_named():
+    records = _records()
+    records[1]['age'] = 'sixty'
+    with pytest.raises(ValueError, match='Non-numeric values in heart features: age$'):
+        feature_schema.validate('heart', records)
+
+
+def test_out_of_range_values_name_row_and_bounds():
+    records = _records()
+    records[2]['sex'] = 2
+    records[0]['chol'] = -1
+    records[1]['oldpeak'] = float('nan')
+    with pytest.raises(ValueError) as error:
+        feature_schema.validate('heart', records)
+    message = str(error.value)
+    assert 'row 2: sex=2.0 (allowed [0, 1])' in message
+    assert 'row 0: chol=-1.0 (allowed [0, inf])' in message
+    assert 'row 1: oldpeak=nan' in message
+
+
+def test_out_of_range_errors_are_capped():
+    records = [record | {'age': 200} for record in _records()]
+    with pytest.raises(ValueError, match=r'row 1: age=200\.0 .*and 1 more'):
+        feature_schema.validate('heart', records, max_errors=2)
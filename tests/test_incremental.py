@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import incremental
+import model_registry
+import train
+
+
+def _labelled(name, X, y):
+    return pd.concat([X, y.rename(model_registry.ARTIFACTS[name]['target'])], axis=1)
+
+
+def test_test_split_rows_are_dropped_before_the_gate():
+    X_test, y_test = model_registry.get_test_data('diabetes')
+    X_train, _, y_train, _ = train.split('diabetes')
+    rows = pd.concat([_labelled('diabetes', X_test.iloc[:10], y_test.iloc[:10]),
+                      _labelled('diabetes', X_train.iloc[:5], y_train.iloc[:5])], ignore_index=True)
+    report = incremental.update('diabetes', rows, dry_run=True)
+    assert report['dropped_test_rows'] == 10
+    assert report['rows'] == 5
+
+
+def test_only_test_split_rows_are_rejected():
+    X_test, y_test = model_registry.get_test_data('heart')
+    with pytest.raises(ValueError, match='test split'):
+        incremental.update('heart', _labelled('heart', X_test.iloc[:3], y_test.iloc[:3]), dry_run=True)
+
+
+def test_row_hashes_ignore_dtypes():
+    import dataset_cache
+
+    features = model_registry.ARTIFACTS['diabetes']['features']
+    cached, _ = dataset_cache.load_dataset('diabetes')
+    parsed = pd.read_csv(model_registry.dataset_path('diabetes'), encoding='utf-8-sig')[features]
+    assert (cached.dtypes != parsed.dtypes).any()
+    assert np.array_equal(train.row_hashes(cached), train.row_hashes(parsed))
+
+
+def test_candidate_calibration_describes_the_updated_model():
+    import calibration
+
+    X_train, _, y_train, _ = train.split('parkinsons')
+    model = model_registry.get_model('parkinsons')
+    candidate = incremental.update_model(model, X_train.iloc[:20], y_train.iloc[:20].to_numpy())
+    fitted = calibration.fit_heldout_calibration(candidate, *model_registry.get_test_data('parkinsons'))
+    assert fitted['scores'] == 'held_out'
+    assert fitted['test']['accuracy_raw'] == incremental.test_accuracy('parkinsons', candidate)
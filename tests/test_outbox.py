@@ -0,0 +1,86 @@
+import threading
+import time
+
+from outbox import PENDING, SENDING, SENT, Outbox, OutboxWorker
+
+
+class RecordingConnection:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+
+    def send(self, recipient, text):
+        time.sleep(self.delay)
+        self.sent.append((recipient, text))
+
+    def close(self):
+        pass
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_worker_keeps_delivering_after_unexpected_error(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.sqlite'))
+    worker = OutboxWorker(outbox, {'sender': 'app@example.com', 'recipient': 'team@example.com'},
+                          poll_seconds=0.05)
+    worker.connection = RecordingConnection()
+    drain = worker.drain
+    failures = []
+
+    def failing_drain():
+        if not failures:
+            failures.append(True)
+            raise ValueError('unexpected')
+        return drain()
+
+    worker.drain = failing_drain
+    first = outbox.enqueue('Ann', 'ann@example.com', 'Hello')
+    worker.start()
+    assert _wait_for(lambda: failures)
+    assert worker._thread.is_alive()
+
+    second = outbox.enqueue('Bob', 'bob@example.com', 'Hi')
+    worker.notify()
+    assert _wait_for(lambda: outbox.stats()[SENT] == 2)
+    assert len(worker.connection.sent) == 2
+    statuses = dict(outbox._connection().execute('SELECT id, status FROM messages'))
+    assert statuses == {first: SENT, second: SENT}
+    assert outbox.stats() == {'pending': 0, 'sending': 0, 'sent': 2, 'failed': 0}
+
+
+def test_workers_sharing_an_outbox_send_each_message_once(tmp_path):
+    path = str(tmp_path / 'outbox.sqlite')
+    settings = {'sender': 'app@example.com', 'recipient': 'team@example.com'}
+    ids = [Outbox(path).enqueue(f'Patient {index}', 'p@example.com', f'Message {index}') for index in range(60)]
+    workers = [OutboxWorker(Outbox(path), settings) for _ in range(3)]
+    for worker in workers:
+        worker.connection = RecordingConnection(delay=0.001)
+    threads = [threading.Thread(target=worker.drain) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    bodies = [text.split('Message: ')[-1].split('\n')[0] for worker in workers for _, text in worker.connection.sent]
+    assert sorted(bodies) == sorted(f'Message {index}' for index in range(60))
+    assert Outbox(path).stats()['sent'] == len(ids)
+
+
+def test_expired_claims_are_taken_over(tmp_path):
+    path = str(tmp_path / 'outbox.sqlite')
+    crashed = Outbox(path, lease_seconds=0.05)
+    message_id = crashed.enqueue('Ann', 'ann@example.com', 'Hello')
+    assert [row[0] for row in crashed.claim()] == [message_id]
+    other = Outbox(path)
+    assert other.claim() == []
+    assert other.stats()[SENDING] == 1
+    time.sleep(0.1)
+    assert [row[0] for row in other.claim()] == [message_id]
+    assert other.stats()[PENDING] == 0
@@ -0,0 +1,44 @@
+import model_registry
+import prediction_cache
+from prediction_cache import MemoryBackend, PredictionCache
+
+FEATURES = model_registry.ARTIFACTS['heart']['features']
+
+
+def _record(**overrides):
+    record = {feature: 1 for feature in FEATURES}
+    record.update(overrides)
+    return record
+
+
+def test_equal_records_share_a_key():
+    key = PredictionCache.key('heart', 'v1', _record(oldpeak=0.0))
+    assert PredictionCache.key('heart', 'v1', _record(oldpeak=-0.0)) == key
+    assert PredictionCache.key('heart', 'v1', {feature: 1.0 for feature in FEATURES} | {'oldpeak': 0}) == key
+    assert PredictionCache.key('heart', 'v1', {feature: '1' for feature in FEATURES} | {'oldpeak': '0'}) == key
+    assert PredictionCache.key('heart', 'v1', dict(reversed(_record(oldpeak=0).items()))) == key
+    assert PredictionCache.key('heart', 'v1', [1] * 9 + [0] + [1] * 3) == key
+    assert PredictionCache.key('heart', 'v1', _record(oldpeak=0.5)) != key
+    assert PredictionCache.key('heart', 'v2', _record(oldpeak=0)) != key
+
+
+def test_entries_are_dropped_when_the_model_or_calibration_changes(monkeypatch):
+    versions = {'model': 'a' * 64, 'calibration': 'c1'}
+    monkeypatch.setattr(model_registry, 'model_version', lambda name: versions['model'])
+    monkeypatch.setattr(prediction_cache, 'calibration_version', lambda name: versions['calibration'])
+    backend = MemoryBackend(100, 60)
+    cache = PredictionCache(backend)
+    record = _record()
+    cache.set('heart', record, (1, 0.9))
+    assert cache.get('heart', record) == (1, 0.9)
+
+    versions['calibration'] = 'c2'
+    assert cache.get('heart', record) is None
+    assert len(backend) == 0
+    cache.set('heart', record, (0, 0.4))
+    assert cache.get('heart', record) == (0, 0.4)
+
+    versions['model'] = 'b' * 64
+    assert cache.get('heart', record) is None
+    assert len(backend) == 0
+    assert cache.stats()['hits'] == 2
@@ -0,0 +1,17 @@
+import drift
+import model_registry
+import prediction_cache
+import screening
+
+
+def test_cached_screenings_are_observed_for_drift(monkeypatch):
+    observed = []
+    monkeypatch.setattr(drift, 'observe', lambda name, data: observed.append(name))
+    cache = prediction_cache.PredictionCache(prediction_cache.MemoryBackend(100, 60))
+    monkeypatch.setattr(prediction_cache, '_cache', cache)
+    record = {feature: 1.0 for feature in model_registry.ARTIFACTS['diabetes']['features']}
+    first = screening.screen_patient(record)
+    second = screening.screen_patient(record)
+    assert first == second
+    assert cache.hits == 1
+    assert observed == ['diabetes', 'diabetes']
@@ -0,0 +1,217 @@
+import argparse
+import itertools
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import VotingClassifier
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+import calibration
+import dataset_cache
+import evaluation
+import model_artifacts
+import model_registry
+
+# Reproducible replacement for the training notebooks. Every model is
+# trained from Datasets/ with the notebooks' 80/20 stratified split
+# (random_state=2), tuned by cross-validated grid search run in parallel
+# with joblib, and written to Saved models/ together with its test split,
+# versioned artifact, fast scorer, metrics and calibration.
+# The CSVs repeat most of their rows (diabetes has 768 distinct rows out of
+# 3074, heart 302 of 1818, parkinsons 195 of 585), so rows are deduplicated
+# on features and target before the split: otherwise nearly every test and
+# cross-validation row is also a training row, and the metrics, calibration
+# and hyperparameter choice all reward memorizing rows.
+RANDOM_STATE = 2
+TEST_SIZE = 0.2
+
+
+# Distinct rows of a dataset, in first-seen order
+def unique_rows(X, y):
+    keep = ~pd.concat([X, y], axis=1).duplicated().to_numpy()
+    return X[keep].reset_index(drop=True), y[keep].reset_index(drop=True)
+
+
+# Hash of each row's feature values, independent of the column dtypes, for
+# recognizing rows that are already in a split
+def row_hashes(X):
+    return pd.util.hash_pandas_object(X.astype(np.float64), index=False).to_numpy()
+
+
+# The train/test split of a dataset's distinct rows:
+# X_train, X_test, y_train, y_test
+def split(name):
+    X, y = unique_rows(*dataset_cache.load_dataset(name))
+    return train_test_split(X, y, test_size=TEST_SIZE, stratify=y, random_state=RANDOM_STATE)
+
+
+# The hybrid models the app serves, now with the scaler saved in the model
+def build_estimator(name):
+    if name == 'heart':
+        return Pipeline([('scaler', StandardScaler()), ('svc', SVC(probability=True, random_state=RANDOM_STATE))])
+    hybrid = VotingClassifier([
+        ('knn', KNeighborsClassifier()),
+        ('svm', SVC(kernel='linear', probability=True, random_state=RANDOM_STATE)),
+    ], voting='soft')
+    return Pipeline([('scaler', StandardScaler()), ('hybrid', hybrid)])
+
+
+PARAM_GRIDS = {
+    'diabetes': {
+        'hybrid__knn__n_neighbors': [3, 5, 7, 9],
+        'hybrid__svm__C': [0.1, 1, 10],
+    },
+    'heart': {
+        'svc__C': [0.1, 1, 10],
+        'svc__gamma': ['scale', 0.01, 0.1],
+    },
+    'parkinsons': {
+        'hybrid__knn__n_neighbors': [3, 5, 7, 9],
+        'hybrid__svm__C': [0.1, 1, 10],
+    },
+}
+
+
+def candidates(name):
+    grid = PARAM_GRIDS[name]
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+# Fit one candidate on one fold; returns its accuracy and timings
+def _fit_fold(estimator, params, X, y, train_index, test_index):
+    model = clone(estimator).set_params(**params)
+    start = time.perf_counter()
+    model.fit(X.iloc[train_index], y.iloc[train_index])
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    score = model.score(X.iloc[test_index], y.iloc[test_index])
+    return {'fit_seconds': fit_seconds, 'score_seconds': time.perf_counter() - start, 'score': score}
+
+
+# Grid search where every (candidate, fold) pair is a separate joblib task,
+# so all cores stay busy and each fold's timing is recorded
+def search(name, X, y, folds=5, n_jobs=-1):
+    estimator = build_estimator(name)
+    grid = candidates(name)
+    splits = list(StratifiedKFold(folds, shuffle=True, random_state=RANDOM_STATE).split(X, y))
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_fold)(estimator, params, X, y, train_index, test_index)
+        for params in grid for train_index, test_index in splits)
+
+    report = []
+    for index, params in enumerate(grid):
+        fold_results = results[index * folds:(index + 1) * folds]
+        report.append({
+            'params': params,
+            'mean_score': sum(fold['score'] for fold in fold_results) / folds,
+            'folds': [{key: round(value, 4) for key, value in fold.items()} for fold in fold_results],
+        })
+    best = max(report, key=lambda candidate: candidate['mean_score'])
+    return clone(estimator).set_params(**best['params']), best, report
+
+
+def train_model(name, folds=5, n_jobs=-1):
+    start = time.perf_counter()
+    X_train, X_test, y_train, y_test = split(name)
+    model, best, report = search(name, X_train, y_train, folds, n_jobs)
+    model.fit(X_train, y_train)
+    return {
+        'name': name,
+        'model': model,
+        'test_data': (X_test, y_test),
+        'calibration': calibration.fit_calibration(model, X_train, y_train, X_test, y_test, folds, n_jobs),
+        'best_params': best['params'],
+        'cv_score': round(best['mean_score'], 4),
+        'test_score': round(model.score(X_test, y_test), 4),
+        'candidates': report,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def _dump(obj, path, dump):
+    with open(f'{path}.tmp', 'wb') as file:
+        dump(obj, file)
+    os.replace(f'{path}.tmp', path)
+
+
+# Write everything main.py and the API read for one trained model
+def save_result(result):
+    import fast_scorer
+
+    name = result['name']
+    _dump(result['model'], model_registry.artifact_path(name, 'model'), pickle.dump)
+    _dump(result['test_data'], model_registry.artifact_path(name, 'test_data'), pickle.dump)
+    # The calibration is written before the new model is swapped in, so the
+    # model is never served without it
+    model_artifacts.export_artifact(
+        name, result['model'], model_registry.artifact_path(name, 'model'),
+        before_swap=lambda manifest: calibration.write_calibration(
+            calibration.calibration_path(name), result['calibration'], manifest['model_version']))
+    try:
+        fast_scorer.compile_and_save(name)
+    except (TypeError, ValueError) as e:
+        print(f'{name}: fast scorer not compiled ({e})')
+    evaluation.write_metrics(name, evaluation.compute_metrics(name))
+
+
+# Train the given models. In parallel mode each disease gets its own process
+# and the cores are split between their grid searches; serial mode trains
+# one model at a time on a single core.
+def train_all(names, folds=5, parallel=True):
+    start = time.perf_counter()
+    if parallel and len(names) > 1:
+        n_jobs = max(1, (os.cpu_count() or 1) // len(names))
+        with ProcessPoolExecutor(len(names)) as pool:
+            results = list(pool.map(train_model, names, [folds] * len(names), [n_jobs] * len(names)))
+    else:
+        results = [train_model(name, folds, -1 if parallel else 1) for name in names]
+    return results, time.perf_counter() - start
+
+
+#   python train.py                    train and save all three models
+#   python train.py heart --folds 10   train one model
+#   python train.py --compare          also time a serial run and report the speedup
+def main():
+    parser = argparse.ArgumentParser(description='Train the disease models from Datasets/.')
+    parser.add_argument('models', nargs='*', help='default: all models')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--serial', action='store_true', help='train one model at a time on one core')
+    parser.add_argument('--compare', action='store_true', help='also run serially and report the speedup')
+    parser.add_argument('--report', help='write the per-candidate, per-fold search report to this JSON file')
+    args = parser.parse_args()
+    names = args.models or sorted(model_registry.ARTIFACTS)
+    unknown = set(names) - set(model_registry.ARTIFACTS)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+
+    results, seconds = train_all(names, args.folds, parallel=not args.serial)
+    for result in results:
+        save_result(result)
+        print(f"{result['name']}: cv={result['cv_score']} test={result['test_score']} "
+              f"params={result['best_params']} ({result['seconds']}s)")
+    print(f"{'serial' if args.serial else 'parallel'} wall clock: {seconds:.2f}s on {os.cpu_count()} cores")
+
+    if args.compare:
+        _, serial_seconds = train_all(names, args.folds, parallel=False)
+        print(f'serial wall clock: {serial_seconds:.2f}s, speedup {serial_seconds / seconds:.2f}x')
+
+    if args.report:
+        report = {result['name']: {key: value for key, value in result.items()
+                                   if key not in ('model', 'test_data', 'calibration')} for result in results}
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()